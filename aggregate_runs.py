@@ -0,0 +1,233 @@
+import sys, os, time, csv, math
+from glob import glob
+from datetime import datetime
+
+import pandas as pd
+import scipy.stats
+
+from manifest import get_file_hash
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+METHODS = [
+            'undirdir',
+            'pagerank',
+            'outdirdir',
+            'pagerank_unrecorded'
+        ]
+# directory (under each method directory) holding the per-run csv files for each measure
+MEASURE_DIRS = {
+        'rank_mean': 'rank_mean',
+        'size_mean': 'size_mean',
+        'depth_mean': 'depth_mean',
+        'size_counts': 'size_and_depth_counts',
+        'depth_counts': 'size_and_depth_counts',
+        }
+# for counts, a key missing from a run counts as 0 (as the reindex(...).fillna(0) in plot_size_and_depth_counts.ipynb)
+FILL_MISSING = set(['size_counts', 'depth_counts'])
+
+SUMMARY_HEADER = ['method', 'measure', 'key', 'n', 'mean', 'm2', 'sem', 'conf_lower', 'conf_upper']
+
+def get_run_fnames(basedir, method, measure):
+    return sorted(glob(os.path.join(basedir, method, MEASURE_DIRS[measure], "*-{}.csv".format(measure))))
+
+def parse_key(key):
+    try:
+        return int(key)
+    except ValueError:
+        try:
+            return float(key)
+        except ValueError:
+            return key
+
+def read_run(fname):
+    """Read one per-run csv file (key, value), with or without a header
+
+    :returns: dict {key: value}
+
+    """
+    d = {}
+    with open(fname, 'r') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[1]:
+                continue
+            try:
+                val = float(row[1])
+            except ValueError:
+                # header
+                continue
+            d[parse_key(row[0])] = val
+    return d
+
+class RunAggregator(object):
+    """One-pass (Welford) mean and variance across runs for every (method, measure, key)
+
+    State is saved to a summary csv, and the runs already folded in are listed in '<summary>.runs',
+    so new runs can be added later without re-reading the old ones. The two files are replaced one
+    after the other, so '.runs' records the hash of its summary: if a save was interrupted between
+    them, load finds that they don't match and starts over, and every run is folded in again.
+
+    """
+    def __init__(self):
+        # (method, measure, key): [n, mean, m2]
+        self.stats = {}
+        # (method, measure): set of keys seen
+        self.keys = {}
+        # (method, measure): number of runs folded in
+        self.num_runs = {}
+        self.runs = set()
+
+    def add_value(self, method, measure, key, x):
+        stat = self.stats.get((method, measure, key))
+        if stat is None:
+            stat = [0, 0.0, 0.0]
+            if measure in FILL_MISSING:
+                # all of the previous runs had 0 for this key
+                stat[0] = self.num_runs.get((method, measure), 0)
+            self.stats[(method, measure, key)] = stat
+            self.keys.setdefault((method, measure), set()).add(key)
+        stat[0] += 1
+        delta = x - stat[1]
+        stat[1] += delta / stat[0]
+        stat[2] += delta * (x - stat[1])
+
+    def add_run(self, method, measure, values, run_id=None):
+        """Fold one run into the aggregate
+
+        :values: dict {key: value} for the run
+        :run_id: identifier (e.g. filename) recorded so the run is not added twice
+
+        """
+        if run_id is not None:
+            if run_id in self.runs:
+                return False
+            self.runs.add(run_id)
+        for key, x in values.items():
+            self.add_value(method, measure, key, x)
+        if measure in FILL_MISSING:
+            for key in self.keys.get((method, measure), set()):
+                if key not in values:
+                    self.add_value(method, measure, key, 0.0)
+        self.num_runs[(method, measure)] = self.num_runs.get((method, measure), 0) + 1
+        return True
+
+    def add_run_fname(self, method, measure, fname):
+        run_id = os.path.abspath(fname)
+        if run_id in self.runs:
+            return False
+        return self.add_run(method, measure, read_run(fname), run_id=run_id)
+
+    def summary_rows(self, confidence=.9):
+        rows = []
+        for (method, measure, key) in sorted(self.stats, key=lambda x: (x[0], x[1], str(type(x[2])), x[2])):
+            n, mean, m2 = self.stats[(method, measure, key)]
+            if n > 1:
+                sem = math.sqrt(m2 / (n - 1) / n)
+                half = scipy.stats.t.ppf((1 + confidence) / 2., n - 1) * sem
+            else:
+                # with one run the interval is just the mean (as the fillna(val) in the plotting notebooks)
+                sem = float('nan')
+                half = 0.0
+            rows.append([method, measure, key, n, mean, m2, sem, mean - half, mean + half])
+        return rows
+
+    def save(self, outfname, confidence=.9):
+        tmpfname = "{}.tmp{}".format(outfname, os.getpid())
+        with open(tmpfname, 'w') as outf:
+            writer = csv.writer(outf, lineterminator='\n')
+            writer.writerow(SUMMARY_HEADER)
+            for row in self.summary_rows(confidence):
+                writer.writerow(row)
+        with open(tmpfname + '.runs', 'w') as outf:
+            writer = csv.writer(outf, lineterminator='\n')
+            writer.writerow(['#summary', get_file_hash(tmpfname)])
+            for (method, measure), n in sorted(self.num_runs.items()):
+                writer.writerow(['#', method, measure, n])
+            for run_id in sorted(self.runs):
+                writer.writerow([run_id])
+        os.rename(tmpfname + '.runs', outfname + '.runs')
+        os.rename(tmpfname, outfname)
+        logger.debug("Wrote summary: {}".format(outfname))
+
+    @classmethod
+    def load(cls, fname):
+        """Load the state saved by save. Returns an empty aggregator if there is no summary yet,
+        or if the summary and its run list are not from the same save"""
+        agg = cls()
+        if not os.path.exists(fname):
+            return agg
+        if not runs_match_summary(fname):
+            logger.warning("{} does not match {}.runs (interrupted save?). Recomputing from all runs".format(fname, fname))
+            return agg
+        with open(fname, 'r') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                method, measure, key, n, mean, m2 = row[:6]
+                key = parse_key(key)
+                agg.stats[(method, measure, key)] = [int(n), float(mean), float(m2)]
+                agg.keys.setdefault((method, measure), set()).add(key)
+        with open(fname + '.runs', 'r') as f:
+            for row in csv.reader(f):
+                if row[0] == '#summary':
+                    continue
+                elif row[0] == '#':
+                    agg.num_runs[(row[1], row[2])] = int(row[3])
+                else:
+                    agg.runs.add(row[0])
+        return agg
+
+def runs_match_summary(fname):
+    """True if '<fname>.runs' was saved with the summary fname (see RunAggregator.save)"""
+    if not os.path.exists(fname + '.runs'):
+        return False
+    with open(fname + '.runs', 'r') as f:
+        row = next(csv.reader(f), None)
+    # run lists saved before the hash was recorded are taken as they are
+    if not row or row[0] != '#summary':
+        return True
+    return row[1] == get_file_hash(fname)
+
+def load_summary(fname):
+    """Load a summary file as a DataFrame (for the plotting notebooks)"""
+    return pd.read_csv(fname)
+
+def main(args):
+    agg = RunAggregator.load(args.outfname)
+    num_added = 0
+    for method in args.methods:
+        for measure in args.measures:
+            fnames = get_run_fnames(args.basedir, method, measure)
+            added = 0
+            for fname in fnames:
+                if agg.add_run_fname(method, measure, fname):
+                    added += 1
+            logger.debug("{} {}: {} runs, {} new".format(method, measure, len(fnames), added))
+            num_added += added
+    logger.info("Folded in {} new runs".format(num_added))
+    agg.save(args.outfname, confidence=args.confidence)
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Aggregate the per-run csv files (rank_mean, size_counts, etc.) across runs into one summary csv with the mean, standard error and confidence interval for each (method, measure, key). Runs already in the summary are not re-read")
+    parser.add_argument("-o", "--outfname", default='runs_summary.csv', help="summary csv filename. if it exists, new runs are folded into it")
+    parser.add_argument("--basedir", default='.', help="directory containing the method directories (default: current directory)")
+    parser.add_argument("--methods", nargs='+', default=METHODS, help="methods to aggregate (default: {})".format(" ".join(METHODS)))
+    parser.add_argument("--measures", nargs='+', default=sorted(MEASURE_DIRS), help="measures to aggregate (default: all)")
+    parser.add_argument("--confidence", type=float, default=.9, help="confidence level for the intervals (default: .9)")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
@@ -0,0 +1,227 @@
+import sys, os, time, json, platform, subprocess, tempfile, shutil
+from collections import OrderedDict
+from datetime import datetime
+import multiprocessing
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compare_vi'))
+from synthetic_tree import write_workload, parse_weights, DEPTH_WEIGHTS
+from get_means_from_tree import get_pubyear, analyze_tree, analyze_tree_vectorized
+from pubyear_index import build_pubyear_index
+from get_size_and_depth_from_tree import analyze_treefile
+from vi_compare import parse_tree, get_vi_from_fnames, get_vi_matrix
+from profiling import get_peak_rss
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# bump when the benchmarks or the output format change, so results are only compared like with like
+BENCHMARK_VERSION = 1
+
+# Each benchmark takes the workload (dict {pubyear_fname, fnames, num_nodes}), does its own setup
+# and returns (seconds taken by the timed call, number of nodes processed)
+
+def bench_get_pubyear(workload):
+    start = time.time()
+    get_pubyear(workload['pubyear_fname'])
+    return time.time() - start, workload['num_nodes']
+
+def bench_build_pubyear_index(workload):
+    start = time.time()
+    build_pubyear_index(workload['pubyear_fname'])
+    return time.time() - start, workload['num_nodes']
+
+def bench_analyze_tree(workload):
+    pubyear = get_pubyear(workload['pubyear_fname'])
+    start = time.time()
+    analyze_tree(workload['fnames'][0], pubyear)
+    return time.time() - start, workload['num_nodes']
+
+def bench_analyze_tree_vectorized(workload):
+    pubyear = build_pubyear_index(workload['pubyear_fname'])
+    start = time.time()
+    analyze_tree_vectorized(workload['fnames'][0], pubyear)
+    return time.time() - start, workload['num_nodes']
+
+def bench_analyze_treefile(workload):
+    start = time.time()
+    analyze_treefile(workload['fnames'][0])
+    return time.time() - start, workload['num_nodes']
+
+def bench_parse_tree(workload):
+    start = time.time()
+    parse_tree(workload['fnames'][0])
+    return time.time() - start, workload['num_nodes']
+
+def bench_get_vi_from_fnames(workload):
+    start = time.time()
+    get_vi_from_fnames(workload['fnames'][0], workload['fnames'][1])
+    return time.time() - start, 2 * workload['num_nodes']
+
+def bench_get_vi_matrix(workload):
+    start = time.time()
+    get_vi_matrix(workload['fnames'])
+    return time.time() - start, len(workload['fnames']) * workload['num_nodes']
+
+BENCHMARKS = OrderedDict([
+        ('get_pubyear', bench_get_pubyear),
+        ('build_pubyear_index', bench_build_pubyear_index),
+        ('analyze_tree', bench_analyze_tree),
+        ('analyze_tree_vectorized', bench_analyze_tree_vectorized),
+        ('analyze_treefile', bench_analyze_treefile),
+        ('parse_tree', bench_parse_tree),
+        ('get_vi_from_fnames', bench_get_vi_from_fnames),
+        ('get_vi_matrix', bench_get_vi_matrix),
+        ])
+
+def run_benchmark(job):
+    """Run one benchmark (in a fresh worker process, so the peak RSS is its own)
+
+    :job: (benchmark name, workload)
+    :returns: (seconds, number of nodes, peak RSS in MB before the run, peak RSS in MB after)
+
+    """
+    name, workload = job
+    rss_before = get_peak_rss()
+    took, num_nodes = BENCHMARKS[name](workload)
+    return took, num_nodes, rss_before, get_peak_rss()
+
+def run_isolated(job):
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_benchmark, (job,))
+    finally:
+        pool.close()
+        pool.join()
+
+def run_benchmarks(workload, names=None, repeat=3):
+    """Time each benchmark on a workload
+
+    :names: names of the benchmarks to run (default: all of BENCHMARKS)
+    :repeat: number of runs of each benchmark. the best time and the highest peak RSS are reported
+    :returns: OrderedDict {name: {seconds, times, nodes, nodes_per_sec, peak_rss_mb, base_rss_mb}}
+
+    """
+    results = OrderedDict()
+    for name in names or BENCHMARKS:
+        if name in ('get_vi_from_fnames', 'get_vi_matrix') and len(workload['fnames']) < 2:
+            logger.warning("{} needs at least 2 trees. skipping".format(name))
+            continue
+        times = []
+        peak_rss = base_rss = 0
+        for _ in range(repeat):
+            took, num_nodes, rss_before, rss_after = run_isolated((name, workload))
+            times.append(took)
+            peak_rss = max(peak_rss, rss_after)
+            base_rss = max(base_rss, rss_before)
+        best = min(times)
+        results[name] = {
+                'seconds': best,
+                'times': times,
+                'nodes': num_nodes,
+                'nodes_per_sec': num_nodes / best if best else None,
+                'peak_rss_mb': peak_rss,
+                'base_rss_mb': base_rss,
+                }
+        logger.info("{}: {:.3f} seconds ({:.0f} nodes/sec), peak RSS {:.1f} MB".format(name, best, num_nodes / best if best else float('inf'), peak_rss))
+    return results
+
+def get_git_revision():
+    """Commit of the code being benchmarked, or None outside a git checkout"""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            out = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('ascii').strip()
+
+def get_environment():
+    return {
+            'revision': get_git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': multiprocessing.cpu_count(),
+            }
+
+def compare_results(old, new):
+    """Log the change of each benchmark between two result files (as written by main)
+
+    :returns: dict {name: new seconds / old seconds}
+
+    """
+    if old.get('benchmark_version') != new.get('benchmark_version') or old.get('params') != new.get('params'):
+        logger.warning("results were made with different benchmark versions or parameters")
+    ratios = {}
+    for name, result in new['results'].items():
+        if name not in old['results'] or not old['results'][name]['seconds']:
+            continue
+        ratios[name] = result['seconds'] / old['results'][name]['seconds']
+        logger.info("{}: {:.3f} -> {:.3f} seconds ({:.2f}x), peak RSS {:.1f} -> {:.1f} MB".format(name, old['results'][name]['seconds'], result['seconds'], ratios[name], old['results'][name]['peak_rss_mb'], result['peak_rss_mb']))
+    return ratios
+
+def main(args):
+    params = OrderedDict([
+        ('num_nodes', args.num_nodes),
+        ('num_trees', args.num_trees),
+        ('depth_weights', args.depth_weights),
+        ('module_size', args.module_size),
+        ('seed', args.seed),
+        ('repeat', args.repeat),
+        ])
+    workdir = args.workdir or tempfile.mkdtemp(prefix='tree_benchmark_')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    try:
+        start = time.time()
+        pubyear_fname, fnames = write_workload(workdir, args.num_nodes, args.num_trees, parse_weights(args.depth_weights), args.module_size, args.seed)
+        logger.info("Wrote {} synthetic trees of {} nodes in {}. Took {:.2f} seconds".format(len(fnames), args.num_nodes, workdir, time.time() - start))
+        workload = {'pubyear_fname': pubyear_fname, 'fnames': fnames, 'num_nodes': args.num_nodes}
+        results = run_benchmarks(workload, args.benchmarks, args.repeat)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+    out = OrderedDict([
+        ('benchmark_version', BENCHMARK_VERSION),
+        ('time', '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now())),
+        ('environment', get_environment()),
+        ('params', params),
+        ('results', results),
+        ])
+    if args.output:
+        with open(args.output, 'w') as outf:
+            json.dump(out, outf, indent=1)
+        logger.info("Wrote results to {}".format(args.output))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare_results(json.load(f), out)
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Time the analysis entry points on synthetic tree files (see synthetic_tree.py) and output the throughput and peak memory of each as json")
+    parser.add_argument("-o", "--output", type=str, help="output filename (json)")
+    parser.add_argument("--compare", type=str, help="results of an earlier run (json) to compare against")
+    parser.add_argument("-n", "--num-nodes", type=int, default=100000, help="number of nodes in each tree")
+    parser.add_argument("--num-trees", type=int, default=4, help="number of trees for the all-pairs VI benchmark (the others use the first one or two)")
+    parser.add_argument("--depth-weights", type=str, default=",".join(str(x) for x in DEPTH_WEIGHTS), help="comma-separated relative frequency of each leaf depth, starting at depth 1")
+    parser.add_argument("--module-size", type=float, default=20, help="mean number of leaves in a module")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the synthetic trees")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each benchmark (the best time is reported)")
+    parser.add_argument("--benchmarks", nargs='+', choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--workdir", type=str, help="directory for the synthetic trees, kept afterwards (default: a temporary directory)")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
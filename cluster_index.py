@@ -0,0 +1,240 @@
+import sys, os, time
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from tree_reader import read_tree_chunks
+from profiling import stage
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROOT = 0
+
+class ClusterIndex(object):
+    """Dense integer IDs for the modules of a tree, stored as a prefix trie
+
+    Every module path (e.g. '3:17:2') and all of its prefixes get an ID. Cluster ROOT (0) is the
+    whole network: the module of top-level nodes, whose path is empty. For each ID the index
+    keeps the parent's ID, the last component of the path and the depth (number of components),
+    so analyzers can key their counts by int instead of by the colon-joined path.
+
+    """
+    def __init__(self):
+        self.parent = array('i', [-1])
+        self.component = array('i', [0])
+        self.depth = array('h', [0])
+        # (parent ID << 32) + component: ID
+        self.children = {}
+        self._last_module = None
+        self._last_id = ROOT
+        self._last_head = None
+        self._last_head_id = ROOT
+        self._ancestors = None
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add_module(self, module):
+        """Get the ID of a module path, adding it (and its prefixes) if it is new
+
+        :module: module path, as str or bytes (e.g. '3:17:2'). '' is ROOT
+        :returns: cluster ID
+
+        """
+        # nodes of the same module, and sibling modules, are next to each other in a tree file
+        if module == self._last_module:
+            return self._last_id
+        if not module:
+            return ROOT
+        sep = b':' if isinstance(module, bytes) else ':'
+        head, _, tail = module.rpartition(sep)
+        if head == self._last_head:
+            cid = self.get_child(self._last_head_id, tail)
+        else:
+            cid = ROOT
+            if head:
+                for x in head.split(sep):
+                    cid = self.get_child(cid, x)
+            self._last_head = head
+            self._last_head_id = cid
+            if tail:
+                cid = self.get_child(cid, tail)
+        self._last_module = module
+        self._last_id = cid
+        return cid
+
+    def get_child(self, cid, x):
+        """ID of the submodule x (a path component) of cluster cid, added if it is new"""
+        x = int(x)
+        key = (cid << 32) + x
+        child = self.children.get(key)
+        if child is None:
+            child = len(self.parent)
+            self.children[key] = child
+            self.parent.append(cid)
+            self.component.append(x)
+            self.depth.append(self.depth[cid] + 1)
+            self._ancestors = None
+        return child
+
+    def add_modules(self, modules):
+        """int32 array of the IDs of a list of module paths (see add_module)"""
+        with stage('cluster_index') as stats:
+            stats.add(nodes=len(modules))
+            return np.fromiter((self.add_module(module) for module in modules), dtype=np.int32, count=len(modules))
+
+    def get_path(self, cid):
+        """Module path of a cluster ID (str)"""
+        components = []
+        while cid != ROOT:
+            components.append(str(self.component[cid]))
+            cid = self.parent[cid]
+        return ":".join(reversed(components))
+
+    def arrays(self):
+        """The index as arrays: {parent: int32, component: int32, depth: int16}, indexed by cluster ID"""
+        return {
+                'parent': np.frombuffer(self.parent, dtype=np.int32).copy(),
+                'component': np.frombuffer(self.component, dtype=np.int32).copy(),
+                'depth': np.frombuffer(self.depth, dtype=np.int16).copy(),
+                }
+
+    @classmethod
+    def from_arrays(cls, parent, component):
+        """Rebuild an index from the parent and component arrays (e.g. saved in a tree cache)"""
+        index = cls()
+        index.add_clusters(parent, component)
+        return index
+
+    def add_clusters(self, parent, component):
+        """Add the clusters of another index (e.g. one built by a worker on part of the tree)
+
+        :parent, component: arrays of the other index (see arrays)
+        :returns: int32 array mapping the other index's cluster IDs to IDs in this index
+
+        """
+        parent = np.asarray(parent).tolist()
+        component = np.asarray(component).tolist()
+        id_map = [ROOT] * len(parent)
+        # parents have lower IDs than their children, so they are mapped first
+        for cid in range(1, len(parent)):
+            id_map[cid] = self.get_child(id_map[parent[cid]], component[cid])
+        return np.array(id_map, dtype=np.int32)
+
+    def ancestor_table(self):
+        """Ancestor of every cluster at every depth
+
+        :returns: int32 array of shape (max depth, number of clusters). row l is each cluster's
+                  ancestor at depth l + 1, or the cluster itself if it is not that deep. row
+                  (depth - 1) of a cluster is its own ID
+
+        """
+        if self._ancestors is not None and self._ancestors.shape[1] == len(self):
+            return self._ancestors
+        parent = np.frombuffer(self.parent, dtype=np.int32).copy()
+        depth = np.frombuffer(self.depth, dtype=np.int16).copy()
+        max_depth = int(depth.max())
+        table = np.zeros((max_depth, len(parent)), dtype=np.int32)
+        for d in range(1, max_depth + 1):
+            ids = np.flatnonzero(depth == d)
+            # parents are one level up, so their rows are already filled in
+            table[:, ids] = table[:, parent[ids]]
+            table[d-1:, ids] = ids
+        self._ancestors = table
+        return table
+
+    def get_ancestors(self, ids, level):
+        """Ancestor at a given depth of each cluster in ids (O(1) per cluster, see ancestor_table)
+
+        :ids: array of cluster IDs
+        :level: depth of the ancestors. 0 is ROOT. clusters not that deep are their own ancestor
+        :returns: int32 array of cluster IDs
+
+        """
+        ids = np.asarray(ids)
+        if level == 0 or len(self) == 1:
+            return np.zeros(len(ids), dtype=np.int32)
+        table = self.ancestor_table()
+        level = min(level, len(table))
+        return table[level - 1][ids]
+
+    def get_sizes(self, ids):
+        """Number of nodes directly in each cluster
+
+        :ids: module ID of each node
+        :returns: int64 array indexed by cluster ID
+
+        """
+        return np.bincount(np.asarray(ids, dtype=np.int64), minlength=len(self))
+
+    def get_subtree_sizes(self, ids):
+        """Number of nodes in each cluster, including the nodes of its submodules
+
+        :ids: module ID of each node
+        :returns: int64 array indexed by cluster ID (ROOT has every node)
+
+        """
+        sizes = self.get_sizes(ids)
+        parent = np.frombuffer(self.parent, dtype=np.int32).copy()
+        depth = np.frombuffer(self.depth, dtype=np.int16).copy()
+        for d in range(int(depth.max()), 0, -1):
+            children = np.flatnonzero(depth == d)
+            sizes += np.bincount(parent[children], weights=sizes[children], minlength=len(sizes)).astype(sizes.dtype)
+        return sizes
+
+    def get_level_sizes(self, ids, level):
+        """Number of nodes in each cluster at a given depth (clusters not that deep keep their own nodes)
+
+        :ids: module ID of each node
+        :returns: int64 array indexed by cluster ID, nonzero only for the clusters of that level
+
+        """
+        return np.bincount(self.get_ancestors(ids, level), minlength=len(self))
+
+def index_tree(fname):
+    """Read a tree file and give each node's module an ID
+
+    :returns: (ClusterIndex, pid: int64 array, module: int32 array of the module ID of each node)
+
+    """
+    index = ClusterIndex()
+    pid = []
+    module = []
+    for chunk in read_tree_chunks(fname):
+        pid.append(chunk['pid'])
+        module.append(index.add_modules(chunk['module']))
+    pid = np.concatenate(pid) if pid else np.array([], dtype=np.int64)
+    module = np.concatenate(module) if module else np.array([], dtype=np.int32)
+    return index, pid, module
+
+def main(args):
+    index, pid, module = index_tree(args.tree_fname)
+    sizes = index.get_sizes(module)
+    subtree_sizes = index.get_subtree_sizes(module)
+    depth = np.array(index.depth)
+    logger.info("{} nodes, {} modules with nodes, {} clusters in the hierarchy".format(len(pid), (sizes > 0).sum(), len(index)))
+    for level in range(1, int(depth.max()) + 1):
+        at_level = depth == level
+        logger.info("depth {}: {} clusters, largest has {} nodes".format(level, at_level.sum(), subtree_sizes[at_level].max()))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Index the module hierarchy of a .tree file and report the number and size of the clusters at each depth")
+    parser.add_argument("tree_fname", type=str, help="input filename (.tree file)")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
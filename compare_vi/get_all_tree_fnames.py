@@ -3,6 +3,9 @@ from datetime import datetime
 
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tree_reader import is_tree_fname
+
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
         datefmt="%H:%M:%S",
@@ -13,7 +16,7 @@ def get_fnames(method):
     # https://stackoverflow.com/questions/2186525/use-a-glob-to-find-files-recursively-in-python
     matches = []
     for root, dirname, filenames in os.walk(method):
-        for filename in fnmatch.filter(filenames, "*.tree"):
+        for filename in filter(is_tree_fname, filenames):
             matches.append(os.path.join(root, filename))
     return matches
 
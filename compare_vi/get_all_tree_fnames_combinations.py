@@ -2,6 +2,9 @@ import sys, os, time, fnmatch
 from datetime import datetime
 import itertools
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from csv_index import write_csv_with_index
+from tree_reader import is_tree_fname
 
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
@@ -11,31 +14,39 @@ logger = logging.getLogger(__name__)
 
 def get_fnames(method, basedir):
     # https://stackoverflow.com/questions/2186525/use-a-glob-to-find-files-recursively-in-python
+    # os.walk order depends on the filesystem, so sort: pair indices must mean the same pairs on every run
     matches = []
-    for root, dirname, filenames in os.walk(os.path.join(basedir, method)):
-        for filename in fnmatch.filter(filenames, "*.tree"):
+    for root, dirnames, filenames in os.walk(os.path.join(basedir, method)):
+        dirnames.sort()
+        for filename in sorted(filter(is_tree_fname, filenames)):
             matches.append(os.path.abspath(os.path.join(root, filename)))
     return matches
 
+def iter_combination_lines(fnames, sep=','):
+    for i, (a, b) in enumerate(itertools.combinations(fnames, 2)):
+        yield "{}{}{}{}{}\n".format(i, sep, a, sep, b)
+
 def output_combinations(fnames, outfname, sep=','):
-    with open(outfname, 'w') as outf:
-        i = 0
-        for a, b in itertools.combinations(fnames, 2):
-            outf.write("{}{}".format(i, sep))
-            outf.write("{}{}".format(a, sep))
-            outf.write("{}\n".format(b))
-            i += 1
+    # also writes the index sidecar (outfname + '.idx') for row lookups, see csv_index.py
+    num_rows = write_csv_with_index(iter_combination_lines(fnames, sep), outfname)
+    logger.debug("Wrote {} combinations to {}".format(num_rows, outfname))
 
-def main(args):
-    methods = [
-                'undirdir',
-                'pagerank',
-                'outdirdir',
-                'pagerank_unrecorded'
-            ]
+METHODS = [
+            'undirdir',
+            'pagerank',
+            'outdirdir',
+            'pagerank_unrecorded'
+        ]
+
+def get_all_fnames(basedir, methods=METHODS):
+    """All tree filenames, in the order used for the combinations csv (and pair_space indices)"""
     fnames = []
     for method in methods:
-        fnames.extend(get_fnames(method, args.basedir))
+        fnames.extend(get_fnames(method, basedir))
+    return fnames
+
+def main(args):
+    fnames = get_all_fnames(args.basedir)
     output_combinations(fnames, args.outfname)
 
 if __name__ == "__main__":
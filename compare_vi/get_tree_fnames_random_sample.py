@@ -4,6 +4,10 @@ from datetime import datetime
 import pandas as pd
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from csv_index import build_index, write_csv_with_index
+from pair_space import num_pairs, sample_pair_indices, iter_pairs_by_index
+from get_all_tree_fnames_combinations import get_all_fnames
 
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
@@ -12,7 +16,22 @@ logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(me
 logger = logging.getLogger(__name__)
 
 
+def sample_from_fnames(fnames, outfname, number, seed, sep=','):
+    """Sample pairs of tree files by pair index, without reading or writing the full combinations csv.
+    The output has the same format as main, and orig_idx is the row the pair would have in the combinations csv
+
+    """
+    logger.debug("Sampling {} of {} pairs of {} files".format(number, num_pairs(len(fnames)), len(fnames)))
+    ks = sample_pair_indices(len(fnames), number, seed)
+    header = sep.join(['idx', 'orig_idx', 'fname_left', 'fname_right']) + '\n'
+    lines = ("{}{}{}{}{}{}{}\n".format(i, sep, k, sep, a, sep, b) for i, (k, a, b) in enumerate(iter_pairs_by_index(fnames, ks)))
+    write_csv_with_index(lines, outfname, header=header)
+
 def main(args):
+    if args.basedir:
+        fnames = get_all_fnames(args.basedir)
+        sample_from_fnames(fnames, args.outfname, args.number, int(args.seed))
+        return
     full_df = pd.read_csv(args.infname, index_col=0, header=None)
     randomstate = np.random.RandomState(args.seed)
     subset = full_df.sample(n=args.number, random_state=randomstate)
@@ -20,6 +39,7 @@ def main(args):
     subset.index.name = 'idx'
     subset.rename(columns={0: 'orig_idx', 1: 'fname_left', 2: 'fname_right'}, inplace=True)
     subset.to_csv(args.outfname)
+    build_index(args.outfname, header=True)
 
 if __name__ == "__main__":
     total_start = time.time()
@@ -29,6 +49,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="get random sample of tree fname combinations")
     parser.add_argument("-i", "--infname", default='all_tree_fnames_combinations.csv', help="input csv filename")
     parser.add_argument("-o", "--outfname", default='all_tree_fnames_combinations_sample.csv', help="output csv filename")
+    parser.add_argument("--basedir", help="sample directly from the tree files under this base directory (same order as get_all_tree_fnames_combinations.py) instead of reading the combinations csv")
     parser.add_argument("-n", "--number", type=int, default=1000, help="number of random samples")
     parser.add_argument("--seed", default=999, help="random seed")
     parser.add_argument("--debug", action='store_true', help="output debugging info")
@@ -2,6 +2,8 @@ import sys, os, time
 from datetime import datetime
 
 from vi_compare import get_vi_from_fnames
+from csv_index import index_is_fresh, read_rows
+from vi_store import VIStore
 
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
@@ -9,10 +11,17 @@ logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(me
         level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_vi_from_line(line, sep=','):
+# results are added to the store every this many pairs (and at the end), so a preempted job keeps most of its work
+STORE_BATCH = 10
+
+def get_fnames_from_line(line, sep=','):
+    # combinations csv: idx, fname_left, fname_right
+    # sample csv: idx, orig_idx, fname_left, fname_right
     line = line.strip().split(sep)
-    fname_left = line[2]
-    fname_right = line[3]
+    return line[-2], line[-1]
+
+def get_vi_from_line(line, sep=','):
+    fname_left, fname_right = get_fnames_from_line(line, sep)
     logger.debug("files to compare: {} | {}".format(fname_left, fname_right))
     vi = get_vi_from_fnames(fname_left, fname_right)
     return {
@@ -21,29 +30,70 @@ def get_vi_from_line(line, sep=','):
             'vi': vi
             }
 
-def get_vi_from_csv_rownum(csvfilename, rownum):
-    rownum = str(rownum)
-    vi_dict = {}
+def get_lines_from_csv(csvfilename, rownum, count=1, sep=','):
+    """Get the csv lines whose idx column is rownum, rownum+1, ..., rownum+count-1
+
+    Uses the index sidecar (see csv_index.py) to seek straight to the rows if there is one.
+    Otherwise scans the file.
+
+    """
+    if index_is_fresh(csvfilename):
+        return read_rows(csvfilename, rownum, rownum+count)
+    logger.warning("No index for {}. Scanning the file (build one with csv_index.py)".format(csvfilename))
+    wanted = set(str(x) for x in range(rownum, rownum+count))
+    lines = []
     with open(csvfilename, 'r') as f:
-        i = 0
         for line in f:
-            if line[:len(rownum)] == rownum:
-                logger.debug('found line in csv file. line number {} in file'.format(i))
-                vi_dict = get_vi_from_line(line)
-                break
-            i += 1
-    return vi_dict
-    
+            if line.split(sep, 1)[0] in wanted:
+                lines.append(line)
+                if len(lines) == count:
+                    break
+    return lines
+
+def get_vi_from_csv_rownum(csvfilename, rownum):
+    lines = get_lines_from_csv(csvfilename, rownum)
+    if not lines:
+        return {}
+    return get_vi_from_line(lines[0])
+
+def output_vi_dict(vi_dict, outf, sep=','):
+    output = sep.join( [vi_dict['fname_left'], vi_dict['fname_right'], str(vi_dict['vi'])] )
+    outf.write(output)
+    outf.write('\n')
 
 def main():
-    vi_dict = get_vi_from_csv_rownum(args.csvfilename, args.rownum)
-    if vi_dict:
-        logger.debug('VI is {}. writing to {}'.format(vi_dict['vi'], args.output.name))
-        output = args.sep.join( [vi_dict['fname_left'], vi_dict['fname_right'], str(vi_dict['vi'])] )
-        args.output.write(output)
-        args.output.write('\n')
-    else:
+    lines = get_lines_from_csv(args.csvfilename, args.rownum, count=args.count)
+    if not lines:
         sys.exit(1)
+    if not args.store:
+        for line in lines:
+            vi_dict = get_vi_from_line(line)
+            logger.debug('VI is {}. writing to {}'.format(vi_dict['vi'], args.output.name))
+            output_vi_dict(vi_dict, args.output, sep=args.sep)
+        return
+    store = VIStore(args.store)
+    new = []
+    try:
+        keys = store.get_pair_keys([get_fnames_from_line(line) for line in lines])
+        stored = store.get_results(keys)
+        logger.debug("{} of {} pairs already in {}".format(sum(key in stored for key in keys), len(keys), args.store))
+        for line, key in zip(lines, keys):
+            if key in stored:
+                fname_left, fname_right = get_fnames_from_line(line)
+                vi_dict = {'fname_left': fname_left, 'fname_right': fname_right, 'vi': stored[key]}
+            else:
+                vi_dict = get_vi_from_line(line)
+                # the same contents may come up twice in one job
+                stored[key] = vi_dict['vi']
+                new.append( (key, vi_dict['vi']) )
+                if len(new) >= STORE_BATCH:
+                    store.add_results(new)
+                    new = []
+            output_vi_dict(vi_dict, args.output, sep=args.sep)
+    finally:
+        if new:
+            store.add_results(new)
+        store.close()
 
 if __name__ == "__main__":
     total_start = time.time()
@@ -53,8 +103,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("csvfilename", help="filename for the csv file to read from")
     parser.add_argument("rownum", type=int, help="row number in the csv (corresponds to the idx column)")
+    parser.add_argument("--count", type=int, default=1, help="number of consecutive rows to compute, starting at rownum (default: 1)")
     parser.add_argument("--output", type=argparse.FileType('w'), default=sys.stdout, help="output file")
     parser.add_argument("--sep", default=',', help="output delimiter (default: ',')")
+    parser.add_argument("--store", help="VI result store (SQLite, see vi_store.py). pairs of tree contents already in it are copied from it instead of computed, and new results are added to it")
     parser.add_argument("--debug", action='store_true', help="output debugging info")
     global args
     args = parser.parse_args()
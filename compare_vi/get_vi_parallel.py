@@ -0,0 +1,246 @@
+import sys, os, time, csv, itertools
+from collections import OrderedDict
+from datetime import datetime
+import multiprocessing
+
+from vi_compare import encode_tree, align_labels, compare_labels, MEASURES
+from tree_cache import cache_is_fresh, convert_tree
+from pair_space import num_pairs, iter_pairs
+from get_all_tree_fnames_combinations import get_all_fnames
+from vi_store import VIStore, get_pair_key
+import profiling
+from profiling import stage
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OUTPUT_HEADER = ['idx', 'fname_left', 'fname_right']
+
+def iter_pairs_csv(csvfilename):
+    """Read the pairs to compare from a combinations csv (idx, fname_left, fname_right; no header;
+    from get_all_tree_fnames_combinations.py) or a sample csv (idx, orig_idx, fname_left, fname_right;
+    with header; from get_tree_fnames_random_sample.py), a row at a time
+
+    :yields: (idx, fname_left, fname_right)
+
+    """
+    with open(csvfilename, 'r') as f:
+        for row in csv.reader(f):
+            if row[0] == 'idx':
+                continue
+            yield (int(row[0]), row[-2], row[-1])
+
+def scan_pairs_csv(csvfilename):
+    """Number of pairs in a pairs csv and the tree files they use, in one streaming pass
+
+    :returns: (number of pairs, sorted list of tree filenames)
+
+    """
+    num_pairs = 0
+    fnames = set()
+    for idx, fname_left, fname_right in iter_pairs_csv(csvfilename):
+        num_pairs += 1
+        fnames.add(fname_left)
+        fnames.add(fname_right)
+    return num_pairs, sorted(fnames)
+
+def get_output_header(measures):
+    return OUTPUT_HEADER + list(measures)
+
+def read_completed(outfname, measures=('vi',)):
+    """Get the set of pairs that are already in an output file (with these measures)
+
+    Pairs are keyed by (fname_left, fname_right), not by idx, so a resumed run skips the right pairs
+    even if the pair indices changed (e.g. tree files were added)
+
+    :returns: set of (fname_left, fname_right)
+
+    """
+    completed = set()
+    if not os.path.exists(outfname):
+        return completed
+    with open(outfname, 'r') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if row[0] == 'idx':
+                if row != get_output_header(measures):
+                    raise RuntimeError("{} has columns {}, not {}. use another output file".format(outfname, row, get_output_header(measures)))
+                continue
+            # skip a partly written last line
+            if len(row) != len(get_output_header(measures)):
+                continue
+            completed.add( (row[1], row[2]) )
+    return completed
+
+# per worker state, set up by init_worker
+_worker_cache_dir = None
+_worker_cache_size = 4
+_worker_encoded = OrderedDict()
+_worker_measures = ['vi']
+
+def init_worker(cache_dir, cache_size, measures=('vi',)):
+    global _worker_cache_dir, _worker_cache_size, _worker_measures
+    _worker_cache_dir = cache_dir
+    _worker_cache_size = cache_size
+    _worker_measures = list(measures)
+    _worker_encoded.clear()
+
+def get_encoded(fname):
+    """Encoded clustering for a tree file, from this worker's LRU cache of recently used trees"""
+    if fname in _worker_encoded:
+        encoded = _worker_encoded.pop(fname)
+    else:
+        encoded = encode_tree(fname, _worker_cache_dir)
+        while len(_worker_encoded) >= _worker_cache_size:
+            _worker_encoded.popitem(last=False)
+    _worker_encoded[fname] = encoded
+    return encoded
+
+def compute_pair(pair):
+    """
+    :pair: (idx, fname_left, fname_right)
+    :returns: output row: (idx, fname_left, fname_right, then the value of each of the worker's measures)
+
+    """
+    idx, fname_left, fname_right = pair
+    pid_left, labels_left = get_encoded(fname_left)
+    pid_right, labels_right = get_encoded(fname_right)
+    # every measure comes from the same contingency table, so more measures cost almost nothing
+    results = compare_labels(*align_labels(pid_left, labels_left, pid_right, labels_right))
+    return (idx, fname_left, fname_right) + tuple(results[measure] for measure in _worker_measures)
+
+def build_cache(fname_and_cache_dir):
+    fname, cache_dir = fname_and_cache_dir
+    if not cache_is_fresh(fname, cache_dir):
+        convert_tree(fname, cache_dir)
+    return fname
+
+def get_pairs(args):
+    """Get the pairs to compute, from the csv or (with --basedir) generated from the pair indices
+
+    :returns: (iterator of (idx, fname_left, fname_right), number of pairs, list of tree filenames)
+
+    """
+    if args.basedir:
+        fnames = get_all_fnames(args.basedir)
+        total = num_pairs(len(fnames))
+        stop = total if args.stop is None else min(args.stop, total)
+        logger.info("{} tree files under {}. Computing pairs {} to {} of {}".format(len(fnames), args.basedir, args.start, stop, total))
+        return iter_pairs(fnames, args.start, stop), max(stop - args.start, 0), fnames
+    # the csv is read twice, a row at a time: once for the tree files, once for the pairs to compute
+    num_todo, fnames = scan_pairs_csv(args.csvfilename)
+    logger.info("{} pairs of {} tree files in {}".format(num_todo, len(fnames), args.csvfilename))
+    return iter_pairs_csv(args.csvfilename), num_todo, fnames
+
+def iter_batches(iterable, size):
+    iterable = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterable, size))
+        if not batch:
+            return
+        yield batch
+
+def main(args):
+    if not args.csvfilename and not args.basedir:
+        raise RuntimeError("need a csv filename or --basedir")
+    profiling.start_from_args('get_vi_parallel', args)
+    pairs, num_todo, fnames = get_pairs(args)
+    completed = read_completed(args.output, args.measures)
+    if completed:
+        pairs = (pair for pair in pairs if (pair[1], pair[2]) not in completed)
+        logger.info("{} pairs already in {}. Skipping them".format(len(completed), args.output))
+
+    processes = args.processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(args.cache_dir, args.worker_cache_size, args.measures))
+    store = None
+    hashes = None
+    num_stored = 0
+    try:
+        if args.store:
+            store = VIStore(args.store)
+            hashes = store.get_hashes(fnames, pool=pool)
+        if args.build_cache:
+            # one conversion per tree file, so every worker memory maps the same cache instead of parsing text
+            logger.info("Building tree caches for {} files...".format(len(fnames)))
+            for _ in pool.imap_unordered(build_cache, [(fname, args.cache_dir) for fname in fnames]):
+                pass
+
+        write_header = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+        with open(args.output, 'a') as outf:
+            writer = csv.writer(outf, lineterminator='\n')
+            if write_header:
+                writer.writerow(get_output_header(args.measures))
+            # pairs are streamed (from the csv, or generated from their indices) to the pool a batch at a time,
+            # so the pair list is never held in memory. only the pairs already in the output are (see read_completed)
+            # consecutive pairs mostly share their left file, so chunks keep each worker's cache warm
+            i = 0
+            for batch in iter_batches(pairs, args.batch_size):
+                if store is not None:
+                    # pairs whose contents were compared before (in any run) are copied from the store
+                    keys = dict((pair[0], get_pair_key(hashes[os.path.abspath(pair[1])], hashes[os.path.abspath(pair[2])])) for pair in batch)
+                    stored = dict((measure, store.get_results(keys.values(), measure)) for measure in args.measures)
+                    is_stored = lambda key: all(key in stored[measure] for measure in args.measures)
+                    with stage('output'):
+                        for pair in batch:
+                            if is_stored(keys[pair[0]]):
+                                writer.writerow(pair + tuple(stored[measure][keys[pair[0]]] for measure in args.measures))
+                                num_stored += 1
+                        outf.flush()
+                    batch = [pair for pair in batch if not is_stored(keys[pair[0]])]
+                new = []
+                for row, stages in pool.imap_unordered(profiling.run_in_worker, [(compute_pair, pair) for pair in batch], chunksize=args.chunksize):
+                    profiling.merge_worker_stages(stages)
+                    with stage('output') as stats:
+                        writer.writerow(row)
+                        outf.flush()
+                        stats.add(lines=1)
+                    if store is not None:
+                        new.append( (keys[row[0]], row[len(OUTPUT_HEADER):]) )
+                    i += 1
+                    if i % 1000 == 0:
+                        logger.info("{} of at most {} pairs done".format(i, num_todo))
+                if new:
+                    # one transaction per batch
+                    with stage('output'):
+                        store.add_results_by_measure([(key, dict(zip(args.measures, values))) for key, values in new])
+        if store is not None:
+            logger.info("{} pairs computed, {} copied from {}".format(i, num_stored, args.store))
+    finally:
+        pool.close()
+        pool.join()
+        if store is not None:
+            store.close()
+    profiling.finish_run(profiling.get_report_fname(os.path.dirname(os.path.abspath(args.output)), os.path.splitext(os.path.basename(args.output))[0]))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Compute the VI for every pair in a combinations or sample csv (or every pair of tree files under a base directory) using a pool of worker processes. Results stream to one output csv, and pairs already in the output are skipped")
+    parser.add_argument("csvfilename", nargs='?', help="combinations csv (from get_all_tree_fnames_combinations.py) or sample csv (from get_tree_fnames_random_sample.py)")
+    parser.add_argument("--basedir", help="instead of a csv, generate the pairs of all tree files under this base directory (same order and idx as get_all_tree_fnames_combinations.py)")
+    parser.add_argument("--start", type=int, default=0, help="with --basedir: index of the first pair to compute")
+    parser.add_argument("--stop", type=int, help="with --basedir: pair index to stop before (default: all pairs)")
+    parser.add_argument("-o", "--output", default='vi_results.csv', help="output csv filename. if it exists, the run resumes from it")
+    parser.add_argument("-p", "--processes", type=int, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--chunksize", type=int, default=16, help="number of consecutive pairs sent to a worker at a time")
+    parser.add_argument("--batch-size", type=int, default=10000, help="number of pairs queued to the pool at a time")
+    parser.add_argument("--worker-cache-size", type=int, default=4, help="number of parsed clusterings each worker keeps in memory")
+    parser.add_argument("--measures", nargs='+', choices=MEASURES, default=['vi'], help="measures to compute for each pair, one output column each (default: vi). all of them come from one contingency table, so extra measures add little time")
+    parser.add_argument("--store", help="VI result store (SQLite, see vi_store.py). pairs of tree contents already in it are not computed again, and new results are added to it once per batch")
+    parser.add_argument("--build-cache", action='store_true', help="build the tree cache (tree_cache.py) for every file before computing")
+    parser.add_argument("--cache-dir", help="base directory for tree caches (default: next to each tree file)")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
@@ -0,0 +1,114 @@
+import math
+
+import numpy as np
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pair k of n files is the k-th pair (i, j), i < j, in the order of itertools.combinations(range(n), 2),
+# i.e. the row with idx k in the csv written by get_all_tree_fnames_combinations.py.
+# Pairs are computed from their index, so the N^2 pair list never has to be written out.
+
+def num_pairs(n):
+    return n * (n - 1) // 2
+
+def _pairs_before(i, n):
+    """number of pairs whose first element is less than i"""
+    return i * n - i * (i + 1) // 2
+
+def rank_pair(i, j, n):
+    """Index of the pair (i, j) (i < j) among all pairs of n items"""
+    return _pairs_before(i, n) + (j - i - 1)
+
+def unrank_pair(k, n):
+    """The pair (i, j) with index k among all pairs of n items"""
+    if k < 0 or k >= num_pairs(n):
+        raise IndexError("pair index {} out of range for {} items".format(k, n))
+    i = n - 2 - int((math.sqrt(-8.0 * k + 4.0 * n * (n - 1) - 7) - 1) / 2)
+    # correct for floating point error
+    while i > 0 and _pairs_before(i, n) > k:
+        i -= 1
+    while _pairs_before(i + 1, n) <= k:
+        i += 1
+    j = k - _pairs_before(i, n) + i + 1
+    return i, j
+
+def unrank_pairs(ks, n):
+    """Vectorized unrank_pair
+
+    :ks: array of pair indices
+    :n: number of items
+    :returns: (i, j) int64 arrays
+
+    """
+    ks = np.asarray(ks, dtype=np.int64)
+    i = n - 2 - ((np.sqrt(-8.0 * ks + 4.0 * n * (n - 1) - 7) - 1) // 2).astype(np.int64)
+    i = np.clip(i, 0, n - 2)
+    # correct for floating point error
+    too_big = _pairs_before(i, n) > ks
+    while too_big.any():
+        i[too_big] -= 1
+        too_big = _pairs_before(i, n) > ks
+    too_small = _pairs_before(i + 1, n) <= ks
+    while too_small.any():
+        i[too_small] += 1
+        too_small = _pairs_before(i + 1, n) <= ks
+    j = ks - _pairs_before(i, n) + i + 1
+    return i, j
+
+def sample_pair_indices(n, number, seed=None):
+    """Sample pair indices uniformly without replacement, without enumerating the pairs
+
+    :n: number of items
+    :number: number of pairs to sample
+    :seed: random seed
+    :returns: sorted int64 array of pair indices
+
+    """
+    total = num_pairs(n)
+    if number > total:
+        raise ValueError("cannot sample {} pairs from {} items ({} pairs)".format(number, n, total))
+    randomstate = np.random.RandomState(seed)
+    if number * 4 > total:
+        return np.sort(randomstate.choice(total, size=number, replace=False)).astype(np.int64)
+    sampled = np.array([], dtype=np.int64)
+    while len(sampled) < number:
+        draw = randomstate.randint(0, total, size=number - len(sampled), dtype=np.int64)
+        sampled = np.unique(np.concatenate([sampled, draw]))
+    return sampled
+
+def iter_pairs(fnames, start=0, stop=None):
+    """Generate pairs of filenames in combinations order
+
+    :fnames: list of filenames
+    :start: index of the first pair
+    :stop: index to stop before (default: all pairs)
+    :yields: (idx, fname_left, fname_right)
+
+    """
+    n = len(fnames)
+    total = num_pairs(n)
+    if stop is None or stop > total:
+        stop = total
+    if start >= stop:
+        return
+    i, j = unrank_pair(start, n)
+    for k in range(start, stop):
+        yield k, fnames[i], fnames[j]
+        j += 1
+        if j == n:
+            i += 1
+            j = i + 1
+
+def iter_pairs_by_index(fnames, ks):
+    """Generate the pairs of filenames with the given indices
+
+    :yields: (idx, fname_left, fname_right)
+
+    """
+    i, j = unrank_pairs(ks, len(fnames))
+    for k, a, b in zip(np.asarray(ks).tolist(), i.tolist(), j.tolist()):
+        yield k, fnames[a], fnames[b]
@@ -1,9 +1,15 @@
-import sys, os, time, fnmatch, itertools
+import sys, os, time, fnmatch, itertools, tempfile, shutil
 from datetime import datetime
 
 import pandas as pd
 import numpy as np
-import igraph
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tree_cache import load_fresh_cache
+from tree_reader import read_tree_chunks
+from cluster_index import index_tree
+import profiling
+from profiling import stage
 
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
@@ -13,45 +19,357 @@ logger = logging.getLogger(__name__)
 
 
 def parse_tree(fname):
-    with open(fname, 'r') as f:
-        rows = []
-        for line in f:
-            if line[0] == "#":
-                continue
+    """
+    :returns: list of (pid, tree path) for every node
+    """
+    rows = []
+    for chunk in read_tree_chunks(fname):
+        rows.extend(zip(chunk['pid'].tolist(), [path.decode('ascii') for path in chunk['path']]))
+    return rows
 
-            line = line.strip().split(' ')
-            pid = int(line[2].strip('"'))
-            cl = line[0]
 
-            rows.append( (pid, cl) )
-    return rows
+def get_labels_from_df(df):
+    """Encode the bottom level clustering of a parsed tree as integer labels
+
+    :df: DataFrame with columns pid and cl (the tree path)
+    :returns: (pid: int64 array, labels: int32 array of module codes), in the row order of df
+
+    """
+    bottom_level = df.cl.apply(lambda x: ':'.join(x.split(':')[:-1])).astype('category')
+    return df.pid.values.astype(np.int64), bottom_level.cat.codes.values.astype(np.int32)
+
+def encode_tree(fname, cache_dir=None):
+    """Parse a tree file and encode its bottom level clustering as integer labels, ordered by paper ID
+
+    :fname: filename of the tree file
+    :cache_dir: base directory for tree caches
+    :returns: (pid: sorted int64 array, labels: int32 array of module codes aligned with pid)
+
+    """
+    columns = load_fresh_cache(fname, cache_dir)
+    if columns is not None:
+        logger.debug("Using tree cache for {}".format(fname))
+        pid = np.asarray(columns['pid'])
+        labels = np.asarray(columns['module'])
+    else:
+        _, pid, labels = index_tree(fname)
+    order = np.argsort(pid, kind='mergesort')
+    return pid[order], labels[order].astype(np.int32)
+
+def encode_tree_levels(fname, cache_dir=None):
+    """Parse a tree file into module codes at every hierarchy level, ordered by paper ID
+
+    :fname: filename of the tree file
+    :cache_dir: base directory for tree caches
+    :returns: (pid: sorted int64 array, components: int64 array of shape (max_depth - 1, number of nodes)
+              aligned with pid. row l is a code for the node's module prefix of length l + 1. where the
+              node's module is not that deep, the code keeps the node in its own module (see iter_level_labels))
+
+    """
+    columns = load_fresh_cache(fname, cache_dir)
+    if columns is not None:
+        logger.debug("Using tree cache for {}".format(fname))
+        pid = np.asarray(columns['pid'])
+        # cache codes are -1 where the path is not that deep
+        components = np.asarray(columns['levels']).astype(np.int64) + 1
+    else:
+        index, pid, module = index_tree(fname)
+        if len(index) > 1:
+            components = index.ancestor_table()[:, module].astype(np.int64)
+        else:
+            components = np.zeros((0, len(module)), dtype=np.int64)
+    order = np.argsort(pid, kind='mergesort')
+    return pid[order], components[:, order]
+
+def iter_level_labels(components, num_levels=None):
+    """Derive the clustering at each hierarchy level from the one above it
+
+    At level d a node is labeled by its module prefix of length d. Nodes whose module is not
+    that deep keep their own (shallower) module, so every level is a full partition and the
+    deepest level is the bottom level clustering.
+
+    :components: array from encode_tree_levels
+    :num_levels: number of levels to yield. levels past the tree's depth repeat the bottom level
+    :yields: dense int64 label array for level 1, 2, ..., num_levels
+
+    """
+    if num_levels is None:
+        num_levels = len(components)
+    labels = np.zeros(components.shape[1], dtype=np.int64)
+    for level in range(num_levels):
+        if level < len(components):
+            row = components[level]
+            combined = labels * (row.max() + 1) + row
+            _, labels = np.unique(combined, return_inverse=True)
+            labels = labels.reshape(-1)
+        yield labels
+
+def get_vi_per_level(components_left, components_right):
+    """Get the VI between two aligned clusterings at every hierarchy level
+
+    :components_left, components_right: arrays from encode_tree_levels, aligned by paper (see align_labels)
+    :returns: list of VI for level 1, 2, ..., max depth of the two trees
+
+    """
+    num_levels = max(len(components_left), len(components_right))
+    levels_left = iter_level_labels(components_left, num_levels)
+    levels_right = iter_level_labels(components_right, num_levels)
+    return [get_vi_from_labels(labels_left, labels_right) for labels_left, labels_right in zip(levels_left, levels_right)]
+
+def get_vi_per_level_from_fnames(fname_left, fname_right, cache_dir=None):
+    pid_left, components_left = encode_tree_levels(fname_left, cache_dir)
+    pid_right, components_right = encode_tree_levels(fname_right, cache_dir)
+    logger.info("Tree files parsed. Computing VI at every level...")
+    return get_vi_per_level(*align_labels(pid_left, components_left, pid_right, components_right))
+
+def align_labels(pid_left, labels_left, pid_right, labels_right):
+    """Join two clusterings on paper ID
+
+    :returns: (labels_left, labels_right) for the papers that are in both clusterings, in the same order.
+              labels can also be 2-d arrays with one column per paper (see encode_tree_levels)
+
+    """
+    with stage('vi'):
+        if len(pid_left) == len(pid_right) and np.array_equal(pid_left, pid_right):
+            return labels_left, labels_right
+        common, idx_left, idx_right = np.intersect1d(pid_left, pid_right, assume_unique=True, return_indices=True)
+        if len(common) < max(len(pid_left), len(pid_right)):
+            logger.warning("Clusterings do not cover the same papers. Comparing the {} papers in both ({} and {} total)".format(len(common), len(pid_left), len(pid_right)))
+        return labels_left[..., idx_left], labels_right[..., idx_right]
+
+def get_entropy(counts):
+    """Entropy (natural log) of the distribution given by an array of counts"""
+    counts = counts[counts > 0]
+    p = counts / float(counts.sum())
+    return -np.sum(p * np.log(p))
 
+# measures computed by compare_labels (names as in igraph.compare_communities, with underscores)
+MEASURES = ['vi', 'nmi', 'rand', 'adjusted_rand', 'split_join']
 
-def get_vi_from_clusterings(clustering_left, clustering_right):
-    return igraph.compare_communities(clustering_left, clustering_right, method='vi')
+def get_contingency(labels_left, labels_right):
+    """Sparse contingency table of two aligned clusterings
+
+    :returns: (rows, cols, counts): the left label, right label and number of papers of each
+              non-empty cell, sorted by row then column
+
+    """
+    num_cols = labels_right.max() + 1
+    # one code per (left, right) label pair
+    combined = labels_left * num_cols + labels_right
+    codes, counts = np.unique(combined, return_counts=True)
+    return codes // num_cols, codes % num_cols, counts
+
+def get_pair_count(counts):
+    """Number of pairs of papers within each group, summed"""
+    counts = counts.astype(np.float64)
+    return float(np.sum(counts * (counts - 1) / 2))
+
+def compare_labels(labels_left, labels_right):
+    """Compare two aligned clusterings given as non-negative integer label arrays. The contingency
+    table is built once and every measure in MEASURES is computed from it
+
+    :returns: dict {vi: variation of information, nmi: normalized mutual information, rand: Rand index,
+              adjusted_rand: adjusted Rand index, split_join: split-join distance}
+              (natural log, same conventions as igraph.compare_communities)
+
+    """
+    labels_left = np.asarray(labels_left, dtype=np.int64)
+    labels_right = np.asarray(labels_right, dtype=np.int64)
+    if len(labels_left) != len(labels_right):
+        raise ValueError("label arrays must be the same length")
+    n = len(labels_left)
+    if n == 0:
+        return {'vi': 0.0, 'nmi': 1.0, 'rand': 1.0, 'adjusted_rand': 1.0, 'split_join': 0.0}
+    with stage('vi') as stats:
+        stats.add(nodes=n)
+        counts_left = np.bincount(labels_left)
+        counts_right = np.bincount(labels_right)
+        rows, cols, joint_counts = get_contingency(labels_left, labels_right)
+        h_left = get_entropy(counts_left)
+        h_right = get_entropy(counts_right)
+        h_joint = get_entropy(joint_counts)
+        # largest overlap of each left cluster with a right cluster, and the other way around.
+        # cells are sorted by row, so each row's cells are contiguous
+        row_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        max_left = np.maximum.reduceat(joint_counts, row_starts)
+        max_right = np.zeros(len(counts_right), dtype=joint_counts.dtype)
+        np.maximum.at(max_right, cols, joint_counts)
+        pairs_joint = get_pair_count(joint_counts)
+        pairs_left = get_pair_count(counts_left)
+        pairs_right = get_pair_count(counts_right)
+    mi = h_left + h_right - h_joint
+    vi = max(h_joint - mi, 0.0)
+    if h_left + h_right > 0:
+        nmi = 2 * mi / (h_left + h_right)
+    else:
+        nmi = 1.0
+    pairs_total = n * (n - 1) / 2.0
+    if pairs_total > 0:
+        # pairs of papers together in both clusterings or apart in both
+        rand = (pairs_total + 2 * pairs_joint - pairs_left - pairs_right) / pairs_total
+        expected = pairs_left * pairs_right / pairs_total
+        best = (pairs_left + pairs_right) / 2.0
+        adjusted_rand = (pairs_joint - expected) / (best - expected) if best != expected else 1.0
+    else:
+        rand = adjusted_rand = 1.0
+    split_join = 2 * n - int(max_left.sum()) - int(max_right.sum())
+    return {'vi': float(vi), 'nmi': float(nmi), 'rand': float(rand), 'adjusted_rand': float(adjusted_rand), 'split_join': float(split_join)}
+
+def get_vi_from_labels(labels_left, labels_right):
+    return compare_labels(labels_left, labels_right)['vi']
+
+def get_nmi_from_labels(labels_left, labels_right):
+    return compare_labels(labels_left, labels_right)['nmi']
 
 def get_vi_from_df(df_left, df_right):
-    clusterings = []
-    for df in [df_left, df_right]:
-        bottom_level = df.cl.apply(lambda x: ':'.join(x.split(':')[:-1])).astype('category')
-        clusterings.append(igraph.Clustering(bottom_level.cat.codes))
-    return get_vi_from_clusterings(clusterings[0], clusterings[1])
-
-def get_vi_from_fnames(fname_left, fname_right):
-    dfs = []
-    for fname in [fname_left, fname_right]:
-        rows = parse_tree(fname)
-        df = pd.DataFrame(rows, columns=['pid', 'cl'])
-        dfs.append(df)
+    pid_left, labels_left = get_labels_from_df(df_left)
+    pid_right, labels_right = get_labels_from_df(df_right)
+    return get_vi_from_labels(*align_labels(pid_left, labels_left, pid_right, labels_right))
+
+def get_vi_from_fnames(fname_left, fname_right, cache_dir=None):
+    pid_left, labels_left = encode_tree(fname_left, cache_dir)
+    pid_right, labels_right = encode_tree(fname_right, cache_dir)
     logger.info("Tree files parsed. Computing VI...")
-    return get_vi_from_df(dfs[0], dfs[1])
-            
+    return get_vi_from_labels(*align_labels(pid_left, labels_left, pid_right, labels_right))
+
+def encode_trees(fnames, outdir=None, cache_dir=None, strict=False):
+    """Parse and encode each tree file exactly once
+
+    :fnames: list of tree filenames
+    :outdir: if given, save each label array here (as <index>.npy) instead of keeping it in memory
+    :cache_dir: base directory for tree caches
+    :strict: raise ValueError if the files do not all cluster the same papers. otherwise each pair
+             is compared on the papers in both (see align_labels)
+    :returns: list with, for each file, (paper IDs, label array). files that cluster the same papers as the
+              first file share its paper ID array. if outdir is given, the label array is saved and its .npy
+              filename is given instead, as is the paper ID array (as <index>.pid.npy) if it is not shared
+
+    """
+    encoded = []
+    pid_ref = None
+    for i, fname in enumerate(fnames):
+        logger.debug("Encoding tree file {} of {}: {}".format(i+1, len(fnames), fname))
+        pid, labels = encode_tree(fname, cache_dir)
+        if pid_ref is None:
+            pid_ref = pid
+        elif np.array_equal(pid, pid_ref):
+            pid = pid_ref
+        elif strict:
+            raise ValueError("tree files do not cluster the same set of nodes: {} and {}".format(fnames[0], fname))
+        else:
+            logger.warning("Tree files do not cluster the same set of nodes: {} and {}. Pairs with {} are compared on the papers in both".format(fnames[0], fname, fname))
+        if outdir is not None:
+            label_fname = os.path.join(outdir, "{}.npy".format(i))
+            np.save(label_fname, labels)
+            labels = label_fname
+            if pid is not pid_ref:
+                pid_fname = os.path.join(outdir, "{}.pid.npy".format(i))
+                np.save(pid_fname, pid)
+                pid = pid_fname
+        encoded.append((pid, labels))
+    return encoded
+
+def load_encoded(encoded):
+    """(paper IDs, label array) of an entry of encode_trees, loading the arrays that were saved"""
+    return tuple(np.load(a) if isinstance(a, str) else a for a in encoded)
+
+def get_vi_from_encoded(left, right):
+    """VI between two loaded entries of encode_trees"""
+    pid_left, labels_left = left
+    pid_right, labels_right = right
+    if pid_left is pid_right:
+        return get_vi_from_labels(labels_left, labels_right)
+    return get_vi_from_labels(*align_labels(pid_left, labels_left, pid_right, labels_right))
+
+def get_vi_matrix(fnames, max_resident=None, cache_dir=None, scratch_dir=None, strict=False):
+    """Get the symmetric matrix of VI between every pair of tree files. Each file is parsed once
+
+    :fnames: list of tree filenames
+    :max_resident: maximum number of clusterings to hold in memory at once (at least 2).
+                   if None, or at least the number of files, all clusterings are kept in memory.
+                   otherwise the encoded clusterings are spilled to scratch_dir and compared block by block
+    :cache_dir: base directory for tree caches
+    :scratch_dir: directory for the spilled clusterings (default: a temporary directory)
+    :strict: raise ValueError if the files do not all cluster the same papers (see encode_trees)
+    :returns: numpy array of shape (len(fnames), len(fnames))
+
+    """
+    n = len(fnames)
+    vi_matrix = np.zeros((n, n), dtype=np.float64)
+    if max_resident is None or max_resident >= n:
+        encoded = encode_trees(fnames, cache_dir=cache_dir, strict=strict)
+        logger.info("{} tree files encoded. Computing VI...".format(n))
+        for i, j in itertools.combinations(range(n), 2):
+            vi_matrix[i, j] = vi_matrix[j, i] = get_vi_from_encoded(encoded[i], encoded[j])
+        return vi_matrix
+
+    if max_resident < 2:
+        raise ValueError("max_resident must be at least 2")
+    tmpdir = tempfile.mkdtemp(prefix='vi_labels_', dir=scratch_dir)
+    try:
+        encoded = encode_trees(fnames, outdir=tmpdir, cache_dir=cache_dir, strict=strict)
+        logger.info("{} tree files encoded. Computing VI in blocks of {}...".format(n, max_resident // 2))
+        # two blocks are resident at a time
+        block_size = max_resident // 2
+        blocks = [range(start, min(start+block_size, n)) for start in range(0, n, block_size)]
+        for bi, block_left in enumerate(blocks):
+            left = dict((i, load_encoded(encoded[i])) for i in block_left)
+            for i, j in itertools.combinations(block_left, 2):
+                vi_matrix[i, j] = vi_matrix[j, i] = get_vi_from_encoded(left[i], left[j])
+            for block_right in blocks[bi+1:]:
+                right = dict((j, load_encoded(encoded[j])) for j in block_right)
+                for i in block_left:
+                    for j in block_right:
+                        vi_matrix[i, j] = vi_matrix[j, i] = get_vi_from_encoded(left[i], right[j])
+                del right
+            del left
+    finally:
+        shutil.rmtree(tmpdir)
+    return vi_matrix
+
+def read_fnames_csv(fname):
+    """Read a list of tree filenames as written by get_all_tree_fnames.py (index, filename; no header)"""
+    fnames = pd.read_csv(fname, index_col=0, header=None)
+    return fnames[1].tolist()
+
+def output_vi_matrix(vi_matrix, fnames, outf, sep=','):
+    with stage('output') as stats:
+        stats.add(lines=len(fnames))
+        df = pd.DataFrame(vi_matrix, index=fnames, columns=fnames)
+        df.to_csv(outf, sep=sep)
+
+def get_report_fname(outf):
+    """Run report filename next to the output file (in the current directory for stdout)"""
+    if outf is sys.stdout:
+        return profiling.get_report_fname(os.getcwd(), 'vi_compare')
+    return profiling.get_report_fname(os.path.dirname(os.path.abspath(outf.name)), os.path.splitext(os.path.basename(outf.name))[0])
 
 
 def main(args):
+    profiling.start_from_args('vi_compare', args)
+    try:
+        compare(args)
+    finally:
+        profiling.finish_run(get_report_fname(args.output))
+
+def compare(args):
+    if args.all_pairs:
+        fnames = list(args.input)
+        if args.fnames_csv:
+            fnames.extend(read_fnames_csv(args.fnames_csv))
+        vi_matrix = get_vi_matrix(fnames, max_resident=args.max_resident, cache_dir=args.cache_dir, scratch_dir=args.scratch_dir, strict=args.strict)
+        output_vi_matrix(vi_matrix, fnames, args.output)
+        return
+    if len(args.input) != 2:
+        raise RuntimeError("need exactly two tree files to compare (or use --all-pairs)")
     fname_left = args.input[0]
     fname_right = args.input[1]
-    vi = get_vi_from_fnames(fname_left, fname_right)
+    if args.levels:
+        vi_per_level = get_vi_per_level_from_fnames(fname_left, fname_right, cache_dir=args.cache_dir)
+        for level, vi in enumerate(vi_per_level, start=1):
+            args.output.write("VI for files: {}, {} at level {}: {}\n".format(fname_left, fname_right, level, vi))
+        return
+    vi = get_vi_from_fnames(fname_left, fname_right, cache_dir=args.cache_dir)
     args.output.write("VI for files: {}, {}: {}\n".format(fname_left, fname_right, vi))
 
 
@@ -61,8 +379,16 @@ if __name__ == "__main__":
     logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
     import argparse
     parser = argparse.ArgumentParser(description="Get the Variation in Information (VI) for two clusterings of the same graph")
-    parser.add_argument("input", nargs=2, help="filenames for the two tree files to compare")
+    parser.add_argument("input", nargs='*', help="filenames for the two tree files to compare (or any number of files with --all-pairs)")
     parser.add_argument("-o", "--output", type=argparse.FileType('w'), default=sys.stdout, help="output filename")
+    parser.add_argument("--levels", action='store_true', help="output the VI at every hierarchy level (level 1 is the top level modules, the deepest level is the bottom level clustering)")
+    parser.add_argument("--all-pairs", action='store_true', help="compare every pair of the input files and output the full VI matrix as csv. each file is parsed only once")
+    parser.add_argument("--fnames-csv", help="with --all-pairs: csv of tree filenames as written by get_all_tree_fnames.py")
+    parser.add_argument("--max-resident", type=int, help="with --all-pairs: maximum number of clusterings to hold in memory at once (default: all)")
+    parser.add_argument("--scratch-dir", help="with --all-pairs: directory for clusterings spilled to disk when --max-resident is smaller than the number of files")
+    parser.add_argument("--strict", action='store_true', help="with --all-pairs: fail if the files do not all cluster the same papers, instead of comparing each pair on the papers in both")
+    parser.add_argument("--cache-dir", help="base directory for tree caches made by tree_cache.py (default: next to each tree file)")
+    profiling.add_arguments(parser)
     parser.add_argument("--debug", action='store_true', help="output debugging info")
     global args
     args = parser.parse_args()
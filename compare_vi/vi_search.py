@@ -0,0 +1,306 @@
+import sys, os, time, csv, heapq
+from collections import defaultdict, OrderedDict
+from datetime import datetime
+import multiprocessing
+
+import numpy as np
+
+from get_vi_parallel import init_worker, compute_pair
+from get_all_tree_fnames_combinations import get_fnames, METHODS
+from vi_store import VIStore, get_pair_key
+import profiling
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MEDOID_HEADER = ['method', 'medoid', 'mean_vi', 'num_runs']
+NEAREST_HEADER = ['query', 'rank', 'fname', 'vi']
+
+class PivotSearch(object):
+    """VI between tree files, computed on demand in a worker pool, with lower bounds from pivot runs
+
+    VI is a metric, so for any pivot p, VI(x, y) >= |VI(p, x) - VI(p, y)|. With the VI from a few
+    pivots to every run, searches can skip the pairs whose lower bound already rules them out.
+    Every VI computed is kept, and with a store (see vi_store.py) pairs compared before are read from it
+    and new ones added to it, so later searches start from them.
+
+    """
+    def __init__(self, fnames, pool, store=None, batch_size=64, chunksize=4):
+        self.fnames = fnames
+        self.pool = pool
+        self.store = store
+        self.batch_size = batch_size
+        self.chunksize = chunksize
+        # known[i][j] = VI of runs i and j (both ways)
+        self.known = defaultdict(dict)
+        self.num_computed = 0
+        self.num_from_store = 0
+        self.hashes = None
+        if store is not None:
+            hashes = store.get_hashes(fnames, pool=pool)
+            self.hashes = [hashes[os.path.abspath(fname)] for fname in fnames]
+
+    def get_vi(self, pairs):
+        """VI of pairs of runs (by index), computing the ones not known yet in parallel
+
+        :returns: list of VI, in the order of pairs
+
+        """
+        todo = sorted(set((min(i, j), max(i, j)) for i, j in pairs if i != j and j not in self.known[i]))
+        if todo and self.store is not None:
+            keys = dict((pair, get_pair_key(self.hashes[pair[0]], self.hashes[pair[1]])) for pair in todo)
+            stored = self.store.get_results(keys.values())
+            for pair in todo:
+                if keys[pair] in stored:
+                    self.set_vi(pair[0], pair[1], stored[keys[pair]])
+                    self.num_from_store += 1
+            todo = [pair for pair in todo if keys[pair] not in stored]
+        if todo:
+            jobs = [(compute_pair, (pair, self.fnames[pair[0]], self.fnames[pair[1]])) for pair in todo]
+            for row, stages in self.pool.imap_unordered(profiling.run_in_worker, jobs, chunksize=self.chunksize):
+                profiling.merge_worker_stages(stages)
+                (i, j), vi = row[0], row[3]
+                self.set_vi(i, j, vi)
+            self.num_computed += len(todo)
+            if self.store is not None:
+                # one transaction per batch
+                self.store.add_results([(keys[pair], self.known[pair[0]][pair[1]]) for pair in todo])
+        return [self.known[i][j] if i != j else 0.0 for i, j in pairs]
+
+    def set_vi(self, i, j, vi):
+        self.known[i][j] = self.known[j][i] = vi
+
+    def choose_pivots(self, runs, num_pivots, seed=None):
+        """Choose pivots among runs farthest first: a random run, then each time the run farthest
+        from the pivots so far. Costs num_pivots * (len(runs) - 1) VIs
+
+        :returns: (list of pivots, array of shape (number of pivots, len(runs)): VI from each pivot to each run)
+
+        """
+        rng = np.random.RandomState(seed)
+        runs = list(runs)
+        pivots, rows = [], []
+        nearest = np.full(len(runs), np.inf)
+        pos = rng.randint(len(runs)) if runs else None
+        for _ in range(min(num_pivots, len(runs))):
+            # one batch per pivot, so each worker keeps the pivot's clustering in its cache
+            rows.append(np.array(self.get_vi([(runs[pos], y) for y in runs])))
+            pivots.append(runs[pos])
+            nearest = np.minimum(nearest, rows[-1])
+            nearest[[runs.index(pivot) for pivot in pivots]] = -1
+            pos = int(np.argmax(nearest))
+            logger.debug("Pivot {}: {}".format(len(pivots), self.fnames[pivots[-1]]))
+        return pivots, np.array(rows).reshape(len(rows), len(runs))
+
+    def get_lower_bounds(self, x, runs, pivots, pivot_vi):
+        """Lower bounds of VI(x, y) for each y in runs: exact where the VI is known, from the pivots otherwise
+
+        :runs: array of run indices
+        :pivot_vi: VI from each pivot to each of runs (see choose_pivots)
+
+        """
+        if len(pivots):
+            x_vi = np.array(self.get_vi([(x, pivot) for pivot in pivots]))
+            bounds = np.abs(pivot_vi - x_vi[:, None]).max(axis=0)
+        else:
+            bounds = np.zeros(len(runs))
+        known = self.known[x]
+        if known:
+            for k, y in enumerate(runs.tolist()):
+                if y in known:
+                    bounds[k] = known[y]
+        bounds[runs == x] = 0.0
+        return bounds
+
+    def find_medoid(self, members, num_pivots=4, seed=None):
+        """Run with the smallest total VI to the other members
+
+        Candidates are taken in order of their lower bound total (from a heap; bounds only grow as
+        VIs are computed, so a stale bound is still a bound). A candidate is dropped as soon as its
+        VIs so far plus the lower bounds of the rest reach the best total, and the search stops when
+        the smallest bound total does. A candidate whose total is computed in full becomes a pivot.
+
+        :members: indices of the runs
+        :returns: (index of the medoid, its total VI to the other members)
+
+        """
+        members = np.asarray(members)
+        pivots, pivot_vi = self.choose_pivots(members, num_pivots, seed)
+        best, best_total = None, np.inf
+        for pivot, row in zip(pivots, pivot_vi):
+            if row.sum() < best_total:
+                best, best_total = pivot, row.sum()
+        heap = [(self.get_lower_bounds(x, members, pivots, pivot_vi).sum(), x) for x in members.tolist() if x not in pivots]
+        heapq.heapify(heap)
+        while heap and heap[0][0] < best_total:
+            _, x = heapq.heappop(heap)
+            bounds = self.get_lower_bounds(x, members, pivots, pivot_vi)
+            if heap and bounds.sum() > heap[0][0]:
+                # tighter now, with the VIs computed since. another candidate may come first
+                heapq.heappush(heap, (bounds.sum(), x))
+                continue
+            # the largest bounds first, so a losing candidate is dropped early
+            order = np.argsort(-bounds, kind='mergesort')
+            remaining = bounds.sum()
+            total = 0.0
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start+self.batch_size]
+                total += sum(self.get_vi([(x, y) for y in members[batch].tolist()]))
+                remaining -= bounds[batch].sum()
+                if total + remaining >= best_total:
+                    break
+            else:
+                best, best_total = x, total
+                pivots.append(x)
+                pivot_vi = np.vstack([pivot_vi, self.get_vi([(x, y) for y in members.tolist()])])
+        return best, best_total
+
+    def find_nearest(self, query, runs, pivots, pivot_vi, k):
+        """The k runs with the smallest VI to query, trying them in order of lower bound
+        and stopping when the next bound is no smaller than the k-th VI so far
+
+        :runs: array of run indices
+        :returns: list of (VI, index), smallest first
+
+        """
+        candidates = runs != query
+        bounds = self.get_lower_bounds(query, runs, pivots, pivot_vi)[candidates]
+        candidates = runs[candidates]
+        order = np.argsort(bounds, kind='mergesort')
+        # max-heap of the k nearest so far, as (-VI, index)
+        nearest = []
+        start = 0
+        while start < len(order):
+            kth = -nearest[0][0] if len(nearest) == k else np.inf
+            if bounds[order[start]] >= kth:
+                break
+            stop = start
+            while stop < len(order) and stop - start < self.batch_size and bounds[order[stop]] < kth:
+                stop += 1
+            batch = candidates[order[start:stop]].tolist()
+            for y, vi in zip(batch, self.get_vi([(query, y) for y in batch])):
+                if len(nearest) < k:
+                    heapq.heappush(nearest, (-vi, y))
+                elif vi < -nearest[0][0]:
+                    heapq.heapreplace(nearest, (-vi, y))
+            start = stop
+        return sorted((-vi, y) for vi, y in nearest)
+
+    def log_comparisons(self, num_full):
+        """Log the number of VIs the search needed, against num_full for the full sweep"""
+        num_used = self.num_computed + self.num_from_store
+        num_skipped = max(num_full - num_used, 0)
+        logger.info("{} VIs computed and {} read from the store, of the {} pairs a full sweep would compare ({} skipped, {:.1f}%)".format(
+            self.num_computed, self.num_from_store, num_full, num_skipped, 100.0 * num_skipped / num_full if num_full else 0.0))
+
+def get_method_fnames(basedir, methods):
+    """:returns: (list of tree filenames, OrderedDict {method: list of their indices})"""
+    fnames = []
+    members = OrderedDict()
+    for method in methods:
+        method_fnames = sorted(get_fnames(method, basedir))
+        members[method] = list(range(len(fnames), len(fnames) + len(method_fnames)))
+        fnames.extend(method_fnames)
+    return fnames, members
+
+def search_medoids(search, members, outf, num_pivots=4, seed=None):
+    """Find the medoid of each method's runs
+
+    :returns: number of pairs a full sweep would compare
+    """
+    writer = csv.writer(outf, lineterminator='\n')
+    writer.writerow(MEDOID_HEADER)
+    num_full = 0
+    for method, indices in members.items():
+        if not indices:
+            continue
+        medoid, total = search.find_medoid(indices, num_pivots, seed)
+        num_full += len(indices) * (len(indices) - 1) // 2
+        mean_vi = total / (len(indices) - 1) if len(indices) > 1 else 0.0
+        logger.info("{}: medoid of {} runs is {} (mean VI {:.4f})".format(method, len(indices), search.fnames[medoid], mean_vi))
+        with profiling.stage('output'):
+            writer.writerow([method, search.fnames[medoid], mean_vi, len(indices)])
+    return num_full
+
+def search_nearest(search, queries, runs, k, outf, num_pivots=4, seed=None):
+    """Find the k nearest runs to each query. The pivots are shared by all of the queries
+
+    :returns: number of pairs a full sweep would compare
+    """
+    runs = np.asarray(runs)
+    pivots, pivot_vi = search.choose_pivots(runs, num_pivots, seed)
+    writer = csv.writer(outf, lineterminator='\n')
+    writer.writerow(NEAREST_HEADER)
+    num_full = 0
+    for query in queries:
+        nearest = search.find_nearest(query, runs, pivots, pivot_vi, k)
+        num_full += int((runs != query).sum())
+        with profiling.stage('output'):
+            for rank, (vi, y) in enumerate(nearest, start=1):
+                writer.writerow([search.fnames[query], rank, search.fnames[y], vi])
+    return num_full
+
+def main(args):
+    profiling.start_from_args('vi_search', args)
+    fnames, members = get_method_fnames(args.basedir, args.methods)
+    runs = list(range(len(fnames)))
+    queries = []
+    if args.command == 'nearest':
+        if not args.queries:
+            raise RuntimeError("nearest needs at least one query tree file")
+        for query in args.queries:
+            query = os.path.abspath(query)
+            if query not in fnames:
+                fnames.append(query)
+            queries.append(fnames.index(query))
+    logger.info("{} tree files".format(len(fnames)))
+    processes = args.processes or multiprocessing.cpu_count()
+    # room for every pivot's clustering, plus the runs being compared to them
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(args.cache_dir, max(args.worker_cache_size, args.pivots + 2)))
+    store = VIStore(args.store) if args.store else None
+    try:
+        search = PivotSearch(fnames, pool, store=store, batch_size=args.batch_size)
+        if args.command == 'medoid':
+            num_full = search_medoids(search, members, args.output, args.pivots, args.seed)
+        else:
+            num_full = search_nearest(search, queries, runs, args.k, args.output, args.pivots, args.seed)
+        search.log_comparisons(num_full)
+    finally:
+        pool.close()
+        pool.join()
+        if store is not None:
+            store.close()
+    profiling.finish_run(profiling.get_report_fname(os.getcwd(), 'vi_search'))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Find the medoid run of each method, or the runs nearest to a given run, by VI without comparing every pair: VI from a few pivot runs gives lower bounds (triangle inequality) that rule most pairs out. Reports how many comparisons were skipped")
+    parser.add_argument("command", choices=['medoid', 'nearest'], help="medoid: output the run of each method with the smallest mean VI to the method's other runs. nearest: output the k runs with the smallest VI to each query run")
+    parser.add_argument("queries", nargs='*', help="with nearest: tree files to find the nearest runs to")
+    parser.add_argument("--basedir", default='.', help="directory containing the method directories (default: current directory)")
+    parser.add_argument("--methods", nargs='+', default=METHODS, help="method directories to search (default: {})".format(" ".join(METHODS)))
+    parser.add_argument("-k", type=int, default=10, help="with nearest: number of runs to output")
+    parser.add_argument("--pivots", type=int, default=4, help="number of pivot runs chosen up front. each costs one VI per run and tightens the bounds. worth more with many queries or a store that already has their VIs")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the first pivot")
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'), default=sys.stdout, help="output filename (csv)")
+    parser.add_argument("-p", "--processes", type=int, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--batch-size", type=int, default=64, help="number of VIs computed in parallel at a time. smaller batches prune more, larger ones keep the workers busy")
+    parser.add_argument("--worker-cache-size", type=int, default=4, help="number of parsed clusterings each worker keeps in memory (at least the number of pivots + 2)")
+    parser.add_argument("--store", help="VI result store (SQLite, see vi_store.py) to read known VIs from and add new ones to")
+    parser.add_argument("--cache-dir", help="base directory for tree caches (default: next to each tree file)")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
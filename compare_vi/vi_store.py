@@ -0,0 +1,258 @@
+import sys, os, time, csv, sqlite3
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from manifest import get_file_hash
+from get_all_tree_fnames_combinations import METHODS
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    # content hash of each tree file seen, so unchanged files (same size and mtime) aren't hashed again
+    """CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY,
+        method TEXT,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        sha1 TEXT NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS files_method ON files (method)",
+    # one row per unordered pair of contents: sha1_left <= sha1_right
+    """CREATE TABLE IF NOT EXISTS results (
+        sha1_left TEXT NOT NULL,
+        sha1_right TEXT NOT NULL,
+        measure TEXT NOT NULL,
+        value REAL NOT NULL,
+        time REAL NOT NULL,
+        PRIMARY KEY (sha1_left, sha1_right, measure))""",
+    ]
+
+# value of each measure (see vi_compare.MEASURES) for two identical clusterings
+IDENTICAL_VALUES = {'vi': 0.0, 'nmi': 1.0, 'rand': 1.0, 'adjusted_rand': 1.0, 'split_join': 0.0}
+
+def get_method(fname, methods=METHODS):
+    """Method of a tree file: the last directory in its path that is a method name, or None"""
+    for name in reversed(os.path.abspath(fname).split(os.sep)[:-1]):
+        if name in methods:
+            return name
+    return None
+
+def get_pair_key(sha1_a, sha1_b):
+    """Key of an unordered pair of tree contents. VI is symmetric, so (a, b) and (b, a) are the same pair"""
+    return (sha1_a, sha1_b) if sha1_a <= sha1_b else (sha1_b, sha1_a)
+
+class VIStore(object):
+    """SQLite database of VI results, keyed by the unordered pair of the tree files' content hashes
+    (so a pair is found again after the files are moved, copied, or sampled in another order) and the measure
+
+    Results are added in batches, one transaction each, so a job that is killed loses at most the
+    batch it was writing and the database is never left half written. Several jobs can share a
+    database: writers wait for each other's transactions (up to timeout seconds).
+
+    """
+    def __init__(self, fname, timeout=600):
+        self.fname = fname
+        self.conn = sqlite3.connect(fname, timeout=timeout)
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+        # sha1 of paths looked up (or hashed) by this process
+        self.hashes = {}
+
+    def close(self):
+        self.conn.close()
+
+    def get_hashes(self, fnames, pool=None):
+        """Content hash of each tree file, hashing only files that are new or changed since they were last seen
+
+        :pool: multiprocessing pool to hash the files in, if given
+        :returns: dict {absolute path: sha1}
+
+        """
+        paths = [os.path.abspath(fname) for fname in fnames if os.path.abspath(fname) not in self.hashes]
+        known = {}
+        for i in range(0, len(paths), 500):
+            batch = paths[i:i+500]
+            rows = self.conn.execute("SELECT path, size, mtime, sha1 FROM files WHERE path IN ({})".format(",".join("?" * len(batch))), batch)
+            known.update((path, (size, mtime, sha1)) for path, size, mtime, sha1 in rows)
+        stats = {}
+        for path in paths:
+            st = os.stat(path)
+            entry = known.get(path)
+            if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime:
+                self.hashes[path] = entry[2]
+            else:
+                stats[path] = st
+        to_hash = sorted(stats)
+        if to_hash:
+            logger.info("Hashing {} tree files".format(len(to_hash)))
+        new = []
+        for path, sha1 in zip(to_hash, pool.imap(get_file_hash, to_hash) if pool is not None else map(get_file_hash, to_hash)):
+            self.hashes[path] = sha1
+            new.append( (path, get_method(path), stats[path].st_size, stats[path].st_mtime, sha1) )
+        if new:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO files (path, method, size, mtime, sha1) VALUES (?, ?, ?, ?, ?)", new)
+        return dict((os.path.abspath(fname), self.hashes[os.path.abspath(fname)]) for fname in fnames)
+
+    def get_pair_keys(self, pairs):
+        """Pair keys for (fname_left, fname_right) pairs (see get_pair_key)"""
+        hashes = self.get_hashes(set(fname for pair in pairs for fname in pair))
+        return [get_pair_key(hashes[os.path.abspath(a)], hashes[os.path.abspath(b)]) for a, b in pairs]
+
+    def get_results(self, keys, measure='vi'):
+        """Stored results for pair keys
+
+        :returns: dict {pair key: value} for the keys that are in the store
+
+        """
+        keys = list(set(keys))
+        results = {}
+        for i in range(0, len(keys), 400):
+            batch = keys[i:i+400]
+            where = " OR ".join(["(sha1_left = ? AND sha1_right = ?)"] * len(batch))
+            params = [x for key in batch for x in key] + [measure]
+            rows = self.conn.execute("SELECT sha1_left, sha1_right, value FROM results WHERE ({}) AND measure = ?".format(where), params)
+            results.update(((left, right), value) for left, right, value in rows)
+        return results
+
+    def add_results(self, rows, measure='vi'):
+        """Add results in one transaction
+
+        :rows: list of (pair key, value)
+
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO results (sha1_left, sha1_right, measure, value, time) VALUES (?, ?, ?, ?, ?)",
+                    [(key[0], key[1], measure, value, now) for key, value in rows])
+
+    def add_results_by_measure(self, rows):
+        """Add results of several measures in one transaction
+
+        :rows: list of (pair key, dict {measure: value})
+
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO results (sha1_left, sha1_right, measure, value, time) VALUES (?, ?, ?, ?, ?)",
+                    [(key[0], key[1], measure, value, now) for key, values in rows for measure, value in values.items()])
+
+    def get_fnames(self, methods=None):
+        """Paths of the tree files seen, of the given methods (default: all), sorted"""
+        if methods is None:
+            rows = self.conn.execute("SELECT path FROM files ORDER BY path")
+        else:
+            rows = self.conn.execute("SELECT path FROM files WHERE method IN ({}) ORDER BY path".format(",".join("?" * len(methods))), list(methods))
+        return [row[0] for row in rows]
+
+    def get_vi_matrix(self, fnames, measure='vi'):
+        """Matrix of the stored results for every pair of tree files. Pairs not in the store are NaN
+
+        :returns: float64 array of shape (len(fnames), len(fnames))
+
+        """
+        hashes = self.get_hashes(fnames)
+        index = {}
+        for i, fname in enumerate(fnames):
+            index.setdefault(hashes[os.path.abspath(fname)], []).append(i)
+        vi_matrix = np.full((len(fnames), len(fnames)), np.nan)
+        for sha1, rows in index.items():
+            # same contents
+            vi_matrix[np.ix_(rows, rows)] = IDENTICAL_VALUES.get(measure, np.nan)
+        sha1s = sorted(index)
+        for i in range(0, len(sha1s), 400):
+            batch = sha1s[i:i+400]
+            for left, right, value in self.conn.execute("SELECT sha1_left, sha1_right, value FROM results WHERE sha1_left IN ({}) AND measure = ?".format(",".join("?" * len(batch))), batch + [measure]):
+                if right in index:
+                    vi_matrix[np.ix_(index[left], index[right])] = value
+                    vi_matrix[np.ix_(index[right], index[left])] = value
+        return vi_matrix
+
+    def count(self, measure='vi'):
+        return self.conn.execute("SELECT COUNT(*) FROM results WHERE measure = ?", (measure,)).fetchone()[0]
+
+def read_result_rows(fname):
+    """Read VI results from csv output of get_vi_parallel.py (idx, fname_left, fname_right, then one column
+    per measure; with header) or get_vi_from_csv_rownum.py (fname_left, fname_right, vi; no header)
+
+    :returns: list of (fname_left, fname_right, dict {measure: value})
+
+    """
+    rows = []
+    measures = ['vi']
+    with open(fname, 'r') as f:
+        for row in csv.reader(f):
+            if row and row[0] == 'idx':
+                # get_vi_parallel.py header: idx, fname_left, fname_right, then one column per measure
+                measures = row[3:]
+                continue
+            if len(row) < 2 + len(measures):
+                continue
+            try:
+                values = dict(zip(measures, [float(x) for x in row[-len(measures):]]))
+            except ValueError:
+                # partly written last line
+                continue
+            rows.append( (row[-len(measures)-2], row[-len(measures)-1], values) )
+    return rows
+
+def import_results(store, fnames, batch_size=10000):
+    """Add the VI results in csv files to the store
+
+    :returns: number of results added
+
+    """
+    num_added = 0
+    for fname in fnames:
+        rows = [row for row in read_result_rows(fname) if os.path.exists(row[0]) and os.path.exists(row[1])]
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i+batch_size]
+            keys = store.get_pair_keys([(a, b) for a, b, values in batch])
+            store.add_results_by_measure(list(zip(keys, [values for a, b, values in batch])))
+            num_added += len(batch)
+        logger.debug("{}: {} results".format(fname, len(rows)))
+    return num_added
+
+def main(args):
+    store = VIStore(args.store)
+    try:
+        if args.command == 'import':
+            num_added = import_results(store, args.input)
+            logger.info("Added {} results to {}".format(num_added, args.store))
+        elif args.command == 'matrix':
+            from vi_compare import output_vi_matrix
+            fnames = store.get_fnames(args.methods)
+            vi_matrix = store.get_vi_matrix(fnames, args.measure)
+            logger.info("{} tree files. {} of {} pairs in the store".format(len(fnames), int((~np.isnan(vi_matrix)).sum() - len(fnames)) // 2, len(fnames) * (len(fnames) - 1) // 2))
+            output_vi_matrix(vi_matrix, fnames, args.output)
+        logger.info("{}: {} tree files, {} {} results".format(args.store, len(store.get_fnames()), store.count(args.measure), args.measure))
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Manage the VI result store (SQLite, keyed by the content hashes of the tree files) used by get_vi_parallel.py and get_vi_from_csv_rownum.py with --store: import existing csv results, or output the VI matrix of the stored tree files of some methods")
+    parser.add_argument("command", choices=['import', 'matrix', 'info'], help="import: add the results in csv files (get_vi_parallel.py or get_vi_from_csv_rownum.py output). matrix: output the VI matrix (NaN for pairs not computed yet). info: show the number of results")
+    parser.add_argument("store", help="result store filename (SQLite)")
+    parser.add_argument("input", nargs='*', help="with import: csv files of VI results")
+    parser.add_argument("--methods", nargs='+', help="with matrix: methods whose tree files to include (default: all)")
+    parser.add_argument("--measure", choices=sorted(IDENTICAL_VALUES), default='vi', help="with matrix: measure to output (default: vi)")
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'), default=sys.stdout, help="with matrix: output filename (csv)")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
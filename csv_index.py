@@ -0,0 +1,128 @@
+import sys, os, time, struct
+from datetime import datetime
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The index sidecar for a csv is '<csv filename>.idx': one little-endian int64 byte offset per
+# data row (header excluded), followed by the offset of the end of the file. Row i is the bytes
+# between offsets i and i+1, so any row or range of rows can be read with two seeks.
+# The last offset is the size of the csv it was built for, which is how a stale index is detected.
+INDEX_SUFFIX = '.idx'
+OFFSET_SIZE = 8
+
+def get_index_fname(csvfilename):
+    return csvfilename + INDEX_SUFFIX
+
+def write_csv_with_index(lines, csvfilename, header=None):
+    """Write csv lines and their index sidecar
+
+    :lines: iterable of lines (str, each ending in a newline)
+    :csvfilename: output csv filename
+    :header: optional header line (not indexed)
+    :returns: number of rows written
+
+    """
+    num_rows = 0
+    tmp_fname = get_index_fname(csvfilename) + '.tmp'
+    # the csv is closed before the index is moved into place, so the index never describes a partly written csv
+    with open(tmp_fname, 'wb') as idxf:
+        with open(csvfilename, 'wb') as outf:
+            pos = 0
+            if header:
+                data = header.encode('utf-8')
+                outf.write(data)
+                pos += len(data)
+            for line in lines:
+                data = line.encode('utf-8')
+                idxf.write(struct.pack('<q', pos))
+                outf.write(data)
+                pos += len(data)
+                num_rows += 1
+        idxf.write(struct.pack('<q', pos))
+    os.rename(tmp_fname, get_index_fname(csvfilename))
+    return num_rows
+
+def build_index(csvfilename, header=False):
+    """Write the index sidecar for an existing csv file (one pass over the file)
+
+    :csvfilename: csv filename
+    :header: True if the first line is a header
+    :returns: number of rows indexed
+
+    """
+    num_rows = 0
+    tmp_fname = get_index_fname(csvfilename) + '.tmp'
+    with open(csvfilename, 'rb') as f, open(tmp_fname, 'wb') as idxf:
+        pos = 0
+        if header:
+            pos += len(f.readline())
+        for line in f:
+            idxf.write(struct.pack('<q', pos))
+            pos += len(line)
+            num_rows += 1
+        idxf.write(struct.pack('<q', pos))
+    os.rename(tmp_fname, get_index_fname(csvfilename))
+    return num_rows
+
+def index_is_fresh(csvfilename):
+    """True if the csv has an index that was built for its current contents (its last offset is the csv's size)"""
+    index_fname = get_index_fname(csvfilename)
+    if not os.path.exists(index_fname) or os.path.getsize(index_fname) < OFFSET_SIZE:
+        return False
+    with open(index_fname, 'rb') as idxf:
+        idxf.seek(-OFFSET_SIZE, os.SEEK_END)
+        end = struct.unpack('<q', idxf.read(OFFSET_SIZE))[0]
+    return end == os.path.getsize(csvfilename)
+
+def get_num_rows(csvfilename):
+    return os.path.getsize(get_index_fname(csvfilename)) // OFFSET_SIZE - 1
+
+def read_rows(csvfilename, start, stop=None):
+    """Read a contiguous range of data rows using the index sidecar
+
+    :csvfilename: csv filename (must have an index, see build_index)
+    :start: first row number (0 is the first row after any header)
+    :stop: row number to stop before (default: start+1)
+    :returns: list of lines (str, without the trailing newline)
+
+    """
+    if stop is None:
+        stop = start + 1
+    num_rows = get_num_rows(csvfilename)
+    stop = min(stop, num_rows)
+    if start < 0 or start >= stop:
+        return []
+    with open(get_index_fname(csvfilename), 'rb') as idxf:
+        idxf.seek(start * OFFSET_SIZE)
+        data = idxf.read((stop - start + 1) * OFFSET_SIZE)
+    offsets = struct.unpack('<{}q'.format(stop - start + 1), data)
+    with open(csvfilename, 'rb') as f:
+        f.seek(offsets[0])
+        data = f.read(offsets[-1] - offsets[0])
+    return data.decode('utf-8').splitlines()
+
+def main(args):
+    num_rows = build_index(args.csvfilename, header=args.header)
+    logger.info("Indexed {} rows: {}".format(num_rows, get_index_fname(args.csvfilename)))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the byte offset index sidecar ('<csv>.idx') for a csv file, so rows can be looked up by row number without scanning the file")
+    parser.add_argument("csvfilename", help="csv file to index")
+    parser.add_argument("--header", action='store_true', help="the first line is a header")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
@@ -2,6 +2,8 @@ import sys, os, time, fnmatch
 from datetime import datetime
 import itertools
 
+from csv_index import write_csv_with_index
+from tree_reader import is_tree_fname
 
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
@@ -13,18 +15,18 @@ def get_fnames(method):
     # https://stackoverflow.com/questions/2186525/use-a-glob-to-find-files-recursively-in-python
     matches = []
     for root, dirname, filenames in os.walk(method):
-        for filename in fnmatch.filter(filenames, "*.tree"):
+        for filename in filter(is_tree_fname, filenames):
             matches.append(os.path.join(root, filename))
     return matches
 
+def iter_combination_lines(fnames, sep=','):
+    for i, (a, b) in enumerate(itertools.combinations(fnames, 2)):
+        yield "{}{}{}{}{}\n".format(i, sep, a, sep, b)
+
 def output_combinations(fnames, outfname, sep=','):
-    with open(outfname, 'w') as outf:
-        i = 0
-        for a, b in itertools.combinations(fnames, 2):
-            outf.write("{}{}".format(i, sep))
-            outf.write("{}{}".format(a, sep))
-            outf.write("{}\n".format(b))
-            i += 1
+    # also writes the index sidecar (outfname + '.idx') for row lookups, see csv_index.py
+    num_rows = write_csv_with_index(iter_combination_lines(fnames, sep), outfname)
+    logger.debug("Wrote {} combinations to {}".format(num_rows, outfname))
 
 def main(args):
     methods = [
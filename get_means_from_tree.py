@@ -2,12 +2,28 @@ import sys, os, time
 from collections import defaultdict, Counter
 from datetime import datetime
 
+import numpy as np
+
+from tree_cache import load_fresh_cache
+from tree_reader import read_tree_chunks, BLOCKSIZE
+from cluster_index import ClusterIndex
+from parallel_tree import map_tree_ranges
+from pubyear_index import PubyearIndex, get_pubyear_index
+import profiling
+from profiling import stage
+
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
         datefmt="%H:%M:%S",
         level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# bump when the outputs change, so batch runs (see manifest.py) recompute them
+ANALYZER_VERSION = 1
+
+# pubyear index for the workers of analyze_tree_vectorized
+_pubyear = None
+
 def get_pubyear(fname):
     """Get dictionary mapping paper ID to publication year
 
@@ -15,10 +31,10 @@ def get_pubyear(fname):
     :returns: pubyear (dict)
 
     """
-    start = time.time()
     logger.debug("Parsing publication year file...")
     pubyear = {}
-    with open(fname, 'r') as f:
+    with stage('pubyear_load') as stats, open(fname, 'r') as f:
+        num_lines = 0
         for line in f:
             line = line.strip().split(',')
             pid = int(line[0])
@@ -27,65 +43,279 @@ def get_pubyear(fname):
             except ValueError:
                 year = line[1]
             pubyear[pid] = year
-    end = time.time()
-    logger.debug("Done. Took {:2f} seconds.".format(end-start))
+            num_lines += 1
+        stats.add(bytes=os.path.getsize(fname), lines=num_lines, nodes=len(pubyear))
     logger.debug("Length of pubyear dict: {}.\n".format(len(pubyear)))
     return pubyear
 
-def analyze_tree(fname, pubyear):
+def get_years(pubyear, pids):
+    """Get the publication years for a chunk of paper IDs
+
+    :pubyear: PubyearIndex (one vectorized lookup for the whole chunk) or dictionary mapping paper id to publication year
+    :pids: list or array of paper IDs
+    :returns: list of years, None where the year is unknown
+
+    """
+    if isinstance(pubyear, PubyearIndex):
+        return [year if year > 0 else None for year in pubyear.lookup(pids).tolist()]
+    return [pubyear.get(pid) for pid in pids]
+
+def analyze_tree(fname, pubyear, cache_dir=None, blocksize=BLOCKSIZE):
     """From the tree file, get the data needed to analyze
 
     :fname: filename of the tree file
-    :pubyear: dictionary mapping paper id to publication year
+    :pubyear: PubyearIndex, or dictionary mapping paper id to publication year
+    :cache_dir: base directory for tree caches. if there is a fresh cache (see tree_cache.py), the text is not parsed
+    :blocksize: bytes of the tree file read (and years looked up) at a time
     :returns: (
                 num_nodes: Counter(year: number of nodes),
                 rank_total: Counter(year: sum of rank),
                 depth_counts: defaultdict(year: Counter(depth: count of nodes)),
-                size_total: defaultdict(year: Counter(cluster name: number of nodes)))
+                size_total: defaultdict(year: Counter(cluster ID: number of nodes)))
                 )
+              cluster IDs are from a ClusterIndex of the tree (see cluster_index.py)
 
     """
-    start = time.time()
+    columns = load_fresh_cache(fname, cache_dir)
+    if columns is not None:
+        return analyze_tree_columns(columns, pubyear)
+
     logger.debug("Analyzing tree file...")
-    i = 0
     num_nodes = Counter()
     rank_total = Counter()
     depth_counts = defaultdict(Counter)
     size_total = defaultdict(Counter)
 
-    with open(fname, 'r') as f:
-        for line in f:
-            i += 1
-            if line[0] == "#":
-                continue
-            line = line.strip().split(' ')
+    index = ClusterIndex()
+    for chunk in read_tree_chunks(fname, blocksize):
+        with stage('aggregate') as stats:
+            stats.add(nodes=len(chunk['pid']))
+            years = get_years(pubyear, chunk['pid'])
+            modules = index.add_modules(chunk['module']).tolist()
+            for year, rank, depth, belongs_to in zip(years, chunk['flow'].tolist(), chunk['depth'].tolist(), modules):
+                if not year:
+                    continue
+
+                # Get depth
+                depth_counts[year][depth] += 1
+
+                # Add to running size total
+                size_total[year][belongs_to] += 1
+
+                # Add to running rank total
+                rank_total[year] += rank
 
-            pid = int(line[2].strip('"'))
-            year = pubyear.get(pid)
+                # Add to running total of papers per year
+                num_nodes[year] += 1
+
+    logger.debug("Total number of nodes: {}.\n".format(sum(num_nodes.values())))
+    return num_nodes, rank_total, depth_counts, size_total
+
+def analyze_tree_columns(columns, pubyear):
+    """Same as analyze_tree, but from the columns of a tree cache
+
+    :columns: dict of arrays (see tree_cache.parse_tree_columns)
+    :pubyear: PubyearIndex, or dictionary mapping paper id to publication year
+    :returns: same as analyze_tree
+
+    """
+    logger.debug("Analyzing tree cache...")
+    num_nodes = Counter()
+    rank_total = Counter()
+    depth_counts = defaultdict(Counter)
+    size_total = defaultdict(Counter)
+
+    with stage('aggregate') as stats:
+        stats.add(nodes=len(columns['pid']))
+        years = get_years(pubyear, columns['pid'])
+        rows = zip(years, columns['flow'].tolist(), columns['depth'].tolist(), columns['module'].tolist())
+        for year, rank, depth, belongs_to in rows:
             if not year:
                 continue
+            depth_counts[year][depth] += 1
+            size_total[year][belongs_to] += 1
+            rank_total[year] += rank
+            num_nodes[year] += 1
 
-            # Get cluster
-            cl = line[0]
-            cl = cl.split(':')
+    logger.debug("Total number of nodes: {}.\n".format(sum(num_nodes.values())))
+    return num_nodes, rank_total, depth_counts, size_total
 
-            # Get depth
-            depth = len(cl)
-            depth_counts[year][depth] += 1
+class YearBincounts(object):
+    """Per-year totals for analyze_tree_vectorized, accumulated one chunk of nodes at a time with np.bincount
 
-            # Add to running size total
-            belongs_to = ":".join(cl[:-1])
-            size_total[year][belongs_to] += 1
+    Node counts, rank sums and depth histograms are arrays indexed by year (and depth). The
+    (year, cluster ID) pair of every node is kept, and the cluster sizes are counted in one
+    grouped count at the end. Totals from different parts of a tree can be merged.
 
-            # Add to running rank total
-            rank = float(line[1])
-            rank_total[year] += rank
+    """
+    def __init__(self):
+        self.num_nodes = np.zeros(0, dtype=np.int64)
+        self.rank_total = np.zeros(0, dtype=np.float64)
+        # [year, depth]
+        self.depth_counts = np.zeros((0, 0), dtype=np.int64)
+        # (year, cluster ID) pairs, and how many nodes each pair stands for (None: one each)
+        self.years = []
+        self.codes = []
+        self.counts = []
 
-            # Add to running total of papers per year
-            num_nodes[year] += 1
+    def grow(self, num_years, num_depths):
+        if num_years > len(self.num_nodes):
+            extra = num_years - len(self.num_nodes)
+            self.num_nodes = np.concatenate([self.num_nodes, np.zeros(extra, dtype=np.int64)])
+            self.rank_total = np.concatenate([self.rank_total, np.zeros(extra, dtype=np.float64)])
+        depth_counts = np.zeros((num_years, num_depths), dtype=np.int64)
+        depth_counts[:self.depth_counts.shape[0], :self.depth_counts.shape[1]] = self.depth_counts
+        self.depth_counts = depth_counts
+
+    def update(self, years, ranks, depths, codes):
+        """
+        :years: int array of publication years, 0 or less where unknown (those nodes are skipped, as in analyze_tree)
+        :ranks: float64 array of flows
+        :depths: int array of depths
+        :codes: int array of the cluster IDs of the nodes' modules
+
+        """
+        known = years > 0
+        years = years[known].astype(np.int64)
+        if not len(years):
+            return
+        ranks = ranks[known]
+        depths = depths[known].astype(np.int64)
+        num_years = max(len(self.num_nodes), int(years.max()) + 1)
+        num_depths = max(self.depth_counts.shape[1], int(depths.max()) + 1)
+        if num_years > len(self.num_nodes) or num_depths > self.depth_counts.shape[1]:
+            self.grow(num_years, num_depths)
+        self.num_nodes += np.bincount(years, minlength=num_years)
+        # start from the running totals so the ranks are summed in file order, the same as analyze_tree
+        self.rank_total = np.bincount(np.concatenate([np.arange(num_years), years]),
+                weights=np.concatenate([self.rank_total, ranks]), minlength=num_years)
+        self.depth_counts += np.bincount(years * num_depths + depths, minlength=num_years * num_depths).reshape(num_years, num_depths)
+        self.years.append(years)
+        self.codes.append(codes[known].astype(np.int64))
+        self.counts.append(None)
+
+    def get_pairs(self):
+        """
+        :returns: (years, codes, counts): int64 arrays of the distinct (year, cluster ID) pairs and their numbers of nodes
+
+        """
+        if not self.years:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, empty
+        years = np.concatenate(self.years)
+        codes = np.concatenate(self.codes)
+        counts = np.concatenate([count if count is not None else np.ones(len(year), dtype=np.int64)
+            for year, count in zip(self.years, self.counts)])
+        num_codes = int(codes.max()) + 1
+        keys, inverse = np.unique(years * num_codes + codes, return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=counts).astype(np.int64)
+        return keys // num_codes, keys % num_codes, counts
 
-    end = time.time()
-    logger.debug("Done. Took {:2f} seconds.".format(end-start))
+    def compact(self):
+        """Collapse the (year, cluster ID) pairs kept so far, e.g. before sending the totals to another process"""
+        years, codes, counts = self.get_pairs()
+        self.years = [years]
+        self.codes = [codes]
+        self.counts = [counts]
+
+    def merge(self, other, code_map=None):
+        """Add the totals of another YearBincounts
+
+        :code_map: array mapping the other's cluster IDs to this one's (see ClusterIndex.add_clusters)
+
+        """
+        num_years = max(len(self.num_nodes), len(other.num_nodes))
+        num_depths = max(self.depth_counts.shape[1], other.depth_counts.shape[1])
+        if num_years > len(self.num_nodes) or num_depths > self.depth_counts.shape[1]:
+            self.grow(num_years, num_depths)
+        self.num_nodes[:len(other.num_nodes)] += other.num_nodes
+        self.rank_total[:len(other.rank_total)] += other.rank_total
+        self.depth_counts[:other.depth_counts.shape[0], :other.depth_counts.shape[1]] += other.depth_counts
+        for years, codes, counts in zip(other.years, other.codes, other.counts):
+            self.years.append(years)
+            self.codes.append(code_map[codes].astype(np.int64) if code_map is not None else codes)
+            self.counts.append(counts)
+
+    def results(self):
+        """
+        :returns: same as analyze_tree
+
+        """
+        num_nodes = Counter()
+        rank_total = Counter()
+        depth_counts = defaultdict(Counter)
+        size_total = defaultdict(Counter)
+        for year in np.flatnonzero(self.num_nodes).tolist():
+            num_nodes[year] = int(self.num_nodes[year])
+            rank_total[year] = float(self.rank_total[year])
+            row = self.depth_counts[year]
+            for depth in np.flatnonzero(row).tolist():
+                depth_counts[year][depth] = int(row[depth])
+        years, codes, counts = self.get_pairs()
+        for year, code, count in zip(years.tolist(), codes.tolist(), counts.tolist()):
+            size_total[year][code] = count
+        return num_nodes, rank_total, depth_counts, size_total
+
+def analyze_tree_range(job):
+    """Per-year totals for one byte range of a tree file (run in the workers of analyze_tree_vectorized)
+
+    :job: (fname, start, end)
+    :returns: (YearBincounts, cluster_parent, cluster_component): the totals, keyed by the IDs of the range's own ClusterIndex
+
+    """
+    fname, start, end = job
+    totals = YearBincounts()
+    index = ClusterIndex()
+    for chunk in read_tree_chunks(fname, start=start, end=end):
+        with stage('aggregate') as stats:
+            stats.add(nodes=len(chunk['pid']))
+            totals.update(_pubyear.lookup(chunk['pid']), chunk['flow'], chunk['depth'], index.add_modules(chunk['module']))
+    totals.compact()
+    clusters = index.arrays()
+    return totals, clusters['parent'], clusters['component']
+
+def analyze_tree_vectorized(fname, pubyear, cache_dir=None, blocksize=BLOCKSIZE, chunksize=1000000, processes=1):
+    """Same as analyze_tree, but with the per-year totals computed with numpy a chunk at a time
+    instead of node by node
+
+    :pubyear: PubyearIndex. with a dictionary, falls back to analyze_tree
+    :blocksize: bytes of the tree file read at a time
+    :chunksize: number of nodes taken at a time from a tree cache
+    :processes: if not 1 (0: the number of cores), byte ranges of the tree file are read in parallel and their totals
+                merged (see parallel_tree.py). rank sums are then added in a different order, so
+                the rank means can differ from analyze_tree in the last digits
+    :returns: same as analyze_tree
+
+    """
+    global _pubyear
+    if not isinstance(pubyear, PubyearIndex):
+        return analyze_tree(fname, pubyear, cache_dir=cache_dir, blocksize=blocksize)
+    logger.debug("Analyzing tree file (vectorized)...")
+    totals = YearBincounts()
+    columns = load_fresh_cache(fname, cache_dir)
+    if columns is None and processes != 1:
+        # set before the pool is created, so the forked workers share it
+        _pubyear = pubyear
+        index = ClusterIndex()
+        for part, cluster_parent, cluster_component in map_tree_ranges(fname, analyze_tree_range, processes):
+            with stage('aggregate'):
+                totals.merge(part, index.add_clusters(cluster_parent, cluster_component))
+    elif columns is not None:
+        for i in range(0, len(columns['pid']), chunksize):
+            with stage('aggregate') as stats:
+                stats.add(nodes=len(columns['pid'][i:i+chunksize]))
+                totals.update(pubyear.lookup(columns['pid'][i:i+chunksize]),
+                        np.asarray(columns['flow'][i:i+chunksize]),
+                        np.asarray(columns['depth'][i:i+chunksize]),
+                        np.asarray(columns['module'][i:i+chunksize]))
+    else:
+        index = ClusterIndex()
+        for chunk in read_tree_chunks(fname, blocksize):
+            with stage('aggregate') as stats:
+                stats.add(nodes=len(chunk['pid']))
+                totals.update(pubyear.lookup(chunk['pid']), chunk['flow'], chunk['depth'], index.add_modules(chunk['module']))
+    with stage('aggregate'):
+        num_nodes, rank_total, depth_counts, size_total = totals.results()
     logger.debug("Total number of nodes: {}.\n".format(sum(num_nodes.values())))
     return num_nodes, rank_total, depth_counts, size_total
 
@@ -110,13 +340,14 @@ def get_mean(counts_by_year):
 
     """
     d = {}
-    for year, counts_dict in counts_by_year.iteritems():
-        sum_this_year = 0
-        count_this_year = 0
-        for k, v in counts_dict.iteritems():
-            sum_this_year += (k * v)
-            count_this_year += v
-        d[year] = float(sum_this_year) / count_this_year
+    with stage('aggregate'):
+        for year, counts_dict in counts_by_year.items():
+            sum_this_year = 0
+            count_this_year = 0
+            for k, v in counts_dict.items():
+                sum_this_year += (k * v)
+                count_this_year += v
+            d[year] = float(sum_this_year) / count_this_year
     return d
 
 def get_size_mean(size_total):
@@ -127,9 +358,10 @@ def get_size_mean(size_total):
 
     """
     size_counts = defaultdict(Counter)
-    for year, cl_size in size_total.iteritems():
-        for cl, size in cl_size.iteritems():
-            size_counts[year][size] += 1
+    with stage('aggregate'):
+        for year, cl_size in size_total.items():
+            for cl, size in cl_size.items():
+                size_counts[year][size] += 1
     size_mean = get_mean(size_counts)
     return size_mean
 
@@ -146,13 +378,18 @@ def get_depth_mean(depth_counts):
 def output_csv(d, dirname, fname, extension='csv', sep=','):
     fname = os.path.join(dirname, "{}.{}".format(fname, extension))
     logger.debug("Writing to file: {}".format(fname))
-    with open(fname, 'w') as outf:
-        for k, v in d.iteritems():
+    with stage('output') as stats, open(fname, 'w') as outf:
+        for k, v in d.items():
             outf.write("{}{}{}\n".format(k, sep, v))
+        stats.add(lines=len(d))
 
 def main(args):
-    pubyear = get_pubyear(args.pubyears_fname)
-    num_nodes, rank_total, depth_counts, size_total = analyze_tree(args.tree_fname, pubyear)
+    profiling.start_from_args('get_means_from_tree', args)
+    pubyear = get_pubyear_index(args.pubyears_fname)
+    if args.vectorized or args.processes != 1:
+        num_nodes, rank_total, depth_counts, size_total = analyze_tree_vectorized(args.tree_fname, pubyear, cache_dir=args.cache_dir, processes=args.processes)
+    else:
+        num_nodes, rank_total, depth_counts, size_total = analyze_tree(args.tree_fname, pubyear, cache_dir=args.cache_dir)
     outdir = args.outdir
     label = args.label
     rank_mean = get_rank_mean(rank_total, num_nodes)
@@ -161,6 +398,7 @@ def main(args):
     output_csv(size_mean, dirname=os.path.join(outdir, "size_mean"), fname=label+"-size_mean")
     depth_mean = get_depth_mean(depth_counts)
     output_csv(depth_mean, dirname=os.path.join(outdir, "depth_mean"), fname=label+"-depth_mean")
+    profiling.finish_run(profiling.get_report_fname(outdir, label))
 
 if __name__ == "__main__":
     total_start = time.time()
@@ -172,6 +410,10 @@ if __name__ == "__main__":
     parser.add_argument("pubyears_fname", type=str, help="(comma-separated) file mapping paper id to publication year")
     parser.add_argument("-o", "--outdir", type=str, help="base directory for the output. must contain directories 'rank_mean', 'size_mean', and 'depth_mean'", default=os.path.dirname(__file__))
     parser.add_argument("--label", type=str, help="label for the output files--- e.g. 'EXAMPLE' will have output files 'EXAMPLE-rank_mean.csv', 'EXAMPLE-size_mean.csv', 'EXAMPLE-depth_mean'")
+    parser.add_argument("--cache-dir", type=str, help="base directory for tree caches made by tree_cache.py (default: next to the tree file)")
+    parser.add_argument("--vectorized", action='store_true', help="compute the per-year totals with numpy a chunk of nodes at a time (same outputs)")
+    parser.add_argument("-p", "--processes", type=int, default=1, help="number of processes reading parts of the tree file in parallel (implies --vectorized. 0: number of cores)")
+    profiling.add_arguments(parser)
     parser.add_argument("--debug", action='store_true', help="output debugging info")
     global args
     args = parser.parse_args()
@@ -0,0 +1,208 @@
+import sys, os, time
+from datetime import datetime
+import multiprocessing
+
+from get_all_tree_fnames import get_fnames
+from pubyear_index import get_pubyear_index
+import get_means_from_tree
+import get_size_and_depth_from_tree
+from tree_analyzer import YearMeansAccumulator, SizeDepthAccumulator, analyze_tree_once
+from manifest import Manifest, get_file_signature
+from result_store import ResultStore, get_records
+import profiling
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+METHODS = [
+            'undirdir',
+            'pagerank',
+            'outdirdir',
+            'pagerank_unrecorded'
+        ]
+MEASURES = ['rank_mean', 'size_mean', 'depth_mean']
+SIZE_DEPTH_DIR = 'size_and_depth_counts'
+SIZE_DEPTH_OUTPUTS = ['node_size_depth', 'size_counts', 'depth_counts']
+
+# Read-only state for the workers. It is set before the pool is created, so forked workers
+# share it with the parent instead of each loading the pubyear file.
+_pubyear = None
+_cache_dir = None
+_use_manifest = False
+_node_size_depth_format = 'csv'
+_use_store = False
+
+def get_jobs(basedir, methods=METHODS):
+    """Get the tree files to process
+
+    :returns: list of (tree filename, output directory, label). the output directory is
+              <basedir>/<method> and the label is the name of the directory holding the tree file
+
+    """
+    jobs = []
+    for method in methods:
+        outdir = os.path.join(basedir, method)
+        for fname in sorted(get_fnames(outdir)):
+            label = os.path.basename(os.path.dirname(fname))
+            jobs.append( (fname, outdir, label) )
+    return jobs
+
+def get_outputs(analyzer, outdir, label, node_size_depth_format='csv'):
+    """Output filenames of an analyzer for one tree file"""
+    if analyzer == 'means':
+        return [os.path.join(outdir, measure, "{}-{}.csv".format(label, measure)) for measure in MEASURES]
+    dirname = os.path.join(outdir, SIZE_DEPTH_DIR)
+    outputs = [get_size_and_depth_from_tree.get_node_size_depth_fname(dirname, label, node_size_depth_format)]
+    outputs.extend(os.path.join(dirname, "{}-{}.csv".format(label, name)) for name in SIZE_DEPTH_OUTPUTS if name != 'node_size_depth')
+    return outputs
+
+def process_tree(job):
+    """Run the analyzers on one tree file
+
+    :job: (tree filename, output directory, label, list of analyzers: 'means' and/or 'size_depth',
+           signature of the tree file if the manifest already has it)
+    :returns: (job, signature of the tree file, time taken, results). results is a dict {measure: dict}
+              for the result store, or None if it isn't used
+
+    """
+    fname, outdir, label, analyzers, signature = job
+    start = time.time()
+    if _use_manifest and signature is None:
+        # hashed before processing, so the signature is of the contents that were analyzed,
+        # and the file is read from the page cache afterwards
+        signature = get_file_signature(fname)
+    # one read of the tree for all of the analyzers
+    accumulators = {}
+    if 'means' in analyzers:
+        accumulators['means'] = YearMeansAccumulator(_pubyear)
+    if 'size_depth' in analyzers:
+        accumulators['size_depth'] = SizeDepthAccumulator(_node_size_depth_format)
+    analyze_tree_once(fname, list(accumulators.values()), cache_dir=_cache_dir)
+    results = {}
+    if 'means' in accumulators:
+        outputs = accumulators['means'].outputs()
+        accumulators['means'].write(outdir, label, outputs)
+        results.update(outputs)
+    if 'size_depth' in accumulators:
+        outputs = accumulators['size_depth'].outputs()
+        accumulators['size_depth'].write(os.path.join(outdir, SIZE_DEPTH_DIR), label, outputs)
+        results['size_counts'] = outputs['size_counts']
+        results['depth_counts'] = outputs['depth_counts']
+    return job, signature, time.time() - start, results if _use_store else None
+
+def flush_results(store, records):
+    """Append the buffered results to the store as one segment, and empty the buffer"""
+    if store is not None and records:
+        with profiling.stage('output'):
+            store.append(records)
+        del records[:]
+
+def main(args):
+    global _pubyear, _cache_dir, _use_manifest, _node_size_depth_format, _use_store
+    profiling.start_from_args('get_means_from_tree_batch', args)
+    report_fname = profiling.get_report_fname(args.basedir, 'get_means_from_tree_batch')
+    analyzers = ['means']
+    if args.size_depth:
+        analyzers.append('size_depth')
+    versions = {
+            'means': get_means_from_tree.ANALYZER_VERSION,
+            'size_depth': get_size_and_depth_from_tree.ANALYZER_VERSION,
+            }
+    manifest = None
+    deps = {'means': {}, 'size_depth': {}}
+    if not args.no_manifest:
+        manifest_fname = args.manifest or os.path.join(args.basedir, 'analysis_manifest.json')
+        manifest = Manifest(manifest_fname)
+        # the pubyear file is only hashed again if its size or mtime changed
+        deps['means']['pubyear'] = manifest.get_signature(args.pubyears_fname)
+    store = ResultStore(args.store) if args.store else None
+    jobs = []
+    num_skipped = 0
+    for fname, outdir, label in get_jobs(args.basedir, args.methods):
+        todo = []
+        for analyzer in analyzers:
+            if manifest is not None and not args.force and manifest.is_current(analyzer, fname, versions[analyzer], deps[analyzer], get_outputs(analyzer, outdir, label, args.node_size_depth_format)):
+                num_skipped += 1
+                continue
+            todo.append(analyzer)
+        if todo:
+            signature = manifest.find_signature(fname, analyzers) if manifest is not None else None
+            jobs.append( (fname, outdir, label, todo, signature) )
+    logger.info("{} tree files to process. {} up-to-date analyses reused".format(len(jobs), num_skipped))
+    if not jobs:
+        if manifest is not None:
+            # is_current may have refreshed the mtimes of touched files
+            manifest.save()
+        profiling.finish_run(report_fname)
+        return
+    for outdir in set(job[1] for job in jobs):
+        for dirname in MEASURES + [SIZE_DEPTH_DIR]:
+            if not os.path.isdir(os.path.join(outdir, dirname)):
+                os.makedirs(os.path.join(outdir, dirname))
+
+    if any('means' in job[3] for job in jobs):
+        # memory mapped, so the workers also share the pages of the index
+        _pubyear = get_pubyear_index(args.pubyears_fname)
+    _cache_dir = args.cache_dir
+    _use_manifest = manifest is not None
+    _node_size_depth_format = args.node_size_depth_format
+    _use_store = store is not None
+    # results for the store, appended in one segment every save_every tree files rather than one per run
+    records = []
+    processes = args.processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        # each worker's stages (parse, aggregate, output) are added to this process's run report
+        for i, ((job, signature, took, results), stages) in enumerate(pool.imap_unordered(profiling.run_in_worker, [(process_tree, job) for job in jobs]), start=1):
+            profiling.merge_worker_stages(stages)
+            fname, outdir, label, todo, _ = job
+            logger.info("({} of {}) {} done in {:.2f} seconds".format(i, len(jobs), fname, took))
+            if results is not None:
+                records.extend(get_records(os.path.basename(outdir), label, results))
+            if manifest is not None:
+                for analyzer in todo:
+                    manifest.record(analyzer, fname, versions[analyzer], get_outputs(analyzer, outdir, label, args.node_size_depth_format), signature=signature, deps=deps[analyzer])
+                if i % args.save_every == 0:
+                    manifest.save()
+            if i % args.save_every == 0:
+                flush_results(store, records)
+    finally:
+        pool.close()
+        pool.join()
+        flush_results(store, records)
+        if manifest is not None:
+            manifest.save()
+    profiling.finish_run(report_fname)
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Run get_means_from_tree.py (and optionally get_size_and_depth_from_tree.py) on every new or changed .tree file in the method directories, in parallel, loading the publication years only once. Outputs go in <basedir>/<method>/rank_mean etc., labeled by the directory of each tree file")
+    parser.add_argument("pubyears_fname", type=str, help="(comma-separated) file mapping paper id to publication year")
+    parser.add_argument("--basedir", type=str, default='.', help="directory containing the method directories (default: current directory)")
+    parser.add_argument("--methods", nargs='+', default=METHODS, help="method directories to process (default: {})".format(" ".join(METHODS)))
+    parser.add_argument("-p", "--processes", type=int, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--size-depth", action='store_true', help="also run get_size_and_depth_from_tree.py on each tree file (outputs in <basedir>/<method>/{}/)".format(SIZE_DEPTH_DIR))
+    parser.add_argument("--node-size-depth-format", choices=get_size_and_depth_from_tree.NODE_SIZE_DEPTH_FORMATS, default='csv', help="format of the per-node size and depth output (see get_size_and_depth_from_tree.py)")
+    parser.add_argument("--manifest", type=str, help="manifest of the tree files already processed (default: <basedir>/analysis_manifest.json). tree files whose contents, pubyear file and analyzer version are unchanged are skipped")
+    parser.add_argument("--no-manifest", action='store_true', help="process every tree file and don't record them in a manifest")
+    parser.add_argument("--force", action='store_true', help="process every tree file, then update the manifest")
+    parser.add_argument("--save-every", type=int, default=50, help="save the manifest (and append to the result store) after this many tree files")
+    parser.add_argument("--store", type=str, help="also append the results of each tree file to this consolidated result store (see result_store.py), keyed by method, run label, measure and key")
+    parser.add_argument("--cache-dir", type=str, help="base directory for tree caches made by tree_cache.py (default: next to each tree file)")
+    parser.add_argument("--vectorized", action='store_true', help="no longer needed: the per-year means are always computed with numpy a chunk of nodes at a time, in the same read of the tree as the sizes and depths (see tree_analyzer.py)")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
@@ -2,88 +2,93 @@ import sys, os, time
 from collections import defaultdict, Counter
 from datetime import datetime
 
+import numpy as np
+import pandas as pd
+
+from tree_cache import load_fresh_cache
+from cluster_index import index_tree
+from parallel_tree import parse_tree_columns_parallel
+import profiling
+from profiling import stage
+
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
         datefmt="%H:%M:%S",
         level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def analyze_treefile(fname):
+# bump when the outputs change, so batch runs (see manifest.py) recompute them
+ANALYZER_VERSION = 1
+
+NODE_SIZE_DEPTH_COLUMNS = ['pid', 'cl_size', 'cl_depth']
+# 'npy' writes a structured array that notebooks can memory map (see load_node_size_depth)
+NODE_SIZE_DEPTH_FORMATS = ['csv', 'npy']
+
+def analyze_treefile(fname, cache_dir=None, processes=1):
     """From the tree file, get the data needed to analyze
 
     :fname: filename of the tree file
-    :returns: node_size_depth: list of tuples,
+    :cache_dir: base directory for tree caches. if there is a fresh cache (see tree_cache.py), the text is not parsed
+    :processes: if more than 1 (or 0: the number of cores), byte ranges of the tree file are parsed in parallel (see parallel_tree.py)
+    :returns: node_size_depth: dict of arrays {pid: int64, cl_size: int64, cl_depth: int8}, one entry per node,
                 size_counts: counter of size: count,
                 depth_counts: counter of depth: count
 
     """
-    start = time.time()
-    logger.debug("Analyzing tree file...")
-    i = 0
-    node_cluster = {}
-    size_total = Counter()
-    cluster_depth = {}
-    num_nodes = 0
-    
-
-    with open(fname, 'r') as f:
-        for line in f:
-            i += 1
-            if line[0] == "#":
-                continue
-            line = line.strip().split(' ')
-
-            # Get paper ID
-            pid = int(line[2].strip('"'))
-
-            # Get cluster
-            cl = line[0]
-            cl = cl.split(':')
-
-            # Get depth
-            depth = len(cl)
-
-            belongs_to = ":".join(cl[:-1])
-            node_cluster[pid] = belongs_to
-            size_total[belongs_to] += 1
-
-            if belongs_to not in cluster_depth:
-                cluster_depth[belongs_to] = depth
-
-            num_nodes += 1
-
-    size_counts = Counter()
-    for count in size_total.itervalues():
-        size_counts[count] += 1
-
-    depth_counts = Counter()
-    for cl_name, depth in cluster_depth.iteritems():
-        depth_counts[depth] += 1
-
-    node_size_depth = []
-    for pid, belongs_to in node_cluster.iteritems():
-        cl_size = size_total[belongs_to]
-        cl_depth = cluster_depth[belongs_to]
-        row = (pid, cl_size, cl_depth)
-        node_size_depth.append(row)
-
-
-    end = time.time()
-    logger.debug("Done. Took {:2f} seconds.".format(end-start))
-    logger.debug("Total number of nodes: {}.\n".format(num_nodes))
+    columns = load_fresh_cache(fname, cache_dir)
+    if columns is not None:
+        return analyze_treefile_columns(columns)
+
+    if processes != 1:
+        index, columns = parse_tree_columns_parallel(fname, processes)
+        pid = columns['pid']
+        module = columns['module']
+    else:
+        index, pid, module = index_tree(fname)
+    depth = np.array(index.depth, dtype=np.int8)[module] + 1
+    return analyze_treefile_columns({'pid': pid, 'module': module, 'depth': depth})
+
+def analyze_treefile_columns(columns):
+    """Same as analyze_treefile, but from columns already parsed (from a tree cache or the tree file)
+
+    :columns: dict of arrays (see tree_cache.parse_tree_columns). only pid, module and depth are used
+    :returns: same as analyze_treefile
+
+    """
+    logger.debug("Aggregating sizes and depths...")
+    with stage('aggregate') as stats:
+        module = np.asarray(columns['module'])
+        stats.add(nodes=len(module))
+        size_total = np.bincount(module)
+        # every node in a module has the same depth
+        cluster_depth = np.zeros(len(size_total), dtype=np.int8)
+        cluster_depth[module] = columns['depth']
+
+        # cluster IDs include the modules' ancestors, which may have no nodes of their own
+        has_nodes = size_total > 0
+        size_counts = Counter(size_total[has_nodes].tolist())
+        depth_counts = Counter(cluster_depth[has_nodes].tolist())
+        node_size_depth = {
+                'pid': np.asarray(columns['pid'], dtype=np.int64),
+                'cl_size': size_total[module].astype(np.int64),
+                'cl_depth': cluster_depth[module],
+                }
+
+    logger.debug("Total number of nodes: {}.\n".format(len(module)))
     return node_size_depth, size_counts, depth_counts
 
 
 def output_csv(d, dirname, fname, extension='csv', sep=',', header=None):
     fname = os.path.join(dirname, "{}.{}".format(fname, extension))
     logger.debug("Writing to file: {}".format(fname))
-    with open(fname, 'w') as outf:
+    with stage('output') as stats, open(fname, 'w') as outf:
+        stats.add(lines=len(d))
         if header:
             outf.write(sep.join(header))
             outf.write("\n")
 
         if isinstance(d, dict):
-            for k, v in d.iteritems():
+            for k, v in d.items():
                 outf.write("{}{}{}\n".format(k, sep, v))
         elif isinstance(d, list):
             for row in d:
@@ -92,10 +97,58 @@ def output_csv(d, dirname, fname, extension='csv', sep=',', header=None):
                 outf.write(row)
                 outf.write("\n")
 
-def output_node_size_depth(data, dirname, label):
-    header = ['pid', 'cl_size', 'cl_depth']
-    fname = label+"-node_size_depth"
-    output_csv(data, dirname, fname, header=header)
+def write_columns_csv(columns, fname, header, sep=',', chunksize=100000):
+    """Write integer columns to a csv file, formatting a chunk of rows at a time
+
+    :columns: list of integer arrays of the same length
+    :header: list of column names
+
+    """
+    row_format = sep.join(['%d'] * len(columns)) + '\n'
+    with open(fname, 'w') as outf:
+        outf.write(sep.join(header))
+        outf.write("\n")
+        for i in range(0, len(columns[0]), chunksize):
+            rows = zip(*[column[i:i+chunksize].tolist() for column in columns])
+            outf.write(''.join([row_format % row for row in rows]))
+
+def get_node_size_depth_fname(dirname, label, fmt='csv'):
+    return os.path.join(dirname, "{}-node_size_depth.{}".format(label, fmt))
+
+def output_node_size_depth(data, dirname, label, fmt='csv'):
+    """Write the per-node cluster sizes and depths
+
+    :data: dict of arrays (see analyze_treefile)
+    :fmt: 'csv', or 'npy' for a structured numpy array with the same columns
+    :returns: output filename
+
+    """
+    fname = get_node_size_depth_fname(dirname, label, fmt)
+    logger.debug("Writing to file: {}".format(fname))
+    with stage('output') as stats:
+        stats.add(lines=len(data['pid']), nodes=len(data['pid']))
+        if fmt == 'npy':
+            arr = np.empty(len(data['pid']), dtype=[(name, data[name].dtype) for name in NODE_SIZE_DEPTH_COLUMNS])
+            for name in NODE_SIZE_DEPTH_COLUMNS:
+                arr[name] = data[name]
+            np.save(fname, arr)
+        else:
+            write_columns_csv([data[name] for name in NODE_SIZE_DEPTH_COLUMNS], fname, header=NODE_SIZE_DEPTH_COLUMNS)
+        stats.add(bytes=os.path.getsize(fname))
+    return fname
+
+def load_node_size_depth(fname, mmap_mode=None):
+    """Load a node_size_depth file written by output_node_size_depth (.csv or .npy)
+
+    :mmap_mode: passed to numpy.load for .npy files
+    :returns: dict of arrays {pid, cl_size, cl_depth}. pandas.DataFrame(...) of it gives the same table as reading the csv
+
+    """
+    if fname.endswith('.npy'):
+        arr = np.load(fname, mmap_mode=mmap_mode)
+        return {name: arr[name] for name in NODE_SIZE_DEPTH_COLUMNS}
+    df = pd.read_csv(fname)
+    return {name: df[name].values for name in NODE_SIZE_DEPTH_COLUMNS}
 
 def output_size_counts(data, dirname, label):
     header = ['cl_size', 'num_clusters']
@@ -108,12 +161,14 @@ def output_depth_counts(data, dirname, label):
     output_csv(data, dirname, fname, header=header)
 
 def main(args):
-    node_size_depth, size_counts, depth_counts = analyze_treefile(args.tree_fname)
+    profiling.start_from_args('get_size_and_depth_from_tree', args)
+    node_size_depth, size_counts, depth_counts = analyze_treefile(args.tree_fname, cache_dir=args.cache_dir, processes=args.processes)
     outdir = args.outdir
     label = args.label
-    output_node_size_depth(node_size_depth, outdir, label)
+    output_node_size_depth(node_size_depth, outdir, label, fmt=args.node_size_depth_format)
     output_size_counts(size_counts, outdir, label)
     output_depth_counts(depth_counts, outdir, label)
+    profiling.finish_run(profiling.get_report_fname(outdir, label))
 
 if __name__ == "__main__":
     total_start = time.time()
@@ -124,6 +179,10 @@ if __name__ == "__main__":
     parser.add_argument("tree_fname", type=str, help="input filename (.tree file)")
     parser.add_argument("-o", "--outdir", type=str, help="directory for the output", default=os.path.dirname(__file__))
     parser.add_argument("--label", type=str, help="label for the output files--- e.g. 'EXAMPLE' will have output files 'EXAMPLE-size_and_depth_pernode.csv', 'EXAMPLE-size_counts.csv', and 'EXAMPLE-depth_counts.csv'")
+    parser.add_argument("--cache-dir", type=str, help="base directory for tree caches made by tree_cache.py (default: next to the tree file)")
+    parser.add_argument("-p", "--processes", type=int, default=1, help="number of processes parsing parts of the tree file in parallel (0: number of cores)")
+    parser.add_argument("--node-size-depth-format", choices=NODE_SIZE_DEPTH_FORMATS, default='csv', help="format of the per-node output: csv, or npy (binary, for loading in notebooks with load_node_size_depth)")
+    profiling.add_arguments(parser)
     parser.add_argument("--debug", action='store_true', help="output debugging info")
     global args
     args = parser.parse_args()
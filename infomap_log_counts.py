@@ -0,0 +1,142 @@
+import sys, os, time, re, json, csv
+from glob import glob
+from datetime import datetime
+import multiprocessing
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+METHODS = [
+            'undirdir',
+            'pagerank',
+            'outdirdir',
+            'pagerank_unrecorded'
+        ]
+# same pattern as counts_per_level.ipynb
+LEAF_COUNTS_RE = re.compile(br"per level number of leaf nodes:.*?(\[.+?\])", re.I)
+WHITESPACE_RE = re.compile(br"\s+")
+# Infomap prints its summary at the end of the run, so it is almost always in the last few KB of the log
+TAIL_BYTES = 64 * 1024
+OUTPUT_HEADER = ['method', 'job_id', 'level', 'leaf_count']
+
+def get_log_fnames(basedir, method, ext='out'):
+    """SLURM logs of the Infomap jobs of a method: <basedir>/<method>/job_logs/infomap_logs/*.<ext>"""
+    return glob(os.path.join(basedir, method, 'job_logs', 'infomap_logs', "*.{}".format(ext)))
+
+def get_job_id(fname):
+    """Job ID from a SLURM log filename (e.g. 'slurm-1160295_101.out' -> '1160295_101')"""
+    name = os.path.splitext(os.path.basename(fname))[0]
+    if name.startswith('slurm-'):
+        name = name[len('slurm-'):]
+    return name
+
+def job_id_key(job_id):
+    """Sort key putting array job IDs in numeric order (1160295_2 before 1160295_10)"""
+    return [int(x) if x.isdigit() else x for x in job_id.split('_')]
+
+def find_leaf_counts(text):
+    """Parse the last 'Per level number of leaf nodes' summary in (part of) a log
+
+    :text: bytes
+    :returns: list of leaf counts, the first for level 1, or None if there is no summary
+
+    """
+    last = None
+    for m in LEAF_COUNTS_RE.finditer(text):
+        last = m
+    if last is None:
+        return None
+    return json.loads(WHITESPACE_RE.sub(b'', last.group(1)).decode('ascii'))
+
+def read_leaf_counts(fname, tail_bytes=TAIL_BYTES):
+    """Read the per level leaf counts from an Infomap log, looking only at its tail unless the summary isn't there
+
+    :returns: list of leaf counts, or None if the log has no summary (e.g. the job failed)
+
+    """
+    with open(fname, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - tail_bytes, 0))
+        counts = find_leaf_counts(f.read())
+        if counts is not None or size <= tail_bytes:
+            return counts
+        logger.debug("No summary in the last {} bytes of {}. Reading the whole log".format(tail_bytes, fname))
+        f.seek(0)
+        return find_leaf_counts(f.read())
+
+def scan_log(job):
+    """
+    :job: (method, log filename, tail bytes)
+    :returns: (method, job ID, list of leaf counts or None)
+
+    """
+    method, fname, tail_bytes = job
+    return method, get_job_id(fname), read_leaf_counts(fname, tail_bytes)
+
+def scan_logs(basedir, methods=METHODS, processes=None, tail_bytes=TAIL_BYTES, chunksize=64):
+    """Read the per level leaf counts from the Infomap logs of every method, in parallel
+
+    :processes: number of worker processes (default: number of cores)
+    :returns: list of (method, job ID, level, leaf count), sorted. levels start at 1
+
+    """
+    jobs = [(method, fname, tail_bytes) for method in methods for fname in get_log_fnames(basedir, method)]
+    logger.debug("Scanning {} logs".format(len(jobs)))
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1 or len(jobs) <= chunksize:
+        results = [scan_log(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = list(pool.imap_unordered(scan_log, jobs, chunksize=chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    rows = []
+    num_missing = 0
+    for method, job_id, counts in results:
+        if counts is None:
+            logger.debug("No leaf counts in the log of job {} ({})".format(job_id, method))
+            num_missing += 1
+            continue
+        for level, count in enumerate(counts, start=1):
+            rows.append( (method, job_id, level, count) )
+    if num_missing:
+        logger.warning("{} of {} logs have no per level leaf counts".format(num_missing, len(jobs)))
+    rows.sort(key=lambda row: (methods.index(row[0]), job_id_key(row[1]), row[2]))
+    return rows
+
+def output_table(rows, outf):
+    writer = csv.writer(outf, lineterminator='\n')
+    writer.writerow(OUTPUT_HEADER)
+    writer.writerows(rows)
+
+def main(args):
+    rows = scan_logs(args.basedir, args.methods, processes=args.processes, tail_bytes=args.tail_bytes)
+    output_table(rows, args.output)
+    logger.info("{} jobs, {} rows".format(len(set(row[:2] for row in rows)), len(rows)))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Read the per level number of leaf nodes from the Infomap job logs (<basedir>/<method>/job_logs/infomap_logs/*.out) in parallel, and output one csv table of method, job id, level, leaf count")
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'), default=sys.stdout, help="output filename (csv)")
+    parser.add_argument("--basedir", type=str, default='.', help="directory containing the method directories (default: current directory)")
+    parser.add_argument("--methods", nargs='+', default=METHODS, help="method directories to scan (default: {})".format(" ".join(METHODS)))
+    parser.add_argument("-p", "--processes", type=int, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--tail-bytes", type=int, default=TAIL_BYTES, help="bytes read from the end of each log. the whole log is read only if the summary is not there")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
@@ -0,0 +1,134 @@
+import os, time, json, hashlib
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def get_file_hash(fname, blocksize=16*1024*1024):
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def get_file_signature(fname):
+    """Size, mtime and content hash of a file"""
+    st = os.stat(fname)
+    return {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': get_file_hash(fname)}
+
+class Manifest(object):
+    """Record of which inputs each analyzer has already processed, so batch runs can skip them
+
+    Entries are keyed by analyzer name and absolute input path, and store the input's size,
+    mtime and content hash, the analyzer version, the signatures of other inputs (e.g. the
+    pubyear file) and the output filenames. An input is current if the version, the other
+    inputs and the outputs are unchanged and either its size and mtime match, or its size
+    matches and its content hash is the same (e.g. a file that was copied or touched).
+
+    Signatures of the other inputs are kept under the analyzer name SIGNATURE, so a large
+    unchanged file (same size and mtime) is not hashed again on every run (see get_signature).
+
+    """
+    SIGNATURE = 'signature'
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.entries = {}
+        # signatures of files hashed by this process: {absolute path: signature}
+        self.hashed = {}
+        if os.path.exists(fname):
+            with open(fname, 'r') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def get_key(analyzer, path):
+        return "{}:{}".format(analyzer, os.path.abspath(path))
+
+    def is_current(self, analyzer, path, version, deps=None, outputs=None):
+        """
+        :analyzer: analyzer name
+        :path: input filename
+        :version: current version of the analyzer
+        :deps: dict {name: signature} of the other inputs (see get_file_signature)
+        :outputs: output filenames expected now. if given, they must be the ones recorded
+        :returns: True if the recorded outputs for this input can be reused
+
+        """
+        entry = self.entries.get(self.get_key(analyzer, path))
+        if entry is None or entry['version'] != version:
+            return False
+        if outputs is not None and sorted(entry['outputs']) != sorted(outputs):
+            return False
+        for name, signature in (deps or {}).items():
+            if entry['deps'].get(name, {}).get('sha1') != signature['sha1']:
+                return False
+        if not all(os.path.exists(output) for output in entry['outputs']):
+            return False
+        st = os.stat(path)
+        if st.st_size != entry['size']:
+            return False
+        if st.st_mtime == entry['mtime']:
+            return True
+        sha1 = get_file_hash(path)
+        self.hashed[os.path.abspath(path)] = {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': sha1}
+        if sha1 == entry['sha1']:
+            entry['mtime'] = st.st_mtime
+            return True
+        return False
+
+    def find_signature(self, path, analyzers=()):
+        """Signature of a file (see get_file_signature) without reading it: the one recorded for it
+        (by one of the analyzers, or by get_signature) or hashed by is_current, if its size and mtime
+        still match
+
+        :returns: signature, or None if the file has to be hashed
+
+        """
+        st = os.stat(path)
+        candidates = [self.hashed.get(os.path.abspath(path))]
+        candidates.extend(self.entries.get(self.get_key(analyzer, path)) for analyzer in list(analyzers) + [self.SIGNATURE])
+        for entry in candidates:
+            if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+                return {'size': entry['size'], 'mtime': entry['mtime'], 'sha1': entry['sha1']}
+        return None
+
+    def get_signature(self, path):
+        """Signature of another input (e.g. the pubyear file), hashing it only if its size or mtime
+        changed since it was last recorded. The signature is recorded for the next run
+
+        """
+        signature = self.find_signature(path)
+        if signature is None:
+            signature = get_file_signature(path)
+        self.entries[self.get_key(self.SIGNATURE, path)] = dict(signature)
+        return signature
+
+    def record(self, analyzer, path, version, outputs, signature=None, deps=None):
+        """Record that an input has been processed
+
+        :signature: signature of the input (computed if None)
+        :outputs: list of output filenames
+
+        """
+        if signature is None:
+            signature = get_file_signature(path)
+        entry = dict(signature)
+        entry.update({
+            'version': version,
+            'deps': deps or {},
+            'outputs': list(outputs),
+            'time': time.time(),
+            })
+        self.entries[self.get_key(analyzer, path)] = entry
+
+    def save(self):
+        tmpfname = "{}.tmp{}".format(self.fname, os.getpid())
+        with open(tmpfname, 'w') as outf:
+            json.dump(self.entries, outf, indent=1, sort_keys=True)
+        os.rename(tmpfname, self.fname)
+        logger.debug("Wrote manifest: {}".format(self.fname))
@@ -0,0 +1,122 @@
+import sys, os, time
+from datetime import datetime
+import multiprocessing
+
+import numpy as np
+
+from tree_reader import read_tree_chunks, get_byte_ranges
+from cluster_index import ClusterIndex
+import profiling
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def map_tree_ranges(fname, func, processes=None, num_ranges=None):
+    """Split a tree file into byte ranges aligned to lines and run func on each range in a process pool
+
+    :func: top-level function taking a job (fname, start, end). it can use module-level state set
+           before calling, since the workers are forked. the stages it records (see profiling.py)
+           are added to the run being profiled
+    :processes: number of worker processes (default: number of cores)
+    :num_ranges: number of byte ranges (default: processes)
+    :returns: list of the results of func, in file order
+
+    """
+    processes = processes or multiprocessing.cpu_count()
+    ranges = get_byte_ranges(fname, num_ranges or processes)
+    jobs = [(fname, start, end) for start, end in ranges]
+    logger.debug("Reading {} in {} byte ranges with {} processes".format(fname, len(jobs), processes))
+    if processes == 1 or len(jobs) == 1:
+        return [func(job) for job in jobs]
+    pool = multiprocessing.Pool(min(processes, len(jobs)))
+    try:
+        results = []
+        for result, stages in pool.map(profiling.run_in_worker, [(func, job) for job in jobs], chunksize=1):
+            profiling.merge_worker_stages(stages)
+            results.append(result)
+        return results
+    finally:
+        pool.close()
+        pool.join()
+
+def parse_tree_range(job):
+    """Parse one byte range of a tree file into columns
+
+    :job: (fname, start, end)
+    :returns: dict {pid, flow, depth, module: cluster IDs in the range's own ClusterIndex,
+              cluster_parent, cluster_component: that index's arrays}
+
+    """
+    fname, start, end = job
+    index = ClusterIndex()
+    pids = []
+    flows = []
+    depths = []
+    modules = []
+    for chunk in read_tree_chunks(fname, start=start, end=end):
+        pids.append(chunk['pid'])
+        flows.append(chunk['flow'])
+        depths.append(chunk['depth'])
+        modules.append(index.add_modules(chunk['module']))
+    clusters = index.arrays()
+    return {
+            'pid': np.concatenate(pids) if pids else np.array([], dtype=np.int64),
+            'flow': np.concatenate(flows) if flows else np.array([], dtype=np.float64),
+            'depth': np.concatenate(depths) if depths else np.array([], dtype=np.int16),
+            'module': np.concatenate(modules) if modules else np.array([], dtype=np.int32),
+            'cluster_parent': clusters['parent'],
+            'cluster_component': clusters['component'],
+            }
+
+def parse_tree_columns_parallel(fname, processes=None, num_ranges=None):
+    """Parse a tree file into columns, with byte ranges of the file parsed in parallel
+
+    :returns: (ClusterIndex of the whole tree, dict of arrays {pid, flow, depth, module}
+              in file order, module being IDs in the returned index)
+
+    """
+    parts = map_tree_ranges(fname, parse_tree_range, processes, num_ranges)
+    # the ranges are parsed in the workers' tree_parse stages; this counts merging them
+    with profiling.stage('tree_parse'):
+        index = ClusterIndex()
+        modules = []
+        for part in parts:
+            id_map = index.add_clusters(part['cluster_parent'], part['cluster_component'])
+            modules.append(id_map[part['module']])
+        columns = {
+                'pid': np.concatenate([part['pid'] for part in parts]),
+                'flow': np.concatenate([part['flow'] for part in parts]),
+                'depth': np.concatenate([part['depth'] for part in parts]),
+                'module': np.concatenate(modules),
+                }
+    logger.debug("Parsed {} nodes in {} byte ranges.".format(len(columns['pid']), len(parts)))
+    return index, columns
+
+def main(args):
+    profiling.start_from_args('parallel_tree', args)
+    index, columns = parse_tree_columns_parallel(args.tree_fname, processes=args.processes, num_ranges=args.num_ranges)
+    logger.info("{} nodes, {} clusters".format(len(columns['pid']), len(index)))
+    profiling.finish_run(profiling.get_report_fname(os.path.dirname(os.path.abspath(args.tree_fname)), 'parallel_tree'))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Parse one .tree file with a pool of processes, each reading a byte range of the file, and report the time taken (see --run-report for the time per stage)")
+    parser.add_argument("tree_fname", type=str, help="input filename (.tree file)")
+    parser.add_argument("-p", "--processes", type=int, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--num-ranges", type=int, help="number of byte ranges to split the file into (default: number of processes)")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
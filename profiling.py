@@ -0,0 +1,339 @@
+import sys, os, time, json, platform, resource, signal
+from collections import OrderedDict, Counter
+from datetime import datetime
+import cProfile, pstats
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# stages recorded by the analysis code:
+#   pubyear_load: reading the publication year file or its index
+#   cache_load: loading a tree cache (tree_cache.py)
+#   tree_parse: reading and splitting tree file blocks (tree_reader.py)
+#   cluster_index: giving modules cluster IDs (cluster_index.py)
+#   aggregate: per-year and per-cluster totals
+#   vi: aligning clusterings and computing VI
+#   output: writing results
+HOOKS = ['cprofile', 'sample']
+REPORT_SUFFIX = '-run_report.json'
+
+def get_cpu_time():
+    """User + system CPU seconds of this process (all threads)"""
+    t = os.times()
+    return t[0] + t[1]
+
+def get_peak_rss():
+    """Peak resident set size of this process, in MB"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return maxrss / 1024.0 / 1024.0 if sys.platform == 'darwin' else maxrss / 1024.0
+
+class StageStats(object):
+    """Totals for one stage of a run, over every time the stage was entered
+
+    wall and cpu exclude the time spent in nested stages. peak_rss_mb is the process's peak RSS
+    at the end of the stage (a high-water mark, so it includes earlier stages).
+    bytes, lines and nodes are added by the code of the stage (see add)
+
+    """
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss_mb = 0.0
+        self.bytes = 0
+        self.lines = 0
+        self.nodes = 0
+
+    def add(self, bytes=0, lines=0, nodes=0):
+        self.bytes += bytes
+        self.lines += lines
+        self.nodes += nodes
+
+    def merge(self, d):
+        """Add the totals of another process (a dict from as_dict)"""
+        self.calls += d['calls']
+        self.wall += d['wall']
+        self.cpu += d['cpu']
+        self.peak_rss_mb = max(self.peak_rss_mb, d['peak_rss_mb'])
+        self.add(d['bytes'], d['lines'], d['nodes'])
+
+    def as_dict(self):
+        return OrderedDict([
+            ('calls', self.calls),
+            ('wall', self.wall),
+            ('cpu', self.cpu),
+            ('peak_rss_mb', self.peak_rss_mb),
+            ('bytes', self.bytes),
+            ('lines', self.lines),
+            ('nodes', self.nodes),
+            ('nodes_per_sec', self.nodes / self.wall if self.wall and self.nodes else None),
+            ('mb_per_sec', self.bytes / 1024.0 / 1024.0 / self.wall if self.wall and self.bytes else None),
+            ])
+
+class Stage(object):
+    """Context manager timing one entry into a stage of a RunProfile. Entering it gives the stage's StageStats"""
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.stats = profile.get_stage(name)
+        self.name = name
+
+    def __enter__(self):
+        # wall and CPU time of the stages nested in this one
+        self.nested = [0.0, 0.0]
+        self.profile.stack.append(self)
+        self.wall = time.time()
+        self.cpu = get_cpu_time()
+        return self.stats
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.time() - self.wall
+        cpu = get_cpu_time() - self.cpu
+        self.profile.stack.pop()
+        if self.profile.stack:
+            parent = self.profile.stack[-1]
+            parent.nested[0] += wall
+            parent.nested[1] += cpu
+        self.stats.calls += 1
+        self.stats.wall += wall - self.nested[0]
+        self.stats.cpu += cpu - self.nested[1]
+        self.stats.peak_rss_mb = max(self.stats.peak_rss_mb, get_peak_rss())
+        return False
+
+class NoStage(object):
+    """Stand-in for Stage when no run is being profiled. Counts added to it are discarded"""
+    def __enter__(self):
+        return StageStats()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+class CProfileHook(object):
+    """Deterministic profile of the run with cProfile"""
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def results(self, limit=30):
+        """The functions with the most cumulative time"""
+        stats = pstats.Stats(self.profiler).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [OrderedDict([
+            ('function', "{}:{}({})".format(os.path.basename(fname), lineno, func)),
+            ('calls', nc),
+            ('tottime', tt),
+            ('cumtime', ct),
+            ]) for (fname, lineno, func), (cc, nc, tt, ct, callers) in rows]
+
+    def write(self, fname):
+        """Save the full profile for pstats or snakeviz"""
+        self.profiler.dump_stats(fname)
+        return fname
+
+class SamplingHook(object):
+    """Statistical profile of the run: the line being run is recorded every interval seconds of CPU time,
+    with the stage it is in. Uses SIGPROF, so it only sees the main thread and only works on Unix
+
+    """
+    def __init__(self, profile, interval=0.005):
+        self.profile = profile
+        self.interval = interval
+        self.samples = Counter()
+        self.old_handler = None
+
+    def sample(self, signum, frame):
+        stage = self.profile.stack[-1].name if self.profile.stack else None
+        location = "{}:{}({})".format(os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+        self.samples[(stage, location)] += 1
+
+    def start(self):
+        self.old_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.old_handler or signal.SIG_DFL)
+
+    def results(self, limit=30):
+        """The most sampled lines"""
+        total = sum(self.samples.values())
+        return [OrderedDict([
+            ('stage', stage),
+            ('location', location),
+            ('samples', count),
+            ('fraction', float(count) / total),
+            ]) for (stage, location), count in self.samples.most_common(limit)]
+
+    def write(self, fname):
+        return None
+
+class RunProfile(object):
+    """Per-stage wall time, CPU time, throughput and peak memory of one run of a script
+
+    Code records a stage with the module-level stage(name) context manager, which adds to the
+    active RunProfile (see start_run) or does nothing if no run is being profiled:
+
+        with stage('tree_parse') as stats:
+            ...
+            stats.add(bytes=len(block), nodes=len(paths))
+
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.stages = OrderedDict()
+        self.stack = []
+        self.hook = None
+        self.start_time = datetime.now()
+        self.start_wall = time.time()
+        self.start_cpu = get_cpu_time()
+
+    def get_stage(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def merge_stages(self, stages):
+        """Add stage totals recorded in another process (see run_in_worker)"""
+        for name, d in (stages or {}).items():
+            self.get_stage(name).merge(d)
+
+    def report(self):
+        wall = time.time() - self.start_wall
+        stages = OrderedDict((name, stats.as_dict()) for name, stats in self.stages.items())
+        out = OrderedDict([
+            ('name', self.name),
+            ('argv', sys.argv),
+            ('start', '{:%Y-%m-%d %H:%M:%S}'.format(self.start_time)),
+            ('host', platform.node()),
+            ('python', platform.python_version()),
+            ('wall', wall),
+            ('cpu', get_cpu_time() - self.start_cpu),
+            ('peak_rss_mb', get_peak_rss()),
+            ('stages', stages),
+            # stages of worker processes overlap in time, so this can be negative for parallel runs
+            ('unstaged_wall', wall - sum(stats.wall for stats in self.stages.values())),
+            ])
+        if self.hook is not None:
+            out['profile'] = self.hook.results()
+        return out
+
+# the run being profiled in this process, if any
+_profile = None
+
+def get_profile():
+    return _profile
+
+def stage(name):
+    """Context manager recording a stage of the active run (see RunProfile)"""
+    if _profile is None:
+        return NoStage()
+    return _profile.stage(name)
+
+def start_run(name=None, hook=None):
+    """Start profiling a run in this process
+
+    :name: name of the run (e.g. the script)
+    :hook: None, 'cprofile' or 'sample', to also profile the functions of the run
+    :returns: RunProfile
+
+    """
+    global _profile
+    if _profile is not None and _profile.hook is not None:
+        # e.g. a forked worker: the parent's hook is not this process's to keep running
+        _profile.hook.stop()
+    _profile = RunProfile(name)
+    if hook == 'cprofile':
+        _profile.hook = CProfileHook()
+    elif hook == 'sample':
+        if hasattr(signal, 'setitimer'):
+            _profile.hook = SamplingHook(_profile)
+        else:
+            logger.warning("Sampling profiler needs signal.setitimer. Not profiling functions")
+    if _profile.hook is not None:
+        _profile.hook.start()
+    return _profile
+
+def start_from_args(name, args):
+    """Start profiling if the --run-report or --profile option (see add_arguments) was given"""
+    if args.run_report or args.profile:
+        return start_run(name, args.profile)
+    return None
+
+def finish_run(fname=None):
+    """Stop profiling and write the run report
+
+    :fname: output filename (json). for cProfile, the full profile is saved next to it as .prof
+    :returns: report (dict), or None if no run was being profiled
+
+    """
+    global _profile
+    profile = _profile
+    if profile is None:
+        return None
+    _profile = None
+    if profile.hook is not None:
+        profile.hook.stop()
+    report = profile.report()
+    if fname is not None:
+        if profile.hook is not None:
+            report['profile_fname'] = profile.hook.write(os.path.splitext(fname)[0] + '.prof')
+        with open(fname, 'w') as outf:
+            json.dump(report, outf, indent=1)
+        logger.info("Wrote run report: {}".format(fname))
+    for name, stats in report['stages'].items():
+        logger.debug("{}: {:.2f} seconds wall, {:.2f} seconds CPU, {} nodes".format(name, stats['wall'], stats['cpu'], stats['nodes']))
+    return report
+
+def take_stages():
+    """Stage totals recorded so far in this process, as dicts, and reset them
+
+    :returns: dict {stage name: StageStats.as_dict()}, or None if no run is being profiled
+
+    """
+    if _profile is None:
+        return None
+    stages = dict((name, stats.as_dict()) for name, stats in _profile.stages.items())
+    _profile.stages = OrderedDict()
+    return stages
+
+def run_in_worker(func_and_job):
+    """Call func(job) in a forked pool worker and collect the stages it records
+
+    A worker forked while the parent is profiled starts its own RunProfile for the call, so the
+    parent's totals aren't counted twice. Add the returned stages to the parent with RunProfile.merge_stages
+
+    :func_and_job: (func, job). func must be a top-level function, so it can be sent to the worker
+    :returns: (result of func, stages (see take_stages) or None if the parent is not being profiled)
+
+    """
+    func, job = func_and_job
+    if _profile is None:
+        return func(job), None
+    start_run(_profile.name)
+    result = func(job)
+    return result, take_stages()
+
+def merge_worker_stages(stages):
+    """Add stages returned by run_in_worker to the active run, if any"""
+    if _profile is not None:
+        _profile.merge_stages(stages)
+
+def get_report_fname(dirname, label):
+    return os.path.join(dirname, "{}{}".format(label, REPORT_SUFFIX))
+
+def add_arguments(parser):
+    """Add the --run-report and --profile options to a script's argument parser"""
+    parser.add_argument("--run-report", action='store_true', help="write a json report of the wall time, CPU time, throughput and peak memory of each stage (pubyear load, tree parse, aggregation, VI, output) next to the outputs")
+    parser.add_argument("--profile", choices=HOOKS, help="also profile the functions of the run with cProfile or a sampling profiler, into the run report (implies --run-report)")
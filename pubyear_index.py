@@ -0,0 +1,158 @@
+import sys, os, time, json, shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from profiling import stage
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.index'
+# year for papers that are not in the index or whose year is not an integer
+UNKNOWN_YEAR = -1
+
+class PubyearIndex(object):
+    """Publication years as a sorted int64 paper ID array and an aligned int16 year array
+
+    Replaces the {pid: year} dict from get_means_from_tree.get_pubyear. Non-integer years are stored as UNKNOWN_YEAR.
+
+    """
+    def __init__(self, pid, year):
+        self.pid = pid
+        self.year = year
+
+    def __len__(self):
+        return len(self.pid)
+
+    def lookup(self, pids):
+        """Vectorized lookup
+
+        :pids: array of paper IDs
+        :returns: int16 array of years, UNKNOWN_YEAR for papers without a known year
+
+        """
+        pids = np.asarray(pids, dtype=np.int64)
+        if len(self.pid) == 0:
+            return np.full(len(pids), UNKNOWN_YEAR, dtype=np.int16)
+        pos = np.searchsorted(self.pid, pids)
+        pos[pos == len(self.pid)] = 0
+        found = self.pid[pos] == pids
+        return np.where(found, self.year[pos], UNKNOWN_YEAR).astype(np.int16)
+
+    def get(self, pid, default=None):
+        """dict-style lookup of one paper. returns default if the year is unknown"""
+        year = int(self.lookup([pid])[0])
+        if year == UNKNOWN_YEAR:
+            return default
+        return year
+
+def build_pubyear_index(fname):
+    """Parse the publication year file into a PubyearIndex
+
+    :fname: filename for the publication years. comma separated with first column paper ID, second column year
+    :returns: PubyearIndex
+
+    """
+    logger.debug("Parsing publication year file...")
+    with stage('pubyear_load') as stats:
+        df = pd.read_csv(fname, header=None, names=['pid', 'year'], dtype={'pid': np.int64, 'year': str})
+        year = pd.to_numeric(df.year, errors='coerce').fillna(UNKNOWN_YEAR).values.astype(np.int16)
+        pid = df.pid.values
+        # sort by paper ID. for duplicate IDs the last line wins, as in get_pubyear
+        order = np.argsort(pid, kind='mergesort')
+        pid = pid[order]
+        year = year[order]
+        last = np.ones(len(pid), dtype=bool)
+        last[:-1] = pid[1:] != pid[:-1]
+        index = PubyearIndex(pid[last], year[last])
+        stats.add(bytes=os.path.getsize(fname), lines=len(df), nodes=len(index))
+    logger.debug("Length of pubyear index: {}. Unknown years: {}.\n".format(len(index), (index.year == UNKNOWN_YEAR).sum()))
+    return index
+
+def get_index_dir(fname):
+    return fname + INDEX_SUFFIX
+
+def save_pubyear_index(index, fname):
+    """Save the index in binary form next to the publication year file (as '<fname>.index/')"""
+    outdir = get_index_dir(fname)
+    tmpdir = "{}.tmp{}".format(outdir, os.getpid())
+    if os.path.exists(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    np.save(os.path.join(tmpdir, 'pid.npy'), index.pid)
+    np.save(os.path.join(tmpdir, 'year.npy'), index.year)
+    st = os.stat(fname)
+    with open(os.path.join(tmpdir, 'meta.json'), 'w') as outf:
+        json.dump({'version': INDEX_VERSION, 'size': st.st_size, 'mtime': st.st_mtime, 'length': len(index)}, outf)
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+    os.rename(tmpdir, outdir)
+    logger.debug("Wrote pubyear index: {}".format(outdir))
+    return outdir
+
+def index_is_fresh(fname):
+    meta_fname = os.path.join(get_index_dir(fname), 'meta.json')
+    if not os.path.exists(meta_fname):
+        return False
+    with open(meta_fname, 'r') as f:
+        meta = json.load(f)
+    st = os.stat(fname)
+    return meta.get('version') == INDEX_VERSION and meta['size'] == st.st_size and meta['mtime'] == st.st_mtime
+
+def load_pubyear_index(fname, mmap_mode='r'):
+    """Load the saved index for a publication year file. Arrays are memory mapped by default,
+    so processes using the same index share its pages"""
+    dirname = get_index_dir(fname)
+    logger.debug("Loading pubyear index: {}".format(dirname))
+    with stage('pubyear_load') as stats:
+        pid = np.load(os.path.join(dirname, 'pid.npy'), mmap_mode=mmap_mode)
+        year = np.load(os.path.join(dirname, 'year.npy'), mmap_mode=mmap_mode)
+        stats.add(nodes=len(pid))
+    return PubyearIndex(pid, year)
+
+def get_pubyear_index(fname, save=True):
+    """Get the PubyearIndex for a publication year file, from the saved index if it is fresh
+
+    :fname: filename for the publication years
+    :save: if there is no fresh saved index, save the one that is built. if it can't be saved
+            (e.g. the directory of the publication year file is read-only), the built index is still used
+    :returns: PubyearIndex
+
+    """
+    if index_is_fresh(fname):
+        return load_pubyear_index(fname)
+    index = build_pubyear_index(fname)
+    if save:
+        try:
+            save_pubyear_index(index, fname)
+        except (IOError, OSError) as e:
+            logger.warning("Could not save pubyear index for {} ({}). Using the index in memory".format(fname, e))
+    return index
+
+def main(args):
+    index = build_pubyear_index(args.pubyears_fname)
+    outdir = save_pubyear_index(index, args.pubyears_fname)
+    logger.info("Wrote pubyear index with {} papers to {}".format(len(index), outdir))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the binary publication year index ('<pubyears_fname>.index/') used by get_means_from_tree.py")
+    parser.add_argument("pubyears_fname", type=str, help="(comma-separated) file mapping paper id to publication year")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
@@ -0,0 +1,224 @@
+import sys, os, time, json, shutil
+from glob import glob
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+COLUMNS = ['method', 'run', 'measure', 'key', 'value']
+SEGMENT_PREFIX = 'seg-'
+
+def get_segment_name():
+    # microsecond timestamp first, so segments sort in the order they were written
+    return "{}{:020d}-{}".format(SEGMENT_PREFIX, int(time.time() * 1e6), os.getpid())
+
+def get_records(method, run, outputs):
+    """Records for the results of one run
+
+    :outputs: dict {measure: dict {key: value}} (e.g. {'rank_mean': get_rank_mean(...)})
+    :returns: list of (method, run, measure, {key: value})
+
+    """
+    return [(method, run, measure, values) for measure, values in sorted(outputs.items())]
+
+def records_to_columns(records):
+    """Columns of a store segment from (method, run, measure, {key: value}) records
+
+    Keys must be integers (years, cluster sizes, depths). Others, e.g. a year of 'unknown', are skipped
+
+    :returns: dict of arrays {method, run, measure: unicode, key: int64, value: float64}
+
+    """
+    methods, runs, measures, keys, values = [], [], [], [], []
+    num_skipped = 0
+    for method, run, measure, d in records:
+        for key, value in d.items():
+            try:
+                key = int(key)
+            except (TypeError, ValueError):
+                num_skipped += 1
+                continue
+            methods.append(method)
+            runs.append(run)
+            measures.append(measure)
+            keys.append(key)
+            values.append(value)
+    if num_skipped:
+        logger.warning("Skipped {} results with non-integer keys".format(num_skipped))
+    return {
+            'method': np.array(methods, dtype='U'),
+            'run': np.array(runs, dtype='U'),
+            'measure': np.array(measures, dtype='U'),
+            'key': np.array(keys, dtype=np.int64),
+            'value': np.array(values, dtype=np.float64),
+            }
+
+class ResultStore(object):
+    """Per-run results of every method and measure in one directory, as typed numpy columns
+    keyed by (method, run, measure, key)
+
+    Each append writes one segment: a directory of .npy columns (see COLUMNS) and meta.json,
+    written under a temporary name and moved into place, so readers never see half a segment.
+    Segments are never modified. If a (method, run, measure) is in several segments, the rows of
+    the last one written replace the others (e.g. a run that was recomputed). compact merges the
+    segments into one.
+
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def get_segments(self):
+        """Segment directories, oldest first"""
+        return sorted(glob(os.path.join(self.dirname, SEGMENT_PREFIX + '*[0-9]')))
+
+    def write_segment(self, columns, name=None):
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+        outdir = os.path.join(self.dirname, name or get_segment_name())
+        tmpdir = "{}.tmp".format(outdir)
+        if os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir)
+        os.makedirs(tmpdir)
+        for name in COLUMNS:
+            np.save(os.path.join(tmpdir, "{}.npy".format(name)), columns[name])
+        with open(os.path.join(tmpdir, 'meta.json'), 'w') as outf:
+            json.dump({'version': STORE_VERSION, 'length': len(columns['key']), 'time': time.time()}, outf)
+        os.rename(tmpdir, outdir)
+        logger.debug("Wrote result store segment: {} ({} rows)".format(outdir, len(columns['key'])))
+        return outdir
+
+    def append(self, records):
+        """Add the results of some runs as a new segment
+
+        :records: list of (method, run, measure, {key: value}) (see get_records)
+        :returns: segment directory, or None if there was nothing to write
+
+        """
+        columns = records_to_columns(records)
+        if len(columns['key']) == 0:
+            return None
+        return self.write_segment(columns)
+
+    def read_segment(self, dirname, mmap_mode=None):
+        with open(os.path.join(dirname, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') != STORE_VERSION:
+            raise RuntimeError("result store segment {} has version {}, expected {}".format(dirname, meta.get('version'), STORE_VERSION))
+        return dict((name, np.load(os.path.join(dirname, "{}.npy".format(name)), mmap_mode=mmap_mode)) for name in COLUMNS)
+
+    def load(self, methods=None, measures=None):
+        """Load the results as one DataFrame
+
+        :methods, measures: if given, only load these
+        :returns: DataFrame with columns method, run, measure (categorical), key (int64), value (float64),
+                  sorted by method, measure, run, key
+
+        """
+        parts = []
+        for i, dirname in enumerate(self.get_segments()):
+            columns = self.read_segment(dirname)
+            keep = np.ones(len(columns['key']), dtype=bool)
+            if methods is not None:
+                keep &= np.isin(columns['method'], methods)
+            if measures is not None:
+                keep &= np.isin(columns['measure'], measures)
+            part = pd.DataFrame(dict((name, columns[name][keep]) for name in COLUMNS), columns=COLUMNS)
+            part['segment'] = i
+            parts.append(part)
+        if not parts:
+            df = pd.DataFrame(records_to_columns([]), columns=COLUMNS)
+        else:
+            df = pd.concat(parts, ignore_index=True)
+            # a run's results for a measure come from the last segment holding them
+            last = df.groupby(['method', 'run', 'measure'])['segment'].transform('max')
+            df = df[df['segment'] == last].drop('segment', axis=1)
+        for name in ['method', 'run', 'measure']:
+            df[name] = df[name].astype('category')
+        return df.sort_values(['method', 'measure', 'run', 'key']).reset_index(drop=True)
+
+    def get_runs(self):
+        """Set of (method, run, measure) in the store"""
+        df = self.load()
+        return set(zip(df['method'].astype(str), df['run'].astype(str), df['measure'].astype(str)))
+
+    def compact(self):
+        """Merge all of the segments into one, dropping replaced rows
+
+        :returns: number of segments before compacting
+
+        """
+        segments = self.get_segments()
+        if len(segments) <= 1:
+            return len(segments)
+        df = self.load()
+        columns = dict((name, np.asarray(df[name].astype(str), dtype='U') if name in ['method', 'run', 'measure'] else df[name].values) for name in COLUMNS)
+        # named after the last segment, so it sorts after the segments it replaces and before any appended meanwhile
+        self.write_segment(columns, name=os.path.basename(segments[-1]) + '-0')
+        for dirname in segments:
+            shutil.rmtree(dirname)
+        return len(segments)
+
+def load_results(dirname, methods=None, measures=None):
+    """Load a result store as one DataFrame (for the plotting notebooks). see ResultStore.load"""
+    return ResultStore(dirname).load(methods, measures)
+
+def import_runs(store, basedir, methods, measures):
+    """Add the per-run csv files (see aggregate_runs.py) that are not in the store yet, as one segment
+
+    :returns: number of runs added
+
+    """
+    from aggregate_runs import get_run_fnames, read_run
+    existing = store.get_runs()
+    records = []
+    for method in methods:
+        for measure in measures:
+            for fname in get_run_fnames(basedir, method, measure):
+                run = os.path.basename(fname)[:-len("-{}.csv".format(measure))]
+                if (method, run, measure) in existing:
+                    continue
+                records.append( (method, run, measure, read_run(fname)) )
+    store.append(records)
+    return len(records)
+
+def main(args):
+    store = ResultStore(args.store)
+    if args.command == 'import':
+        from aggregate_runs import METHODS, MEASURE_DIRS
+        num_added = import_runs(store, args.basedir, args.methods or METHODS, args.measures or sorted(MEASURE_DIRS))
+        logger.info("Added {} runs to {}".format(num_added, args.store))
+    elif args.command == 'compact':
+        num_segments = store.compact()
+        logger.info("Compacted {} segments".format(num_segments))
+    df = store.load()
+    logger.info("{}: {} segments, {} rows, {} runs".format(args.store, len(store.get_segments()), len(df), len(df.groupby(['method', 'run'], observed=True))))
+    for (method, measure), group in df.groupby(['method', 'measure'], observed=True):
+        logger.info("{} {}: {} runs".format(method, measure, group['run'].nunique()))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Manage the consolidated store of per-run results (rank_mean, size_counts, etc.) written by the analysis scripts with --store: import the existing per-run csv files, compact the store, or show what is in it")
+    parser.add_argument("command", choices=['import', 'compact', 'info'], help="import: add the per-run csv files under basedir that are not in the store yet. compact: merge the store's segments into one. info: show the number of runs")
+    parser.add_argument("store", help="result store directory")
+    parser.add_argument("--basedir", default='.', help="with import: directory containing the method directories (default: current directory)")
+    parser.add_argument("--methods", nargs='+', help="with import: methods to import (default: all)")
+    parser.add_argument("--measures", nargs='+', help="with import: measures to import (default: all)")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
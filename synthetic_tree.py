@@ -0,0 +1,142 @@
+import sys, os, time
+from datetime import datetime
+
+import numpy as np
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# probability of a leaf at depth 1, 2, ... (real jstor trees are mostly 3-5 levels deep)
+DEPTH_WEIGHTS = [0.01, 0.09, 0.3, 0.4, 0.2]
+FIRST_PID = 1
+YEARS = (1900, 2015)
+
+def parse_weights(s):
+    """Parse comma-separated weights (e.g. '0.1,0.3,0.6') into probabilities"""
+    weights = np.array([float(x) for x in s.split(',')], dtype=np.float64)
+    if (weights < 0).any() or weights.sum() <= 0:
+        raise ValueError("weights must be non-negative and not all zero: {}".format(s))
+    return weights / weights.sum()
+
+def iter_tree_paths(num_nodes, depth_weights=DEPTH_WEIGHTS, module_size=20, seed=None):
+    """Generate the paths of the leaves of a random module hierarchy, in tree file order
+
+    Leaves are made one module at a time. Each module gets a leaf depth drawn from depth_weights
+    and a geometric number of leaves with mean module_size. It is placed under a random ancestor
+    of the previous module, so paths are unique and depth first like an Infomap tree file.
+
+    :num_nodes: number of leaves
+    :depth_weights: probability of each leaf depth, starting at depth 1
+    :module_size: mean number of leaves in a module
+    :returns: iterator of lists of path components (ints)
+
+    """
+    rng = np.random.RandomState(seed)
+    depth_weights = np.asarray(depth_weights, dtype=np.float64)
+    depth_weights = depth_weights / depth_weights.sum()
+    path = []
+    # next free component under the root and under each module of the current path
+    next_child = [1]
+    num_done = 0
+    while num_done < num_nodes:
+        module_depth = rng.choice(len(depth_weights), p=depth_weights)
+        keep = rng.randint(0, min(len(path), module_depth) + 1)
+        if keep == len(path) == module_depth and keep > 0:
+            # a new module, not more leaves in the same one
+            keep -= 1
+        del path[keep:]
+        del next_child[keep+1:]
+        while len(path) < module_depth:
+            path.append(next_child[-1])
+            next_child[-1] += 1
+            next_child.append(1)
+        size = min(rng.geometric(1.0 / module_size), num_nodes - num_done)
+        for _ in range(size):
+            yield path + [next_child[-1]]
+            next_child[-1] += 1
+        num_done += size
+
+def write_tree(fname, num_nodes, depth_weights=DEPTH_WEIGHTS, module_size=20, seed=None, first_pid=FIRST_PID):
+    """Write a synthetic tree file. pids first_pid .. first_pid+num_nodes-1 are shuffled over the leaves,
+    so trees with different seeds cluster the same papers
+
+    :returns: fname
+
+    """
+    rng = np.random.RandomState(seed)
+    pids = (rng.permutation(num_nodes) + first_pid).tolist()
+    flows = rng.exponential(1.0 / num_nodes, size=num_nodes).tolist()
+    with open(fname, 'w') as outf:
+        outf.write("# Codelength = {:.6f} bits.\n".format(rng.uniform(5, 20)))
+        outf.write("# path flow name node_id\n")
+        lines = []
+        for i, path in enumerate(iter_tree_paths(num_nodes, depth_weights, module_size, seed)):
+            lines.append("{} {!r} \"{}\" {}\n".format(":".join(str(x) for x in path), flows[i], pids[i], i + 1))
+            if len(lines) >= 100000:
+                outf.write("".join(lines))
+                lines = []
+        outf.write("".join(lines))
+    return fname
+
+def write_pubyear(fname, num_nodes, unknown=0.05, seed=None, first_pid=FIRST_PID, years=YEARS):
+    """Write a publication year file (pid,year) for the papers of synthetic trees
+
+    :unknown: fraction of papers whose year is 'unknown', as in the real file
+    :returns: fname
+
+    """
+    rng = np.random.RandomState(seed)
+    year = rng.randint(years[0], years[1] + 1, size=num_nodes).tolist()
+    is_unknown = (rng.random_sample(num_nodes) < unknown).tolist()
+    with open(fname, 'w') as outf:
+        for i in range(0, num_nodes, 100000):
+            outf.write("".join("{},{}\n".format(first_pid + j, 'unknown' if is_unknown[j] else year[j]) for j in range(i, min(i + 100000, num_nodes))))
+    return fname
+
+def write_workload(outdir, num_nodes, num_trees=1, depth_weights=DEPTH_WEIGHTS, module_size=20, seed=0):
+    """Write a pubyear file and num_trees synthetic trees of the same papers, laid out like a method directory
+    (<outdir>/pubyear.csv, <outdir>/undirdir/<i>/synthetic.tree)
+
+    :returns: (pubyear filename, list of tree filenames)
+
+    """
+    pubyear_fname = write_pubyear(os.path.join(outdir, 'pubyear.csv'), num_nodes, seed=seed)
+    fnames = []
+    for i in range(num_trees):
+        dirname = os.path.join(outdir, 'undirdir', str(i + 1))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fnames.append(write_tree(os.path.join(dirname, 'synthetic.tree'), num_nodes, depth_weights, module_size, seed=seed + i + 1))
+    return pubyear_fname, fnames
+
+def main(args):
+    start = time.time()
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    pubyear_fname, fnames = write_workload(args.outdir, args.num_nodes, args.num_trees, parse_weights(args.depth_weights), args.module_size, args.seed)
+    logger.info("Wrote {} and {} tree files of {} nodes. Took {:.2f} seconds".format(pubyear_fname, len(fnames), args.num_nodes, time.time() - start))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Write synthetic Infomap .tree files (and a matching publication year file) for testing and benchmarking")
+    parser.add_argument("outdir", type=str, help="output directory. trees go in <outdir>/undirdir/<i>/synthetic.tree")
+    parser.add_argument("-n", "--num-nodes", type=int, default=100000, help="number of nodes in each tree")
+    parser.add_argument("--num-trees", type=int, default=2, help="number of trees (clusterings of the same papers)")
+    parser.add_argument("--depth-weights", type=str, default=",".join(str(x) for x in DEPTH_WEIGHTS), help="comma-separated relative frequency of each leaf depth, starting at depth 1")
+    parser.add_argument("--module-size", type=float, default=20, help="mean number of leaves in a module")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
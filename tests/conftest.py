@@ -0,0 +1,15 @@
+import sys, os
+
+# the scripts are run from the repo root (and compare_vi), not installed.
+# compare_vi comes first: its modules import its own get_all_tree_fnames_combinations, not the root one
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'compare_vi'))
+
+import pytest
+
+@pytest.fixture(scope='session')
+def workload(tmpdir_factory):
+    """(pubyear filename, tree filenames): small synthetic trees of the same papers (see synthetic_tree.py)"""
+    from synthetic_tree import write_workload
+    return write_workload(str(tmpdir_factory.mktemp('workload')), 3000, num_trees=3)
@@ -0,0 +1,46 @@
+import os, csv
+from argparse import Namespace
+
+import numpy as np
+
+import get_means_from_tree
+import get_size_and_depth_from_tree
+from cluster_index import ClusterIndex
+
+MEASURES = ['rank_mean', 'size_mean', 'depth_mean']
+
+def get_rows(columns, index=None):
+    """(pid, flow, depth, module path) rows of parsed columns, as parse_tree_lines gives them"""
+    if index is None:
+        index = ClusterIndex.from_arrays(columns['cluster_parent'], columns['cluster_component'])
+    modules = [index.get_path(cid) for cid in np.asarray(columns['module']).tolist()]
+    return list(zip(np.asarray(columns['pid']).tolist(), np.asarray(columns['flow']).tolist(), np.asarray(columns['depth']).tolist(), modules))
+
+def read_csv_dict(fname):
+    """{key: value} of a two-column output csv, skipping a header"""
+    d = {}
+    with open(fname, 'r') as f:
+        for row in csv.reader(f):
+            try:
+                d[int(row[0])] = float(row[1])
+            except ValueError:
+                continue
+    return d
+
+def assert_same_csv(fname, expected_fname):
+    d = read_csv_dict(fname)
+    expected = read_csv_dict(expected_fname)
+    assert d and sorted(d) == sorted(expected)
+    for k in d:
+        assert np.isclose(d[k], expected[k], rtol=1e-12), (fname, k)
+
+def run_standalone(pubyear_fname, fname, outdir, label):
+    for measure in MEASURES:
+        if not os.path.isdir(os.path.join(outdir, measure)):
+            os.makedirs(os.path.join(outdir, measure))
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    get_means_from_tree.main(Namespace(tree_fname=fname, pubyears_fname=pubyear_fname, outdir=outdir, label=label,
+        cache_dir=None, vectorized=False, processes=1, run_report=False, profile=None))
+    get_size_and_depth_from_tree.main(Namespace(tree_fname=fname, outdir=outdir, label=label,
+        cache_dir=None, processes=1, node_size_depth_format='csv', run_report=False, profile=None))
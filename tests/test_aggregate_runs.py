@@ -0,0 +1,61 @@
+import os, shutil
+
+import numpy as np
+
+from aggregate_runs import RunAggregator
+
+def write_runs(basedir, values):
+    dirname = os.path.join(basedir, 'undirdir', 'rank_mean')
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fnames = []
+    for i, d in enumerate(values):
+        fname = os.path.join(dirname, "{}-rank_mean.csv".format(i + 1))
+        with open(fname, 'w') as outf:
+            outf.write("".join("{},{}\n".format(k, v) for k, v in sorted(d.items())))
+        fnames.append(fname)
+    return fnames
+
+def test_incremental_matches_one_pass(tmpdir):
+    values = [{1990: 1.0, 1991: 2.0}, {1990: 3.0, 1991: 5.0}, {1990: 4.0}]
+    fnames = write_runs(str(tmpdir), values)
+    summary = str(tmpdir.join('summary.csv'))
+    agg = RunAggregator.load(summary)
+    agg.add_run_fname('undirdir', 'rank_mean', fnames[0])
+    agg.save(summary)
+    agg = RunAggregator.load(summary)
+    for fname in fnames:
+        agg.add_run_fname('undirdir', 'rank_mean', fname)
+    n, mean, m2 = agg.stats[('undirdir', 'rank_mean', 1990)]
+    assert n == 3
+    assert np.isclose(mean, np.mean([1.0, 3.0, 4.0]))
+    assert np.isclose(m2 / (n - 1), np.var([1.0, 3.0, 4.0], ddof=1))
+
+def test_interrupted_save_is_recomputed(tmpdir):
+    fnames = write_runs(str(tmpdir), [{1990: 1.0}, {1990: 3.0}])
+    summary = str(tmpdir.join('summary.csv'))
+    agg = RunAggregator()
+    agg.add_run_fname('undirdir', 'rank_mean', fnames[0])
+    agg.save(summary)
+    shutil.copy(summary, str(tmpdir.join('old_summary.csv')))
+    agg.add_run_fname('undirdir', 'rank_mean', fnames[1])
+    agg.save(summary)
+    # as if the second save stopped after replacing the run list but before the summary
+    shutil.copy(str(tmpdir.join('old_summary.csv')), summary)
+    agg = RunAggregator.load(summary)
+    assert agg.runs == set()
+    for fname in fnames:
+        agg.add_run_fname('undirdir', 'rank_mean', fname)
+    assert agg.stats[('undirdir', 'rank_mean', 1990)][:2] == [2, 2.0]
+
+def test_load_after_save(tmpdir):
+    fnames = write_runs(str(tmpdir), [{1990: 1.0}, {1990: 3.0}])
+    summary = str(tmpdir.join('summary.csv'))
+    agg = RunAggregator()
+    for fname in fnames:
+        agg.add_run_fname('undirdir', 'rank_mean', fname)
+    agg.save(summary)
+    loaded = RunAggregator.load(summary)
+    assert loaded.runs == agg.runs
+    assert loaded.num_runs == agg.num_runs
+    assert not loaded.add_run_fname('undirdir', 'rank_mean', fnames[0])
@@ -0,0 +1,72 @@
+import os, shutil
+from argparse import Namespace
+
+import get_means_from_tree_batch
+from helpers import assert_same_csv, run_standalone
+
+def copy_workload(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    basedir = str(tmpdir.join('run'))
+    os.makedirs(os.path.join(basedir, 'undirdir'))
+    shutil.copy(pubyear_fname, basedir)
+    copies = []
+    for fname in fnames:
+        label = os.path.basename(os.path.dirname(fname))
+        os.makedirs(os.path.join(basedir, 'undirdir', label))
+        copies.append(shutil.copy(fname, os.path.join(basedir, 'undirdir', label)))
+    return os.path.join(basedir, 'pubyear.csv'), copies, basedir
+
+def get_batch_args(pubyear_fname, basedir, **kwargs):
+    args = Namespace(pubyears_fname=pubyear_fname, basedir=basedir, methods=['undirdir'], processes=2,
+            size_depth=True, node_size_depth_format='csv', manifest=None, no_manifest=False, force=False,
+            save_every=50, store=None, cache_dir=None, vectorized=False, run_report=False, profile=None)
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+    return args
+
+def test_batch_matches_standalone(workload, tmpdir):
+    pubyear_fname, fnames, basedir = copy_workload(workload, tmpdir)
+    get_means_from_tree_batch.main(get_batch_args(pubyear_fname, basedir, store=os.path.join(basedir, 'store')))
+    outdir = os.path.join(basedir, 'undirdir')
+    for fname in fnames:
+        label = os.path.basename(os.path.dirname(fname))
+        expected_dir = str(tmpdir.join('standalone', label))
+        run_standalone(pubyear_fname, fname, expected_dir, label)
+        for measure in get_means_from_tree_batch.MEASURES:
+            assert_same_csv(os.path.join(outdir, measure, "{}-{}.csv".format(label, measure)),
+                    os.path.join(expected_dir, measure, "{}-{}.csv".format(label, measure)))
+        for name in ['size_counts', 'depth_counts']:
+            assert_same_csv(os.path.join(outdir, get_means_from_tree_batch.SIZE_DEPTH_DIR, "{}-{}.csv".format(label, name)),
+                    os.path.join(expected_dir, "{}-{}.csv".format(label, name)))
+        with open(os.path.join(outdir, get_means_from_tree_batch.SIZE_DEPTH_DIR, "{}-node_size_depth.csv".format(label))) as f, \
+                open(os.path.join(expected_dir, "{}-node_size_depth.csv".format(label))) as expected:
+            assert f.read() == expected.read()
+
+def test_batch_skips_current(workload, tmpdir):
+    pubyear_fname, fnames, basedir = copy_workload(workload, tmpdir)
+    get_means_from_tree_batch.main(get_batch_args(pubyear_fname, basedir))
+    outputs = get_means_from_tree_batch.get_outputs('means', os.path.join(basedir, 'undirdir'), '1')
+    mtime = os.stat(outputs[0]).st_mtime
+    get_means_from_tree_batch.main(get_batch_args(pubyear_fname, basedir))
+    assert os.stat(outputs[0]).st_mtime == mtime
+
+def test_process_tree_reads_once(workload, tmpdir, monkeypatch):
+    import tree_analyzer
+    from pubyear_index import get_pubyear_index
+    pubyear_fname, fnames, basedir = copy_workload(workload, tmpdir)
+    outdir = os.path.join(basedir, 'undirdir')
+    for dirname in get_means_from_tree_batch.MEASURES + [get_means_from_tree_batch.SIZE_DEPTH_DIR]:
+        os.makedirs(os.path.join(outdir, dirname))
+    reads = []
+    read_tree_chunks = tree_analyzer.read_tree_chunks
+    def counting_read(fname, *args, **kwargs):
+        reads.append(fname)
+        return read_tree_chunks(fname, *args, **kwargs)
+    monkeypatch.setattr(tree_analyzer, 'read_tree_chunks', counting_read)
+    monkeypatch.setattr(get_means_from_tree_batch, '_pubyear', get_pubyear_index(pubyear_fname, save=False))
+    monkeypatch.setattr(get_means_from_tree_batch, '_use_store', True)
+    job, signature, took, results = get_means_from_tree_batch.process_tree((fnames[0], outdir, '1', ['means', 'size_depth'], None))
+    assert reads == [fnames[0]]
+    assert sorted(results) == ['depth_counts', 'depth_mean', 'rank_mean', 'size_counts', 'size_mean']
+    for output in get_means_from_tree_batch.get_outputs('means', outdir, '1') + get_means_from_tree_batch.get_outputs('size_depth', outdir, '1'):
+        assert os.path.exists(output)
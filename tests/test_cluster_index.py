@@ -0,0 +1,26 @@
+import numpy as np
+
+from tree_reader import parse_tree_lines
+from tree_cache import parse_tree_columns
+from cluster_index import ClusterIndex, index_tree
+
+def get_paths(parent, component, module):
+    index = ClusterIndex.from_arrays(parent, component)
+    return [index.get_path(cid) for cid in np.asarray(module).tolist()]
+
+def test_levels_are_module_prefixes(workload):
+    pubyear_fname, fnames = workload
+    columns = parse_tree_columns(fnames[0])
+    index = ClusterIndex.from_arrays(columns['cluster_parent'], columns['cluster_component'])
+    for node in range(0, len(columns['pid']), 97):
+        path = index.get_path(int(columns['module'][node])).split(':')
+        for level, cid in enumerate(columns['levels'][:, node].tolist()):
+            if level < len(path) and path[0]:
+                assert index.get_path(cid) == ':'.join(path[:level + 1])
+            else:
+                assert cid == -1
+
+def test_index_tree_paths(workload):
+    pubyear_fname, fnames = workload
+    index, pid, module = index_tree(fnames[0])
+    assert get_paths(index.arrays()['parent'], index.arrays()['component'], module) == [row[3] for row in parse_tree_lines(fnames[0])]
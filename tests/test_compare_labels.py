@@ -0,0 +1,72 @@
+import itertools, math
+
+import numpy as np
+
+from vi_compare import compare_labels, get_vi_from_fnames, MEASURES
+from vi_store import IDENTICAL_VALUES
+
+def brute_force(left, right):
+    """Every measure from its definition, pair by pair and cluster by cluster"""
+    n = len(left)
+    pairs = {'both': 0, 'left': 0, 'right': 0, 'agree': 0}
+    for a, b in itertools.combinations(range(n), 2):
+        in_left = left[a] == left[b]
+        in_right = right[a] == right[b]
+        pairs['both'] += in_left and in_right
+        pairs['left'] += in_left
+        pairs['right'] += in_right
+        pairs['agree'] += in_left == in_right
+    total = n * (n - 1) / 2.0
+    expected = pairs['left'] * pairs['right'] / total
+    best = (pairs['left'] + pairs['right']) / 2.0
+    joint = {}
+    for a, b in zip(left, right):
+        joint[(a, b)] = joint.get((a, b), 0) + 1
+    def entropy(counts):
+        return -sum(c / float(n) * math.log(c / float(n)) for c in counts if c)
+    h_left = entropy([list(left).count(x) for x in set(left)])
+    h_right = entropy([list(right).count(x) for x in set(right)])
+    h_joint = entropy(joint.values())
+    mi = h_left + h_right - h_joint
+    split_join = 2 * n
+    for x in set(left):
+        split_join -= max(c for (a, b), c in joint.items() if a == x)
+    for y in set(right):
+        split_join -= max(c for (a, b), c in joint.items() if b == y)
+    return {
+            'vi': h_joint - mi,
+            'nmi': 2 * mi / (h_left + h_right) if h_left + h_right else 1.0,
+            'rand': pairs['agree'] / total,
+            'adjusted_rand': (pairs['both'] - expected) / (best - expected) if best != expected else 1.0,
+            'split_join': split_join,
+            }
+
+def test_measures_match_definitions():
+    rng = np.random.RandomState(0)
+    for n, k_left, k_right in [(40, 3, 5), (60, 8, 2), (30, 1, 4)]:
+        left = rng.randint(k_left, size=n)
+        right = rng.randint(k_right, size=n)
+        results = compare_labels(left, right)
+        assert sorted(results) == sorted(MEASURES)
+        for measure, value in brute_force(left.tolist(), right.tolist()).items():
+            assert np.isclose(results[measure], value, atol=1e-12), measure
+
+def test_symmetric_and_identical():
+    rng = np.random.RandomState(1)
+    left = rng.randint(6, size=100)
+    right = rng.randint(4, size=100)
+    forward = compare_labels(left, right)
+    backward = compare_labels(right, left)
+    for measure in MEASURES:
+        assert np.isclose(forward[measure], backward[measure])
+    # relabeling doesn't change the clustering
+    same = compare_labels(left, (left + 3) % 6)
+    for measure in MEASURES:
+        assert np.isclose(same[measure], IDENTICAL_VALUES[measure])
+
+def test_tree_files(workload):
+    pubyear_fname, fnames = workload
+    assert get_vi_from_fnames(fnames[0], fnames[0]) == 0.0
+    vi = get_vi_from_fnames(fnames[0], fnames[1])
+    assert vi > 0
+    assert np.isclose(vi, get_vi_from_fnames(fnames[1], fnames[0]))
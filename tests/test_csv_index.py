@@ -0,0 +1,49 @@
+import os
+
+from csv_index import write_csv_with_index, build_index, index_is_fresh, read_rows, get_num_rows
+
+def get_lines(num_rows):
+    return ["{},left_{},right_{}\n".format(i, i, i) for i in range(num_rows)]
+
+def test_write_round_trip(tmpdir):
+    fname = str(tmpdir.join('pairs.csv'))
+    assert write_csv_with_index(get_lines(50), fname, header='idx,fname_left,fname_right\n') == 50
+    assert index_is_fresh(fname)
+    assert get_num_rows(fname) == 50
+    assert read_rows(fname, 0) == ['0,left_0,right_0']
+    assert read_rows(fname, 48, 60) == ['48,left_48,right_48', '49,left_49,right_49']
+    assert read_rows(fname, 50) == []
+
+def test_build_index_matches_write(tmpdir):
+    written = str(tmpdir.join('written.csv'))
+    built = str(tmpdir.join('built.csv'))
+    write_csv_with_index(get_lines(20), written, header='idx,a,b\n')
+    with open(built, 'w') as outf:
+        outf.write('idx,a,b\n')
+        outf.writelines(get_lines(20))
+    assert build_index(built, header=True) == 20
+    with open(written + '.idx', 'rb') as a, open(built + '.idx', 'rb') as b:
+        assert a.read() == b.read()
+
+def test_fresh_right_after_writing(tmpdir):
+    # the index must never look older than the csv it was written with
+    fname = str(tmpdir.join('pairs.csv'))
+    for _ in range(100):
+        write_csv_with_index(get_lines(10), fname)
+        assert index_is_fresh(fname)
+
+def test_stale_when_csv_changes(tmpdir):
+    fname = str(tmpdir.join('pairs.csv'))
+    write_csv_with_index(get_lines(10), fname)
+    with open(fname, 'a') as outf:
+        outf.write('10,left_10,right_10\n')
+    assert not index_is_fresh(fname)
+    build_index(fname)
+    assert index_is_fresh(fname)
+    assert read_rows(fname, 10) == ['10,left_10,right_10']
+
+def test_missing_index(tmpdir):
+    fname = str(tmpdir.join('pairs.csv'))
+    with open(fname, 'w') as outf:
+        outf.writelines(get_lines(3))
+    assert not index_is_fresh(fname)
@@ -0,0 +1,46 @@
+import csv, types
+from argparse import Namespace
+
+import numpy as np
+
+import get_vi_parallel
+from get_all_tree_fnames_combinations import output_combinations
+from vi_compare import get_vi_from_fnames
+
+def get_args(csvfilename, output, **kwargs):
+    args = Namespace(csvfilename=csvfilename, basedir=None, start=0, stop=None, output=output, processes=2,
+            chunksize=2, batch_size=2, worker_cache_size=4, measures=['vi'], store=None, build_cache=False,
+            cache_dir=None, run_report=False, profile=None)
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+    return args
+
+def read_output(fname):
+    with open(fname, 'r') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == get_vi_parallel.OUTPUT_HEADER + ['vi']
+    return dict(((row[1], row[2]), float(row[3])) for row in rows[1:])
+
+def test_pairs_csv_is_streamed(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    csvfilename = str(tmpdir.join('combinations.csv'))
+    output_combinations(fnames, csvfilename)
+    pairs = get_vi_parallel.iter_pairs_csv(csvfilename)
+    assert isinstance(pairs, types.GeneratorType)
+    assert list(pairs) == [(0, fnames[0], fnames[1]), (1, fnames[0], fnames[2]), (2, fnames[1], fnames[2])]
+    assert get_vi_parallel.scan_pairs_csv(csvfilename) == (3, sorted(fnames))
+
+def test_vi_from_csv_and_resume(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    csvfilename = str(tmpdir.join('combinations.csv'))
+    output_combinations(fnames, csvfilename)
+    output = str(tmpdir.join('vi.csv'))
+    get_vi_parallel.main(get_args(csvfilename, output))
+    results = read_output(output)
+    assert len(results) == 3
+    for (a, b), vi in results.items():
+        assert np.isclose(vi, get_vi_from_fnames(a, b))
+    # a resumed run finds every pair in the output
+    get_vi_parallel.main(get_args(csvfilename, output))
+    with open(output, 'r') as f:
+        assert len(f.readlines()) == 4
@@ -0,0 +1,54 @@
+import os
+
+import manifest
+from manifest import Manifest, get_file_signature
+
+def count_hashes(monkeypatch):
+    hashed = []
+    get_file_hash = manifest.get_file_hash
+    def counting_hash(fname, *args, **kwargs):
+        hashed.append(fname)
+        return get_file_hash(fname, *args, **kwargs)
+    monkeypatch.setattr(manifest, 'get_file_hash', counting_hash)
+    return hashed
+
+def test_dep_signature_not_rehashed(tmpdir, monkeypatch):
+    fname = str(tmpdir.join('pubyear.csv'))
+    tmpdir.join('pubyear.csv').write('1,1990\n2,2001\n')
+    manifest_fname = str(tmpdir.join('manifest.json'))
+    m = Manifest(manifest_fname)
+    signature = m.get_signature(fname)
+    assert signature['sha1'] == get_file_signature(fname)['sha1']
+    m.save()
+
+    hashed = count_hashes(monkeypatch)
+    assert Manifest(manifest_fname).get_signature(fname) == signature
+    assert hashed == []
+
+    tmpdir.join('pubyear.csv').write('1,1990\n2,2002\n')
+    os.utime(fname, (signature['mtime'] + 10, signature['mtime'] + 10))
+    changed = Manifest(manifest_fname).get_signature(fname)
+    assert hashed == [fname]
+    assert changed['sha1'] != signature['sha1']
+
+def test_tree_signature_reused(tmpdir, monkeypatch):
+    tree = str(tmpdir.join('a.tree'))
+    output = str(tmpdir.join('out.csv'))
+    tmpdir.join('a.tree').write('1:1 0.5 "1" 1\n')
+    tmpdir.join('out.csv').write('')
+    m = Manifest(str(tmpdir.join('manifest.json')))
+    assert m.find_signature(tree, ['means']) is None
+    m.record('means', tree, 1, [output])
+    sha1 = get_file_signature(tree)['sha1']
+
+    hashed = count_hashes(monkeypatch)
+    # a new analyzer version has to process the file again, but the recorded hash is still good
+    assert not m.is_current('means', tree, 2, outputs=[output])
+    assert m.find_signature(tree, ['means'])['sha1'] == sha1
+    # touched: is_current hashes it, and that hash is reused
+    st = os.stat(tree)
+    os.utime(tree, (st.st_mtime + 10, st.st_mtime + 10))
+    assert m.is_current('means', tree, 1, outputs=[output])
+    assert len(hashed) == 1
+    assert m.find_signature(tree, ['means'])['mtime'] == os.stat(tree).st_mtime
+    assert len(hashed) == 1
@@ -0,0 +1,51 @@
+import itertools
+
+import numpy as np
+
+from pair_space import num_pairs, rank_pair, unrank_pair, unrank_pairs, iter_pairs, iter_pairs_by_index, sample_pair_indices
+from get_all_tree_fnames_combinations import get_fnames
+
+def test_unrank_round_trip():
+    for n in [2, 3, 7, 50]:
+        pairs = list(itertools.combinations(range(n), 2))
+        assert num_pairs(n) == len(pairs)
+        for k, (i, j) in enumerate(pairs):
+            assert rank_pair(i, j, n) == k
+            assert unrank_pair(k, n) == (i, j)
+        i, j = unrank_pairs(np.arange(len(pairs)), n)
+        assert list(zip(i.tolist(), j.tolist())) == pairs
+
+def test_unrank_large_n():
+    # floating point error in the closed form shows up only for large n
+    n = 10 ** 6
+    ks = np.array([0, 1, n - 2, n - 1, num_pairs(n) // 2, num_pairs(n) - 2, num_pairs(n) - 1], dtype=np.int64)
+    i, j = unrank_pairs(ks, n)
+    for k, a, b in zip(ks.tolist(), i.tolist(), j.tolist()):
+        assert 0 <= a < b < n
+        assert rank_pair(a, b, n) == k
+        assert unrank_pair(k, n) == (a, b)
+
+def test_iter_pairs_matches_combinations():
+    fnames = ['f{}'.format(i) for i in range(9)]
+    expected = [(k, a, b) for k, (a, b) in enumerate(itertools.combinations(fnames, 2))]
+    assert list(iter_pairs(fnames)) == expected
+    assert list(iter_pairs(fnames, 5, 20)) == expected[5:20]
+    assert list(iter_pairs_by_index(fnames, [3, 0, 35])) == [expected[3], expected[0], expected[35]]
+
+def test_sample_pair_indices():
+    for number in [10, 30]:
+        sampled = sample_pair_indices(9, number, seed=1)
+        assert len(sampled) == number
+        assert len(np.unique(sampled)) == number
+        assert sampled.min() >= 0 and sampled.max() < num_pairs(9)
+
+def test_get_fnames_sorted(tmpdir):
+    # pair indices are only stable if the file order doesn't depend on os.walk
+    method_dir = tmpdir.mkdir('undirdir')
+    for name in ['9', '10', '2']:
+        method_dir.mkdir(name)
+        for tree in ['b.tree', 'a.tree']:
+            tmpdir.join('undirdir', name, tree).write('')
+    fnames = get_fnames('undirdir', str(tmpdir))
+    assert len(fnames) == 6
+    assert fnames == sorted(fnames)
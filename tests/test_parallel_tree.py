@@ -0,0 +1,10 @@
+from tree_reader import parse_tree_lines
+from parallel_tree import parse_tree_columns_parallel
+from helpers import get_rows
+
+def test_parallel_matches_serial(workload):
+    pubyear_fname, fnames = workload
+    expected = parse_tree_lines(fnames[0])
+    for processes, num_ranges in [(1, 3), (2, 2), (2, 5)]:
+        index, columns = parse_tree_columns_parallel(fnames[0], processes, num_ranges)
+        assert get_rows(columns, index) == expected
@@ -0,0 +1,28 @@
+import os
+
+import pubyear_index
+from pubyear_index import get_pubyear_index, get_index_dir, index_is_fresh, UNKNOWN_YEAR
+
+def write_pubyears(tmpdir):
+    fname = str(tmpdir.join('pubyears.csv'))
+    with open(fname, 'w') as outf:
+        outf.write('3,1990\n1,1985\n7,unknown\n3,1991\n')
+    return fname
+
+def test_lookup_and_saved_index(tmpdir):
+    fname = write_pubyears(tmpdir)
+    index = get_pubyear_index(fname)
+    assert index_is_fresh(fname)
+    for index in [index, get_pubyear_index(fname)]:
+        # the last line wins for a duplicate paper ID
+        assert index.lookup([1, 3, 7, 8]).tolist() == [1985, 1991, UNKNOWN_YEAR, UNKNOWN_YEAR]
+
+def test_unwritable_index_dir(tmpdir, monkeypatch):
+    fname = write_pubyears(tmpdir)
+    def makedirs(*args, **kwargs):
+        raise OSError(13, 'Permission denied')
+    # as if the directory of the publication year file were read-only
+    monkeypatch.setattr(pubyear_index.os, 'makedirs', makedirs)
+    index = get_pubyear_index(fname)
+    assert not os.path.exists(get_index_dir(fname))
+    assert index.lookup([1, 3]).tolist() == [1985, 1991]
@@ -0,0 +1,22 @@
+from result_store import ResultStore, get_records
+
+def test_append_load_compact(tmpdir):
+    store = ResultStore(str(tmpdir.join('store')))
+    store.append(get_records('undirdir', '1', {'rank_mean': {1990: 0.5, 1991: 0.25}, 'size_counts': {1: 10, 'unknown': 3}}))
+    store.append(get_records('pagerank', '1', {'rank_mean': {1990: 0.75}}))
+    # a recomputed run replaces the rows of the earlier segment
+    store.append(get_records('undirdir', '1', {'rank_mean': {1990: 0.5, 1992: 0.125}}))
+    df = store.load()
+    rows = set(zip(df['method'].astype(str), df['run'].astype(str), df['measure'].astype(str), df['key'].tolist(), df['value'].tolist()))
+    assert rows == set([
+        ('pagerank', '1', 'rank_mean', 1990, 0.75),
+        ('undirdir', '1', 'rank_mean', 1990, 0.5),
+        ('undirdir', '1', 'rank_mean', 1992, 0.125),
+        ('undirdir', '1', 'size_counts', 1, 10.0),
+        ])
+    assert store.compact() == 3
+    assert len(store.get_segments()) == 1
+    compacted = store.load()
+    assert compacted.astype(str).values.tolist() == df.astype(str).values.tolist()
+    assert len(store.load(methods=['pagerank'])) == 1
+    assert len(store.load(measures=['size_counts'])) == 1
@@ -0,0 +1,24 @@
+import numpy as np
+
+from get_size_and_depth_from_tree import analyze_treefile
+from tree_cache import convert_tree
+
+def test_size_depth_paths_agree(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    fname = fnames[1]
+    expected = analyze_treefile(fname)
+    cache_dir = str(tmpdir)
+    convert_tree(fname, cache_dir)
+    for results in [analyze_treefile(fname, processes=2), analyze_treefile(fname, cache_dir=cache_dir)]:
+        node_size_depth, size_counts, depth_counts = results
+        for name in ['pid', 'cl_size', 'cl_depth']:
+            np.testing.assert_array_equal(node_size_depth[name], expected[0][name])
+        assert size_counts == expected[1]
+        assert depth_counts == expected[2]
+
+def test_size_depth_counts(workload):
+    pubyear_fname, fnames = workload
+    node_size_depth, size_counts, depth_counts = analyze_treefile(fnames[1])
+    # every node's cluster size, counted once per cluster, adds up to the number of nodes
+    assert sum(size * count for size, count in size_counts.items()) == len(node_size_depth['pid'])
+    assert sum(size_counts.values()) == sum(depth_counts.values())
@@ -0,0 +1,64 @@
+import os
+from argparse import Namespace
+
+import numpy as np
+
+from pubyear_index import get_pubyear_index
+from get_means_from_tree import analyze_tree
+from get_size_and_depth_from_tree import analyze_treefile
+from helpers import assert_same_csv, run_standalone
+import tree_analyzer
+from tree_analyzer import YearMeansAccumulator, SizeDepthAccumulator, analyze_tree_once
+
+def test_size_depth_matches_analyze_treefile(workload):
+    pubyear_fname, fnames = workload
+    accumulator, = analyze_tree_once(fnames[0], [SizeDepthAccumulator()])
+    outputs = accumulator.outputs()
+    node_size_depth, size_counts, depth_counts = analyze_treefile(fnames[0])
+    for name in ['pid', 'cl_size', 'cl_depth']:
+        np.testing.assert_array_equal(outputs['node_size_depth'][name], node_size_depth[name])
+    assert outputs['size_counts'] == size_counts
+    assert outputs['depth_counts'] == depth_counts
+
+def test_size_depth_keeps_repeated_pids(tmpdir):
+    # a paper can be in more than one module. every node gets its own row, as in analyze_treefile
+    fname = str(tmpdir.join('repeated.tree'))
+    with open(fname, 'w') as outf:
+        outf.write('# path flow name node_id\n1:1 0.25 "7" 1\n1:2 0.25 "8" 2\n2:1:1 0.25 "7" 3\n2:1:2 0.25 "9" 4\n3 0.0 "10" 5\n')
+    accumulator, = analyze_tree_once(fname, [SizeDepthAccumulator()])
+    outputs = accumulator.outputs()
+    node_size_depth, size_counts, depth_counts = analyze_treefile(fname)
+    assert outputs['node_size_depth']['pid'].tolist() == [7, 8, 7, 9, 10]
+    for name in ['pid', 'cl_size', 'cl_depth']:
+        np.testing.assert_array_equal(outputs['node_size_depth'][name], node_size_depth[name])
+    assert outputs['size_counts'] == size_counts
+    assert outputs['depth_counts'] == depth_counts
+
+def test_year_means_match_analyze_tree(workload):
+    pubyear_fname, fnames = workload
+    pubyear = get_pubyear_index(pubyear_fname, save=False)
+    accumulator, = analyze_tree_once(fnames[0], [YearMeansAccumulator(pubyear)])
+    num_nodes, rank_total, depth_counts, size_total = accumulator.totals.results()
+    expected = analyze_tree(fnames[0], pubyear)
+    assert num_nodes == expected[0]
+    assert set(rank_total) == set(expected[1])
+    for year in rank_total:
+        assert np.isclose(rank_total[year], expected[1][year], rtol=1e-12)
+    assert depth_counts == expected[2]
+    assert size_total == expected[3]
+
+def test_written_outputs_match_standalone(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    outdir = str(tmpdir.join('once'))
+    for name in ['rank_mean', 'size_mean', 'depth_mean']:
+        os.makedirs(os.path.join(outdir, name))
+    tree_analyzer.main(Namespace(tree_fname=fnames[0], pubyears_fname=pubyear_fname, outdir=outdir, label='1',
+        skip_size_depth=False, cache_dir=None, node_size_depth_format='csv', run_report=False, profile=None))
+    expected_dir = str(tmpdir.join('standalone'))
+    run_standalone(pubyear_fname, fnames[0], expected_dir, '1')
+    for name in ['rank_mean', 'size_mean', 'depth_mean']:
+        assert_same_csv(os.path.join(outdir, name, "1-{}.csv".format(name)), os.path.join(expected_dir, name, "1-{}.csv".format(name)))
+    for name in ['size_counts', 'depth_counts']:
+        assert_same_csv(os.path.join(outdir, "1-{}.csv".format(name)), os.path.join(expected_dir, "1-{}.csv".format(name)))
+    with open(os.path.join(outdir, "1-node_size_depth.csv")) as f, open(os.path.join(expected_dir, "1-node_size_depth.csv")) as expected:
+        assert f.read() == expected.read()
@@ -0,0 +1,36 @@
+import numpy as np
+
+from tree_reader import parse_tree_lines
+from tree_cache import parse_tree_columns, convert_tree, cache_is_fresh, load_fresh_cache, load_tree_columns
+from helpers import get_rows
+
+def test_columns_match_per_line_parse(workload):
+    pubyear_fname, fnames = workload
+    columns = parse_tree_columns(fnames[0])
+    assert get_rows(columns) == parse_tree_lines(fnames[0])
+
+def test_cache_round_trip(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    cache_dir = str(tmpdir)
+    assert load_fresh_cache(fnames[0], cache_dir) is None
+    convert_tree(fnames[0], cache_dir)
+    assert cache_is_fresh(fnames[0], cache_dir)
+    cached = load_fresh_cache(fnames[0], cache_dir)
+    parsed = parse_tree_columns(fnames[0])
+    assert sorted(cached) == sorted(parsed)
+    for name in parsed:
+        np.testing.assert_array_equal(cached[name], parsed[name])
+        assert cached[name].dtype == parsed[name].dtype
+
+def test_cache_stale_after_change(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    fname = str(tmpdir.join('copy.tree'))
+    with open(fnames[0], 'rb') as f, open(fname, 'wb') as outf:
+        outf.write(f.read())
+    cache_dir = str(tmpdir.join('cache'))
+    load_tree_columns(fname, cache_dir, build_cache=True)
+    assert cache_is_fresh(fname, cache_dir)
+    with open(fname, 'ab') as outf:
+        outf.write(b'9:1 0.5 "999999" 999999\n')
+    assert not cache_is_fresh(fname, cache_dir)
+    assert load_tree_columns(fname, cache_dir)['pid'][-1] == 999999
@@ -0,0 +1,86 @@
+import gzip, subprocess
+
+import numpy as np
+import pytest
+
+import tree_reader
+
+from tree_reader import split_block, read_tree_chunks, parse_tree_lines, parse_flows, parse_names, get_byte_ranges
+
+def read_rows(fname, **kwargs):
+    rows = []
+    for chunk in read_tree_chunks(fname, **kwargs):
+        modules = [module.decode() for module in chunk['module']]
+        rows.extend(zip(chunk['pid'].tolist(), chunk['flow'].tolist(), chunk['depth'].tolist(), modules))
+    return rows
+
+def test_chunks_match_per_line_parse(workload):
+    pubyear_fname, fnames = workload
+    expected = parse_tree_lines(fnames[0])
+    # small blocks, so lines are split across block boundaries
+    assert read_rows(fnames[0], blocksize=4096) == expected
+    assert read_rows(fnames[0], readahead=False) == expected
+
+def test_byte_ranges_cover_the_file(workload):
+    pubyear_fname, fnames = workload
+    rows = []
+    for start, end in get_byte_ranges(fnames[0], 5):
+        rows.extend(read_rows(fnames[0], start=start, end=end, blocksize=4096))
+    assert rows == parse_tree_lines(fnames[0])
+
+def test_gzip(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    fname = str(tmpdir.join('synthetic.tree.gz'))
+    with open(fnames[0], 'rb') as f, gzip.open(fname, 'wb') as outf:
+        outf.write(f.read())
+    assert read_rows(fname, blocksize=4096) == parse_tree_lines(fnames[0])
+
+def test_zstd_command(workload, tmpdir, monkeypatch):
+    pubyear_fname, fnames = workload
+    monkeypatch.setattr(tree_reader, 'zstandard', None)
+    fname = tree_reader.compress_tree(fnames[0], str(tmpdir), 'zstd')
+    if fname is None:
+        pytest.skip("zstd command not available")
+    assert read_rows(fname, blocksize=4096) == parse_tree_lines(fnames[0])
+    # stopping early doesn't leave the process behind
+    f = tree_reader.open_tree(fname)
+    assert f.read(100)
+    f.close()
+    assert f.proc.returncode is not None
+    # a truncated file fails instead of looking like a shorter tree
+    with open(fname, 'rb') as f:
+        data = f.read()
+    truncated = str(tmpdir.join('truncated.tree.zst'))
+    with open(truncated, 'wb') as outf:
+        outf.write(data[:len(data) // 2])
+    with pytest.raises(subprocess.CalledProcessError):
+        read_rows(truncated, blocksize=4096)
+
+def test_parse_fields():
+    np.testing.assert_array_equal(parse_flows([b'0.5', b'1e-05', b'2']), [0.5, 1e-05, 2.0])
+    np.testing.assert_array_equal(parse_names([b'"7"', b'"12"']), [7, 12])
+
+def test_malformed_fields_raise():
+    with pytest.raises(ValueError):
+        parse_flows([b'0.5', b'0.1x'])
+    with pytest.raises(ValueError):
+        parse_names([b'"7"', b'"12x"'])
+    # a name with a space would shift every value after it
+    with pytest.raises(ValueError):
+        parse_names([b'"7 8"', b'"12"'])
+
+def test_mixed_field_counts_are_not_shifted(tmpdir):
+    # as many tokens as 4-field lines, but a 3-field line then a 5-field line
+    block = b'1:1 0.5 "7" 1\n1:2 0.25 "8"\n1:3 0.25 "9" 3 extra\n2:1 0.0 "10" 4'
+    paths, flows, names, num_fields = split_block(block)
+    assert paths == [b'1:1', b'1:2', b'1:3', b'2:1']
+    assert flows == [b'0.5', b'0.25', b'0.25', b'0.0']
+    assert names == [b'"7"', b'"8"', b'"9"', b'"10"']
+    fname = str(tmpdir.join('mixed.tree'))
+    with open(fname, 'wb') as outf:
+        outf.write(b'# path flow name node_id\n' + block + b'\n')
+    assert read_rows(fname) == [(7, 0.5, 2, '1'), (8, 0.25, 2, '1'), (9, 0.25, 2, '1'), (10, 0.0, 2, '2')]
+
+def test_too_few_fields_raise():
+    with pytest.raises(ValueError):
+        split_block(b'1:1 0.5 "7" 1\n1:2 0.25\n1:3 0.25 "9" 3 extra')
@@ -0,0 +1,32 @@
+import numpy as np
+
+from pubyear_index import get_pubyear_index
+from get_means_from_tree import get_pubyear, analyze_tree, analyze_tree_vectorized
+from tree_cache import convert_tree
+
+def drop_unknown(results):
+    """analyze_tree with the pubyear dict keeps the year 'unknown' as a year. the PubyearIndex skips those papers"""
+    return [dict((year, value) for year, value in d.items() if year != 'unknown') for d in results]
+
+def assert_same_means(results, expected):
+    num_nodes, rank_total, depth_counts, size_total = results
+    assert num_nodes == expected[0]
+    assert set(rank_total) == set(expected[1])
+    for year in rank_total:
+        assert np.isclose(rank_total[year], expected[1][year], rtol=1e-12)
+    assert depth_counts == expected[2]
+    assert size_total == expected[3]
+
+def test_means_match_baseline(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    fname = fnames[1]
+    # the original parse: pubyear dict, tree text
+    expected = drop_unknown(analyze_tree(fname, get_pubyear(pubyear_fname)))
+    pubyear = get_pubyear_index(pubyear_fname, save=False)
+    assert_same_means(analyze_tree(fname, pubyear), expected)
+    assert_same_means(analyze_tree_vectorized(fname, pubyear, blocksize=8192), expected)
+    assert_same_means(analyze_tree_vectorized(fname, pubyear, processes=2), expected)
+    cache_dir = str(tmpdir)
+    convert_tree(fname, cache_dir)
+    assert_same_means(analyze_tree(fname, pubyear, cache_dir=cache_dir), expected)
+    assert_same_means(analyze_tree_vectorized(fname, pubyear, cache_dir=cache_dir, chunksize=1000), expected)
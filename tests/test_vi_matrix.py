@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from vi_compare import get_vi_from_fnames, get_vi_matrix
+
+def test_matrix_matches_pairs(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    # a tree without some of the papers of the others
+    fname = str(tmpdir.join('fewer.tree'))
+    with open(fnames[1], 'rb') as f, open(fname, 'wb') as outf:
+        outf.writelines(f.readlines()[:-200])
+    fnames = fnames + [fname]
+    expected = np.array([[get_vi_from_fnames(a, b) if a != b else 0.0 for b in fnames] for a in fnames])
+    for max_resident in [None, 2]:
+        vi_matrix = get_vi_matrix(fnames, max_resident=max_resident, scratch_dir=str(tmpdir))
+        np.testing.assert_allclose(vi_matrix, expected, atol=1e-12)
+    with pytest.raises(ValueError):
+        get_vi_matrix(fnames, strict=True)
@@ -0,0 +1,80 @@
+import multiprocessing
+
+import numpy as np
+
+from get_vi_parallel import init_worker
+from vi_compare import get_vi_from_fnames
+from vi_search import PivotSearch
+from vi_store import VIStore
+
+class PointSearch(PivotSearch):
+    """PivotSearch over points in the plane, with Euclidean distance (a metric, like VI) instead of VI"""
+    def __init__(self, points, batch_size=8):
+        PivotSearch.__init__(self, [str(i) for i in range(len(points))], None, batch_size=batch_size)
+        self.points = points
+
+    def get_vi(self, pairs):
+        todo = set((min(i, j), max(i, j)) for i, j in pairs if i != j and j not in self.known[i])
+        for i, j in todo:
+            self.set_vi(i, j, float(np.linalg.norm(self.points[i] - self.points[j])))
+        self.num_computed += len(todo)
+        return [self.known[i][j] if i != j else 0.0 for i, j in pairs]
+
+def get_points(n, seed):
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(0, 100, size=(5, 2))
+    return centers[rng.randint(5, size=n)] + rng.normal(0, 3, size=(n, 2))
+
+def get_distances(points):
+    return np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+
+def test_medoid_matches_brute_force():
+    for seed in range(5):
+        points = get_points(200, seed)
+        totals = get_distances(points).sum(axis=1)
+        search = PointSearch(points)
+        medoid, total = search.find_medoid(list(range(len(points))), num_pivots=4, seed=seed)
+        assert np.isclose(total, totals.min())
+        assert np.isclose(totals[medoid], totals.min())
+        # the bounds rule out most of the pairs
+        assert search.num_computed < len(points) * (len(points) - 1) // 2
+
+def test_medoid_of_subset():
+    points = get_points(100, 7)
+    members = list(range(10, 60, 2))
+    totals = get_distances(points[members]).sum(axis=1)
+    medoid, total = PointSearch(points).find_medoid(members, num_pivots=3, seed=0)
+    assert medoid in members
+    assert np.isclose(total, totals.min())
+
+def test_nearest_matches_brute_force():
+    points = get_points(300, 3)
+    distances = get_distances(points)
+    search = PointSearch(points)
+    runs = np.arange(len(points))
+    pivots, pivot_vi = search.choose_pivots(runs, 4, seed=0)
+    for query in [0, 17, 299]:
+        nearest = search.find_nearest(query, runs, pivots, pivot_vi, 5)
+        expected = np.sort(np.delete(distances[query], query))[:5]
+        np.testing.assert_allclose([vi for vi, y in nearest], expected)
+        for vi, y in nearest:
+            assert np.isclose(distances[query, y], vi)
+
+def test_tree_files_and_store(workload, tmpdir):
+    pubyear_fname, fnames = workload
+    vi = np.array([[get_vi_from_fnames(a, b) for b in fnames] for a in fnames])
+    pool = multiprocessing.Pool(2, initializer=init_worker, initargs=(None, 4))
+    try:
+        store = VIStore(str(tmpdir.join('vi.sqlite')))
+        search = PivotSearch(fnames, pool, store=store)
+        medoid, total = search.find_medoid(list(range(len(fnames))), num_pivots=1, seed=0)
+        assert np.isclose(total, vi.sum(axis=1).min())
+        # a second search finds every VI it needs in the store
+        search = PivotSearch(fnames, pool, store=store)
+        assert search.find_medoid(list(range(len(fnames))), num_pivots=1, seed=0) == (medoid, total)
+        assert search.num_computed == 0
+        assert search.num_from_store > 0
+        store.close()
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,172 @@
+import sys, os, time
+from datetime import datetime
+
+import numpy as np
+
+from tree_cache import load_fresh_cache
+from tree_reader import read_tree_chunks
+from cluster_index import ClusterIndex
+from pubyear_index import get_pubyear_index
+import get_means_from_tree
+import get_size_and_depth_from_tree
+import profiling
+from profiling import stage
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Accumulator(object):
+    """Per-file metric computed in the single pass of analyze_tree_once
+
+    Subclasses implement update, which is called with each chunk of nodes in the tree, and outputs,
+    which returns {output name: data} after the last chunk. write saves the outputs to disk.
+
+    """
+    def update(self, chunk):
+        """
+        :chunk: dict of aligned arrays for a chunk of nodes:
+                pid: paper IDs (int64),
+                flow: flows of the nodes (float64),
+                depth: number of levels in each node's tree path,
+                module: cluster ID of each node's module: the path without its last level (see cluster_index.py)
+        """
+        raise NotImplementedError
+
+    def outputs(self):
+        raise NotImplementedError
+
+    def write(self, outdir, label, outputs=None):
+        """
+        :outputs: the result of outputs(), if the caller already has it
+        """
+        raise NotImplementedError
+
+class YearMeansAccumulator(Accumulator):
+    """Mean rank, cluster size and depth per publication year (the outputs of get_means_from_tree.py)"""
+    def __init__(self, pubyear):
+        """
+        :pubyear: PubyearIndex (see pubyear_index.py)
+        """
+        self.pubyear = pubyear
+        self.totals = get_means_from_tree.YearBincounts()
+
+    def update(self, chunk):
+        self.totals.update(self.pubyear.lookup(chunk['pid']), chunk['flow'], chunk['depth'], chunk['module'])
+
+    def outputs(self):
+        num_nodes, rank_total, depth_counts, size_total = self.totals.results()
+        return {
+                'rank_mean': get_means_from_tree.get_rank_mean(rank_total, num_nodes),
+                'size_mean': get_means_from_tree.get_size_mean(size_total),
+                'depth_mean': get_means_from_tree.get_depth_mean(depth_counts),
+                }
+
+    def write(self, outdir, label, outputs=None):
+        for name, d in (outputs or self.outputs()).items():
+            get_means_from_tree.output_csv(d, dirname=os.path.join(outdir, name), fname="{}-{}".format(label, name))
+
+class SizeDepthAccumulator(Accumulator):
+    """Per-node cluster size and depth, and counts of cluster sizes and depths (the outputs of get_size_and_depth_from_tree.py)
+
+    Keeps one row per node, in file order, the same as get_size_and_depth_from_tree.analyze_treefile
+
+    """
+    def __init__(self, node_size_depth_format='csv'):
+        self.node_size_depth_format = node_size_depth_format
+        self.columns = {'pid': [], 'module': [], 'depth': []}
+
+    def update(self, chunk):
+        for name in self.columns:
+            self.columns[name].append(np.asarray(chunk[name]))
+
+    def outputs(self):
+        columns = dict((name, np.concatenate(arrays) if arrays else np.array([], dtype=np.int64)) for name, arrays in self.columns.items())
+        node_size_depth, size_counts, depth_counts = get_size_and_depth_from_tree.analyze_treefile_columns(columns)
+        return {
+                'node_size_depth': node_size_depth,
+                'size_counts': size_counts,
+                'depth_counts': depth_counts,
+                }
+
+    def write(self, outdir, label, outputs=None):
+        outputs = outputs or self.outputs()
+        get_size_and_depth_from_tree.output_node_size_depth(outputs['node_size_depth'], outdir, label, fmt=self.node_size_depth_format)
+        get_size_and_depth_from_tree.output_size_counts(outputs['size_counts'], outdir, label)
+        get_size_and_depth_from_tree.output_depth_counts(outputs['depth_counts'], outdir, label)
+
+def iter_tree_chunks(fname, cache_dir=None, chunksize=1000000):
+    """Read the nodes of a tree file once, a chunk at a time
+
+    :chunksize: number of nodes taken at a time from a tree cache (chunks of the text follow read_tree_chunks' blocks)
+    :yields: dict of arrays. see Accumulator.update
+
+    """
+    columns = load_fresh_cache(fname, cache_dir)
+    if columns is not None:
+        logger.debug("Using tree cache for {}".format(fname))
+        for i in range(0, len(columns['pid']), chunksize):
+            yield dict((name, np.asarray(columns[name][i:i+chunksize])) for name in ['pid', 'flow', 'depth', 'module'])
+        return
+    index = ClusterIndex()
+    for chunk in read_tree_chunks(fname):
+        yield {'pid': chunk['pid'], 'flow': chunk['flow'], 'depth': chunk['depth'], 'module': index.add_modules(chunk['module'])}
+
+def analyze_tree_once(fname, accumulators, cache_dir=None):
+    """Feed every chunk of nodes of a tree file to all of the accumulators in a single read of the file
+
+    :fname: filename of the tree file
+    :accumulators: list of Accumulator
+    :cache_dir: base directory for tree caches
+    :returns: accumulators
+
+    """
+    logger.debug("Analyzing tree file...")
+    num_nodes = 0
+    # parsing happens while iterating, in its own stages, so only the updates are counted here
+    for chunk in iter_tree_chunks(fname, cache_dir):
+        with stage('aggregate') as stats:
+            for accumulator in accumulators:
+                accumulator.update(chunk)
+            stats.add(nodes=len(chunk['pid']))
+        num_nodes += len(chunk['pid'])
+    logger.debug("Total number of nodes: {}.\n".format(num_nodes))
+    return accumulators
+
+def main(args):
+    profiling.start_from_args('tree_analyzer', args)
+    accumulators = []
+    if args.pubyears_fname:
+        accumulators.append(YearMeansAccumulator(get_pubyear_index(args.pubyears_fname)))
+    if not args.skip_size_depth:
+        accumulators.append(SizeDepthAccumulator(args.node_size_depth_format))
+    analyze_tree_once(args.tree_fname, accumulators, cache_dir=args.cache_dir)
+    for accumulator in accumulators:
+        accumulator.write(args.outdir, args.label)
+    profiling.finish_run(profiling.get_report_fname(args.outdir, args.label))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="From a .tree file, get the outputs of both get_means_from_tree.py and get_size_and_depth_from_tree.py with a single read of the file")
+    parser.add_argument("tree_fname", type=str, help="input filename (.tree file)")
+    parser.add_argument("--pubyears-fname", type=str, help="(comma-separated) file mapping paper id to publication year. needed for the rank, size, and depth means")
+    parser.add_argument("-o", "--outdir", type=str, help="base directory for the output. the size and depth counts go here, and the means go in its directories 'rank_mean', 'size_mean', and 'depth_mean'", default=os.path.dirname(__file__))
+    parser.add_argument("--label", type=str, help="label for the output files (see get_means_from_tree.py and get_size_and_depth_from_tree.py)")
+    parser.add_argument("--skip-size-depth", action='store_true', help="don't compute the per-node size and depth outputs")
+    parser.add_argument("--cache-dir", type=str, help="base directory for tree caches made by tree_cache.py (default: next to the tree file)")
+    parser.add_argument("--node-size-depth-format", choices=get_size_and_depth_from_tree.NODE_SIZE_DEPTH_FORMATS, default='csv', help="format of the per-node size and depth output")
+    profiling.add_arguments(parser)
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
@@ -0,0 +1,216 @@
+import sys, os, time, json, shutil
+from datetime import datetime
+
+import numpy as np
+
+from tree_reader import read_tree_chunks
+from cluster_index import ClusterIndex
+from profiling import stage
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+CACHE_SUFFIX = '.cache'
+COLUMNS = ['pid', 'flow', 'depth', 'module', 'levels', 'cluster_parent', 'cluster_component']
+
+def get_cache_dir(tree_fname, cache_dir=None):
+    """Get the directory holding the columnar cache for a tree file
+
+    :tree_fname: filename of the tree file
+    :cache_dir: base directory for caches. if None, the cache sits next to the tree file
+    :returns: directory name (str)
+
+    """
+    if cache_dir is None:
+        return tree_fname + CACHE_SUFFIX
+    # tree files are usually all named jstor.tree, so key the cache on the full path
+    key = os.path.abspath(tree_fname).strip(os.sep).replace(os.sep, '__')
+    return os.path.join(cache_dir, key + CACHE_SUFFIX)
+
+def get_source_stat(tree_fname):
+    st = os.stat(tree_fname)
+    return {'size': st.st_size, 'mtime': st.st_mtime}
+
+def parse_tree_columns(fname):
+    """Parse a tree file into columns
+
+    :fname: filename of the tree file
+    :returns: dict of numpy arrays: {
+                pid: int64 paper ID per node,
+                flow: float64 flow (rank) per node,
+                depth: int8 number of levels in the node's path,
+                module: int32 cluster ID of the module the node belongs to (path without the last level),
+                levels: int32 array of shape (max_depth - 1, num_nodes). row l is the cluster ID of the
+                        node's path prefix of length l + 1, or -1 if the path is not that deep,
+                cluster_parent: int32 parent of each cluster ID (see cluster_index.ClusterIndex),
+                cluster_component: int32 last path component of each cluster ID
+                }
+
+    """
+    logger.debug("Parsing tree file into columns...")
+    # the blocks are parsed in read_tree_chunks' own (nested) stages; this counts joining them into columns
+    with stage('tree_parse'):
+        index = ClusterIndex()
+        pids = []
+        flows = []
+        depths = []
+        modules = []
+        for chunk in read_tree_chunks(fname):
+            pids.append(chunk['pid'])
+            flows.append(chunk['flow'])
+            depths.append(chunk['depth'])
+            modules.append(index.add_modules(chunk['module']))
+        pids = np.concatenate(pids) if pids else np.array([], dtype=np.int64)
+        flows = np.concatenate(flows) if flows else np.array([], dtype=np.float64)
+        depths = np.concatenate(depths) if depths else np.array([], dtype=np.int8)
+        modules = np.concatenate(modules) if modules else np.array([], dtype=np.int32)
+
+        clusters = index.arrays()
+        if len(index) > 1:
+            levels = index.ancestor_table()[:, modules]
+            # ancestor_table gives a shallow module itself at the deeper levels
+            levels[np.arange(len(levels))[:, np.newaxis] >= clusters['depth'][modules]] = -1
+        else:
+            levels = np.zeros((0, len(modules)), dtype=np.int32)
+
+        columns = {
+                'pid': pids.astype(np.int64),
+                'flow': flows.astype(np.float64),
+                'depth': depths.astype(np.int8),
+                'module': modules,
+                'levels': levels,
+                'cluster_parent': clusters['parent'],
+                'cluster_component': clusters['component'],
+                }
+    logger.debug("Total number of nodes: {}. Number of clusters: {}.".format(len(pids), len(index)))
+    return columns
+
+def convert_tree(tree_fname, cache_dir=None):
+    """Convert a tree file into its columnar cache (one .npy file per column plus meta.json)
+
+    :tree_fname: filename of the tree file
+    :cache_dir: base directory for caches (see get_cache_dir)
+    :returns: cache directory name
+
+    """
+    outdir = get_cache_dir(tree_fname, cache_dir)
+    source = get_source_stat(tree_fname)
+    columns = parse_tree_columns(tree_fname)
+
+    # write to a temporary directory and move it into place, so a half-written cache is never loaded
+    tmpdir = "{}.tmp{}".format(outdir, os.getpid())
+    if os.path.exists(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    for name in COLUMNS:
+        np.save(os.path.join(tmpdir, "{}.npy".format(name)), columns[name])
+    meta = {
+            'version': CACHE_VERSION,
+            'source': os.path.abspath(tree_fname),
+            'size': source['size'],
+            'mtime': source['mtime'],
+            'num_nodes': len(columns['pid']),
+            'num_clusters': len(columns['cluster_parent']),
+            }
+    with open(os.path.join(tmpdir, 'meta.json'), 'w') as outf:
+        json.dump(meta, outf)
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+    os.rename(tmpdir, outdir)
+    logger.debug("Wrote tree cache: {}".format(outdir))
+    return outdir
+
+def cache_is_fresh(tree_fname, cache_dir=None):
+    """Check that a cache exists for the tree file and was built from its current version
+
+    :tree_fname: filename of the tree file
+    :cache_dir: base directory for caches (see get_cache_dir)
+    :returns: bool
+
+    """
+    meta_fname = os.path.join(get_cache_dir(tree_fname, cache_dir), 'meta.json')
+    if not os.path.exists(meta_fname):
+        return False
+    with open(meta_fname, 'r') as f:
+        meta = json.load(f)
+    source = get_source_stat(tree_fname)
+    return (meta.get('version') == CACHE_VERSION
+            and meta['size'] == source['size']
+            and meta['mtime'] == source['mtime'])
+
+def load_tree_cache(tree_fname, cache_dir=None, mmap_mode='r'):
+    """Load the columnar cache for a tree file. Arrays are memory mapped by default
+
+    :tree_fname: filename of the tree file
+    :cache_dir: base directory for caches (see get_cache_dir)
+    :mmap_mode: passed to numpy.load
+    :returns: dict of numpy arrays (see parse_tree_columns)
+
+    """
+    dirname = get_cache_dir(tree_fname, cache_dir)
+    logger.debug("Loading tree cache: {}".format(dirname))
+    columns = {}
+    with stage('cache_load') as stats:
+        for name in COLUMNS:
+            columns[name] = np.load(os.path.join(dirname, "{}.npy".format(name)), mmap_mode=mmap_mode)
+        stats.add(nodes=len(columns['pid']))
+    return columns
+
+def load_fresh_cache(tree_fname, cache_dir=None):
+    """Load the cache for a tree file if it is present and fresh
+
+    :returns: dict of numpy arrays, or None if there is no usable cache
+
+    """
+    if cache_is_fresh(tree_fname, cache_dir):
+        return load_tree_cache(tree_fname, cache_dir)
+    return None
+
+def load_tree_columns(tree_fname, cache_dir=None, build_cache=False):
+    """Get the columns for a tree file, from the cache when possible
+
+    :tree_fname: filename of the tree file
+    :cache_dir: base directory for caches (see get_cache_dir)
+    :build_cache: if there is no fresh cache, write one after parsing
+    :returns: dict of numpy arrays (see parse_tree_columns)
+
+    """
+    columns = load_fresh_cache(tree_fname, cache_dir)
+    if columns is not None:
+        return columns
+    if build_cache:
+        convert_tree(tree_fname, cache_dir)
+        return load_tree_cache(tree_fname, cache_dir)
+    return parse_tree_columns(tree_fname)
+
+def main(args):
+    for tree_fname in args.tree_fnames:
+        if not args.force and cache_is_fresh(tree_fname, args.cache_dir):
+            logger.debug("Cache is fresh. Skipping: {}".format(tree_fname))
+            continue
+        start = time.time()
+        outdir = convert_tree(tree_fname, args.cache_dir)
+        logger.info("Converted {} -> {} in {:.2f} seconds".format(tree_fname, outdir, time.time()-start))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert .tree files into a binary columnar cache that the analysis scripts load (memory mapped) instead of parsing the text")
+    parser.add_argument("tree_fnames", nargs='+', help="input filenames (.tree files)")
+    parser.add_argument("--cache-dir", help="base directory for the caches (default: '<tree_fname>.cache' next to each tree file)")
+    parser.add_argument("--force", action='store_true', help="rebuild caches even if they are fresh")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))
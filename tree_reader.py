@@ -0,0 +1,428 @@
+import sys, os, time, gzip, fnmatch, subprocess, threading, tempfile, shutil
+from datetime import datetime
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from profiling import stage
+
+import logging
+logging.basicConfig(format='%(asctime)s %(name)s.%(lineno)d %(levelname)s : %(message)s',
+        datefmt="%H:%M:%S",
+        level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BLOCKSIZE = 16 * 1024 * 1024
+# number of blocks the readahead thread reads ahead of the parser
+READAHEAD_BLOCKS = 2
+
+# tree files may be stored compressed
+TREE_PATTERNS = ['*.tree', '*.tree.gz', '*.tree.zst']
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def is_tree_fname(fname):
+    return any(fnmatch.fnmatch(fname, pattern) for pattern in TREE_PATTERNS)
+
+def get_compression(fname):
+    """'gzip', 'zstd' or None, from the first bytes of the file"""
+    with open(fname, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+class ZstdProcessReader(object):
+    """Decompressed output of a `zstd -dc` process, for when the zstandard module is not installed
+
+    close() closes the pipe and waits for the process. If the process failed (e.g. the file is truncated)
+    after all of its output was read, close() raises CalledProcessError, so the missing lines are not
+    taken for the end of the tree.
+
+    """
+    def __init__(self, fname):
+        self.args = ['zstd', '-dcq', fname]
+        self.proc = subprocess.Popen(self.args, stdout=subprocess.PIPE, bufsize=BLOCKSIZE)
+        self.eof = False
+
+    def read(self, size=-1):
+        data = self.proc.stdout.read(size)
+        if not data and size != 0:
+            self.eof = True
+        return data
+
+    def close(self):
+        if self.proc.returncode is not None:
+            return
+        try:
+            # if the output was not read to the end, zstd exits on the closed pipe
+            self.proc.stdout.close()
+        finally:
+            self.proc.wait()
+        if self.eof and self.proc.returncode != 0:
+            raise subprocess.CalledProcessError(self.proc.returncode, self.args)
+
+def open_tree(fname):
+    """Open a tree file for reading bytes, decompressing it if it is gzip or zstd compressed
+
+    zstd files are read with the zstandard module if it is installed, otherwise through the zstd command
+
+    """
+    compression = get_compression(fname)
+    if compression == 'gzip':
+        return gzip.open(fname, 'rb')
+    if compression == 'zstd':
+        if zstandard is not None:
+            return zstandard.ZstdDecompressor().stream_reader(open(fname, 'rb'))
+        return ZstdProcessReader(fname)
+    return open(fname, 'rb')
+
+def iter_range(f, blocksize, remaining=None):
+    """Read blocks from a file object, stopping after remaining bytes (if not None)"""
+    while True:
+        size = blocksize if remaining is None else min(blocksize, remaining)
+        block = f.read(size) if size > 0 else b''
+        if not block:
+            break
+        if remaining is not None:
+            remaining -= len(block)
+        yield block
+
+def read_ahead(blocks, num_blocks=READAHEAD_BLOCKS):
+    """Run an iterator of blocks (e.g. iter_range) on a background thread, so reading and
+    decompressing overlap with whatever the caller does with the blocks
+
+    :yields: the blocks, in order
+
+    """
+    queued = queue.Queue(maxsize=num_blocks)
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for block in blocks:
+                if stop.is_set():
+                    return
+                queued.put(block)
+            queued.put(None)
+        except Exception as e:
+            queued.put(e)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            block = queued.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        stop.set()
+        # unblock the reader if it is waiting on a full queue
+        while thread.is_alive():
+            try:
+                queued.get(timeout=.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+def iter_blocks(fname, blocksize=BLOCKSIZE, start=0, end=None, readahead=True):
+    """Read a file in large blocks that end on a line boundary
+
+    :start: byte offset to start at. should be the start of a line (see get_byte_ranges)
+    :end: byte offset to stop at (default: end of file). should be the start of a line
+    :readahead: read on a background thread (see read_ahead)
+    :yields: bytes, each holding whole lines
+
+    """
+    f = open_tree(fname)
+    raw_blocks = None
+    try:
+        remaining = None
+        if start or end is not None:
+            # byte ranges are only made for uncompressed files (see get_byte_ranges)
+            f.seek(start)
+            if end is not None:
+                remaining = end - start
+        raw_blocks = iter_range(f, blocksize, remaining)
+        if readahead:
+            raw_blocks = read_ahead(raw_blocks)
+        remainder = b''
+        for block in raw_blocks:
+            block = remainder + block
+            end_of_lines = block.rfind(b'\n')
+            if end_of_lines == -1:
+                remainder = block
+                continue
+            remainder = block[end_of_lines+1:]
+            yield block[:end_of_lines+1]
+        if remainder:
+            yield remainder
+    finally:
+        if raw_blocks is not None:
+            raw_blocks.close()
+        f.close()
+
+def get_byte_ranges(fname, num_ranges):
+    """Split a file into about equal byte ranges that start and end on line boundaries
+
+    :returns: list of (start, end) byte offsets, covering the whole file. a compressed file
+              can't be split, so it is one range, (0, None)
+
+    """
+    size = os.path.getsize(fname)
+    if get_compression(fname) is not None:
+        return [(0, None)]
+    offsets = [0]
+    with open(fname, 'rb') as f:
+        for i in range(1, num_ranges):
+            f.seek(size * i // num_ranges)
+            # move to the start of the next line
+            f.readline()
+            offset = f.tell()
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+# token put at the end of every line before splitting a block, so the layout of the lines can be checked
+# on the token list. NUL is not whitespace, so bytes.split() keeps it as a token of its own
+LINE_END = b'\x00'
+
+def split_block(block, num_fields=None):
+    """Split a block of tree lines into columns of byte strings
+
+    When every line has the same number of fields, the whole block is split with a single
+    call and the columns are taken by striding, so there is no per-line work in Python.
+
+    :block: bytes holding whole lines
+    :num_fields: number of fields per line, if known
+    :returns: (paths, flows, names, num_fields): lists of bytes for the first three fields
+
+    """
+    # header lines are at the start of the file, so drop those without splitting the block
+    while block.startswith(b'#'):
+        end = block.find(b'\n')
+        block = block[end+1:] if end != -1 else b''
+    if b'\n#' in block:
+        block = b'\n'.join(line for line in block.split(b'\n') if not line.startswith(b'#'))
+    block = block.strip()
+    if not block:
+        return [], [], [], num_fields
+    if num_fields is None:
+        first_line = block.split(b'\n', 1)[0]
+        num_fields = len(first_line.split())
+    num_lines = block.count(b'\n') + 1
+    tokens = block.replace(b'\n', b' ' + LINE_END + b' ').split()
+    # every line has num_fields fields if and only if every line end is right after them
+    stride = num_fields + 1
+    if (len(tokens) == stride * num_lines - 1
+            and tokens[num_fields::stride].count(LINE_END) == num_lines - 1
+            and tokens.count(LINE_END) == num_lines - 1):
+        return tokens[0::stride], tokens[1::stride], tokens[2::stride], num_fields
+    # lines with different numbers of fields. fall back to splitting each line
+    paths = []
+    flows = []
+    names = []
+    for line in block.split(b'\n'):
+        line = line.split()
+        if len(line) < 3:
+            raise ValueError("tree line with {} fields: {!r}".format(len(line), b' '.join(line)))
+        paths.append(line[0])
+        flows.append(line[1])
+        names.append(line[2])
+    return paths, flows, names, num_fields
+
+def parse_fields(fields, dtype, num_lines):
+    """Array of numbers from a list of fields, parsed in bulk
+
+    :num_lines: number of lines the fields came from
+    :raises ValueError: if a field is not a number, or there isn't one value per line
+
+    """
+    values = np.array(fields).astype(dtype)
+    if len(values) != num_lines:
+        raise ValueError("got {} values from {} tree lines".format(len(values), num_lines))
+    return values
+
+def parse_flows(flows):
+    """float64 array from a list of flow fields, parsed in bulk"""
+    return parse_fields(flows, np.float64, len(flows))
+
+def parse_names(names):
+    """int64 array of paper IDs from a list of quoted name fields, parsed in bulk"""
+    return parse_fields(b' '.join(names).replace(b'"', b'').split(), np.int64, len(names))
+
+def read_tree_chunks(fname, blocksize=BLOCKSIZE, start=0, end=None, readahead=True):
+    """Read a tree file as chunks of column arrays
+
+    :fname: filename of the tree file
+    :blocksize: number of bytes read at a time (about one chunk)
+    :start, end: byte range to read (see get_byte_ranges). default: the whole file
+    :readahead: read (and decompress) the next blocks on a background thread while parsing
+    :yields: dict {
+                pid: int64 array of paper IDs,
+                flow: float64 array of flows (ranks),
+                depth: int16 array of the number of levels in each node's path,
+                path: list of tree paths (bytes),
+                module: list of the module each node belongs to: its path without the last level (bytes),
+                }
+
+    """
+    num_fields = None
+    blocks = iter_blocks(fname, blocksize, start, end, readahead)
+    try:
+        while True:
+            with stage('tree_parse') as stats:
+                block = next(blocks, None)
+                if block is None:
+                    break
+                paths, flows, names, num_fields = split_block(block, num_fields)
+                stats.add(bytes=len(block), lines=block.count(b'\n'), nodes=len(paths))
+                if not paths:
+                    continue
+                depth = np.fromiter((path.count(b':') + 1 for path in paths), dtype=np.int16, count=len(paths))
+                modules = [path.rpartition(b':')[0] for path in paths]
+                chunk = {
+                        'pid': parse_names(names),
+                        'flow': parse_flows(flows),
+                        'depth': depth,
+                        'path': paths,
+                        'module': modules,
+                        }
+            # outside the stage, so the caller's work on the chunk isn't counted as parsing
+            yield chunk
+    finally:
+        blocks.close()
+
+def parse_tree_lines(fname):
+    """The per-line parse the analysis scripts used before read_tree_chunks. Kept as the benchmark baseline"""
+    rows = []
+    with open(fname, 'r') as f:
+        for line in f:
+            if line[0] == "#":
+                continue
+            line = line.strip().split(' ')
+            pid = int(line[2].strip('"'))
+            rank = float(line[1])
+            cl = line[0].split(':')
+            rows.append( (pid, rank, len(cl), ":".join(cl[:-1])) )
+    return rows
+
+def benchmark(fname, repeat=3, blocksize=BLOCKSIZE):
+    """Time parse_tree_lines against read_tree_chunks on a tree file
+
+    :returns: dict {name: best time in seconds}, and the number of nodes
+
+    """
+    times = {}
+    num_nodes = 0
+    for name in ['per_line', 'chunks']:
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            if name == 'per_line':
+                num_nodes = len(parse_tree_lines(fname))
+            else:
+                num_nodes = sum(len(chunk['pid']) for chunk in read_tree_chunks(fname, blocksize))
+            took = time.time() - start
+            if best is None or took < best:
+                best = took
+        times[name] = best
+    return times, num_nodes
+
+def compress_tree(fname, outdir, compression):
+    """Write a gzip or zstd compressed copy of a tree file into outdir. returns its filename, or None if zstd is not available"""
+    if compression == 'gzip':
+        outfname = os.path.join(outdir, os.path.basename(fname) + '.gz')
+        with open(fname, 'rb') as f, gzip.open(outfname, 'wb') as outf:
+            for block in iter_range(f, BLOCKSIZE):
+                outf.write(block)
+        return outfname
+    outfname = os.path.join(outdir, os.path.basename(fname) + '.zst')
+    if zstandard is not None:
+        with open(fname, 'rb') as f, open(outfname, 'wb') as outf:
+            zstandard.ZstdCompressor().copy_stream(f, outf)
+        return outfname
+    try:
+        subprocess.check_call(['zstd', '-qf', fname, '-o', outfname])
+    except OSError:
+        return None
+    return outfname
+
+def benchmark_compressed(fname, repeat=3, blocksize=BLOCKSIZE, tmpdir=None):
+    """Time read_tree_chunks on a tree file and on gzip and zstd compressed copies of it,
+    with and without the readahead thread
+
+    :tmpdir: directory for the compressed copies (default: a new temporary directory, removed afterwards)
+    :returns: dict {name: best time in seconds}, and the number of nodes
+
+    """
+    outdir = tmpdir or tempfile.mkdtemp()
+    try:
+        fnames = {'plain': fname}
+        for compression in ['gzip', 'zstd']:
+            compressed_fname = compress_tree(fname, outdir, compression)
+            if compressed_fname is None:
+                logger.warning("zstd is not available (install zstandard or the zstd command). skipping")
+                continue
+            fnames[compression] = compressed_fname
+        times = {}
+        num_nodes = 0
+        for name, this_fname in fnames.items():
+            for readahead in [False, True]:
+                best = None
+                for _ in range(repeat):
+                    start = time.time()
+                    num_nodes = sum(len(chunk['pid']) for chunk in read_tree_chunks(this_fname, blocksize, readahead=readahead))
+                    took = time.time() - start
+                    if best is None or took < best:
+                        best = took
+                times["{}{}".format(name, '_readahead' if readahead else '')] = best
+        return times, num_nodes
+    finally:
+        if tmpdir is None:
+            shutil.rmtree(outdir)
+
+def main(args):
+    if args.compressed:
+        times, num_nodes = benchmark_compressed(args.tree_fname, repeat=args.repeat, blocksize=args.blocksize)
+        for name, took in sorted(times.items()):
+            logger.info("{}: {:.3f} seconds ({:.0f} nodes/sec, {:.2f}x the plain file)".format(name, took, num_nodes / took if took else float('inf'), took / times['plain'] if times['plain'] else float('inf')))
+        return
+    times, num_nodes = benchmark(args.tree_fname, repeat=args.repeat, blocksize=args.blocksize)
+    for name, took in sorted(times.items()):
+        logger.info("{}: {:.3f} seconds ({:.0f} nodes/sec)".format(name, took, num_nodes / took if took else float('inf')))
+    logger.info("speedup: {:.2f}x".format(times['per_line'] / times['chunks'] if times['chunks'] else float('inf')))
+
+if __name__ == "__main__":
+    total_start = time.time()
+    logger.info(" ".join(sys.argv))
+    logger.info( '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now()) )
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the block tree reader against the per-line parse on a .tree file (or, with --compressed, plain against compressed input)")
+    parser.add_argument("tree_fname", type=str, help="input filename (.tree file)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timing runs for each reader (the best is reported)")
+    parser.add_argument("--blocksize", type=int, default=BLOCKSIZE, help="bytes read at a time by the block reader")
+    parser.add_argument("--compressed", action='store_true', help="instead, time the block reader on the file and on gzip and zstd compressed copies of it, with and without readahead")
+    parser.add_argument("--debug", action='store_true', help="output debugging info")
+    global args
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.debug('debug mode is on')
+    main(args)
+    total_end = time.time()
+    logger.info('all finished. total time: {:.2f} seconds'.format(total_end-total_start))